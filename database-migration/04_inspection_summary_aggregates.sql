@@ -0,0 +1,315 @@
+-- Incrementally maintained aggregates behind inspection_complete_summary
+-- The inspection_complete_summary view joins evaluation scores, assessments and
+-- student scores onto every session and aggregates the cross product per query.
+-- These tables keep the same counters up to date from statement-level triggers,
+-- so dashboards read one row per session instead.
+-- inspection_complete_summary stays as the slow reference for reconciliation.
+
+-- Drop existing objects if needed
+DROP VIEW IF EXISTS inspection_complete_summary_fast CASCADE;
+DROP TABLE IF EXISTS inspection_evaluation_totals CASCADE;
+DROP TABLE IF EXISTS assessment_score_totals CASCADE;
+DROP FUNCTION IF EXISTS maintain_evaluation_totals CASCADE;
+DROP FUNCTION IF EXISTS maintain_assessment_totals CASCADE;
+DROP FUNCTION IF EXISTS maintain_assessment_score_totals CASCADE;
+DROP FUNCTION IF EXISTS maintain_inspection_totals CASCADE;
+DROP FUNCTION IF EXISTS rebuild_inspection_summary_totals CASCADE;
+
+-- Evaluation indicator counters per inspection session
+CREATE TABLE inspection_evaluation_totals (
+    inspection_id UUID PRIMARY KEY,
+    indicators_evaluated BIGINT NOT NULL DEFAULT 0,
+    yes_count BIGINT NOT NULL DEFAULT 0,
+    some_practice_count BIGINT NOT NULL DEFAULT 0,
+    no_count BIGINT NOT NULL DEFAULT 0
+);
+
+-- Student score totals per assessment (one row per student_assessment_sessions row)
+CREATE TABLE assessment_score_totals (
+    assessment_id UUID PRIMARY KEY,
+    inspection_session_id UUID,
+    score_sum NUMERIC NOT NULL DEFAULT 0,
+    score_count BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX idx_assessment_score_totals_session ON assessment_score_totals(inspection_session_id);
+
+-- Apply +1/-1 deltas from inspection_evaluation_scores transition tables
+CREATE OR REPLACE FUNCTION maintain_evaluation_totals()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_delta TEXT;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE inspection_evaluation_totals;
+        RETURN NULL;
+    END IF;
+
+    v_delta := CASE TG_OP
+        WHEN 'INSERT' THEN
+            'SELECT inspection_session_id, field_id, score, 1 AS sign FROM new_rows'
+        WHEN 'DELETE' THEN
+            'SELECT inspection_session_id, field_id, score, -1 AS sign FROM old_rows'
+        ELSE
+            'SELECT inspection_session_id, field_id, score, 1 AS sign FROM new_rows
+             UNION ALL
+             SELECT inspection_session_id, field_id, score, -1 AS sign FROM old_rows'
+    END;
+
+    -- Sessions removed in the same statement (cascades) are skipped; their
+    -- totals row is deleted by maintain_inspection_totals()
+    EXECUTE format($sql$
+        INSERT INTO inspection_evaluation_totals AS t
+            (inspection_id, indicators_evaluated, yes_count, some_practice_count, no_count)
+        SELECT
+            d.inspection_session_id,
+            SUM(CASE WHEN d.field_id IS NOT NULL THEN d.sign ELSE 0 END),
+            SUM(CASE WHEN d.field_id IS NOT NULL AND d.score = 'yes' THEN d.sign ELSE 0 END),
+            SUM(CASE WHEN d.field_id IS NOT NULL AND d.score = 'some_practice' THEN d.sign ELSE 0 END),
+            SUM(CASE WHEN d.field_id IS NOT NULL AND d.score = 'no' THEN d.sign ELSE 0 END)
+        FROM (%s) d
+        WHERE EXISTS (SELECT 1 FROM inspection_sessions ins WHERE ins.id = d.inspection_session_id)
+        GROUP BY d.inspection_session_id
+        ON CONFLICT (inspection_id) DO UPDATE
+        SET indicators_evaluated = t.indicators_evaluated + EXCLUDED.indicators_evaluated,
+            yes_count = t.yes_count + EXCLUDED.yes_count,
+            some_practice_count = t.some_practice_count + EXCLUDED.some_practice_count,
+            no_count = t.no_count + EXCLUDED.no_count
+    $sql$, v_delta);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Keep one assessment_score_totals row per student_assessment_sessions row
+CREATE OR REPLACE FUNCTION maintain_assessment_totals()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE assessment_score_totals;
+    ELSIF TG_OP = 'INSERT' THEN
+        INSERT INTO assessment_score_totals (assessment_id, inspection_session_id)
+        SELECT assessment_id, inspection_session_id FROM new_rows
+        ON CONFLICT (assessment_id) DO UPDATE
+        SET inspection_session_id = EXCLUDED.inspection_session_id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE assessment_score_totals t
+        SET inspection_session_id = n.inspection_session_id
+        FROM new_rows n
+        WHERE t.assessment_id = n.assessment_id
+          AND t.inspection_session_id IS DISTINCT FROM n.inspection_session_id;
+    ELSE
+        DELETE FROM assessment_score_totals t
+        USING old_rows o
+        WHERE t.assessment_id = o.assessment_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Apply score sum/count deltas from student_scores transition tables
+CREATE OR REPLACE FUNCTION maintain_assessment_score_totals()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_delta TEXT;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE assessment_score_totals SET score_sum = 0, score_count = 0;
+        RETURN NULL;
+    END IF;
+
+    v_delta := CASE TG_OP
+        WHEN 'INSERT' THEN
+            'SELECT assessment_id, score, 1 AS sign FROM new_rows'
+        WHEN 'DELETE' THEN
+            'SELECT assessment_id, score, -1 AS sign FROM old_rows'
+        ELSE
+            'SELECT assessment_id, score, 1 AS sign FROM new_rows
+             UNION ALL
+             SELECT assessment_id, score, -1 AS sign FROM old_rows'
+    END;
+
+    -- Assessments removed in the same statement (cascades) no longer join
+    EXECUTE format($sql$
+        INSERT INTO assessment_score_totals AS t
+            (assessment_id, inspection_session_id, score_sum, score_count)
+        SELECT
+            d.assessment_id,
+            sas.inspection_session_id,
+            COALESCE(SUM(d.sign * d.score), 0),
+            SUM(CASE WHEN d.score IS NOT NULL THEN d.sign ELSE 0 END)
+        FROM (%s) d
+        JOIN student_assessment_sessions sas ON sas.assessment_id = d.assessment_id
+        GROUP BY d.assessment_id, sas.inspection_session_id
+        ON CONFLICT (assessment_id) DO UPDATE
+        SET score_sum = t.score_sum + EXCLUDED.score_sum,
+            score_count = t.score_count + EXCLUDED.score_count
+    $sql$, v_delta);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Drop evaluation totals of deleted inspection sessions
+CREATE OR REPLACE FUNCTION maintain_inspection_totals()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE inspection_evaluation_totals;
+    ELSE
+        DELETE FROM inspection_evaluation_totals t
+        USING old_rows o
+        WHERE t.inspection_id = o.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level triggers (one per event, as transition tables require)
+CREATE TRIGGER trigger_evaluation_totals_insert
+    AFTER INSERT ON inspection_evaluation_scores
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_evaluation_totals();
+CREATE TRIGGER trigger_evaluation_totals_update
+    AFTER UPDATE ON inspection_evaluation_scores
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_evaluation_totals();
+CREATE TRIGGER trigger_evaluation_totals_delete
+    AFTER DELETE ON inspection_evaluation_scores
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_evaluation_totals();
+CREATE TRIGGER trigger_evaluation_totals_truncate
+    AFTER TRUNCATE ON inspection_evaluation_scores
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_evaluation_totals();
+
+CREATE TRIGGER trigger_assessment_totals_insert
+    AFTER INSERT ON student_assessment_sessions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_assessment_totals();
+CREATE TRIGGER trigger_assessment_totals_update
+    AFTER UPDATE ON student_assessment_sessions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_assessment_totals();
+CREATE TRIGGER trigger_assessment_totals_delete
+    AFTER DELETE ON student_assessment_sessions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_assessment_totals();
+CREATE TRIGGER trigger_assessment_totals_truncate
+    AFTER TRUNCATE ON student_assessment_sessions
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_assessment_totals();
+
+CREATE TRIGGER trigger_score_totals_insert
+    AFTER INSERT ON student_scores
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_assessment_score_totals();
+CREATE TRIGGER trigger_score_totals_update
+    AFTER UPDATE ON student_scores
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_assessment_score_totals();
+CREATE TRIGGER trigger_score_totals_delete
+    AFTER DELETE ON student_scores
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_assessment_score_totals();
+CREATE TRIGGER trigger_score_totals_truncate
+    AFTER TRUNCATE ON student_scores
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_assessment_score_totals();
+
+CREATE TRIGGER trigger_inspection_totals_delete
+    AFTER DELETE ON inspection_sessions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_inspection_totals();
+CREATE TRIGGER trigger_inspection_totals_truncate
+    AFTER TRUNCATE ON inspection_sessions
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_inspection_totals();
+
+-- Recompute totals from the source tables, for all sessions or only the given ones
+CREATE OR REPLACE FUNCTION rebuild_inspection_summary_totals(p_inspection_ids UUID[] DEFAULT NULL)
+RETURNS VOID AS $$
+BEGIN
+    -- Block writers to the source tables so the rebuilt counters are consistent
+    LOCK TABLE inspection_evaluation_scores, student_assessment_sessions, student_scores IN SHARE MODE;
+
+    DELETE FROM inspection_evaluation_totals
+    WHERE p_inspection_ids IS NULL OR inspection_id = ANY(p_inspection_ids);
+
+    DELETE FROM assessment_score_totals
+    WHERE p_inspection_ids IS NULL OR inspection_session_id = ANY(p_inspection_ids);
+
+    INSERT INTO inspection_evaluation_totals
+        (inspection_id, indicators_evaluated, yes_count, some_practice_count, no_count)
+    SELECT
+        ies.inspection_session_id,
+        COUNT(DISTINCT ies.field_id),
+        COUNT(DISTINCT ies.field_id) FILTER (WHERE ies.score = 'yes'),
+        COUNT(DISTINCT ies.field_id) FILTER (WHERE ies.score = 'some_practice'),
+        COUNT(DISTINCT ies.field_id) FILTER (WHERE ies.score = 'no')
+    FROM inspection_evaluation_scores ies
+    JOIN inspection_sessions ins ON ins.id = ies.inspection_session_id
+    WHERE p_inspection_ids IS NULL OR ies.inspection_session_id = ANY(p_inspection_ids)
+    GROUP BY ies.inspection_session_id;
+
+    INSERT INTO assessment_score_totals
+        (assessment_id, inspection_session_id, score_sum, score_count)
+    SELECT
+        sas.assessment_id,
+        sas.inspection_session_id,
+        COALESCE(SUM(sc.score), 0),
+        COUNT(sc.score)
+    FROM student_assessment_sessions sas
+    LEFT JOIN student_scores sc ON sc.assessment_id = sas.assessment_id
+    WHERE p_inspection_ids IS NULL OR sas.inspection_session_id = ANY(p_inspection_ids)
+    GROUP BY sas.assessment_id, sas.inspection_session_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Same columns as inspection_complete_summary, read from the maintained totals
+CREATE VIEW inspection_complete_summary_fast AS
+SELECT
+    -- Inspection session info
+    ins.id as inspection_id,
+    ins.inspection_date,
+    ins.province,
+    ins.district,
+    ins.commune,
+    ins.school,
+    ins.name_of_teacher,
+    ins.sex as teacher_gender,
+    ins.employment_type,
+    ins.grade,
+    ins.subject,
+    ins.level as evaluation_level,
+    ins.total_students,
+    ins.total_present,
+    ins.total_absent,
+    ROUND((ins.total_present::decimal / NULLIF(ins.total_students, 0)) * 100, 2) as attendance_rate,
+
+    -- Evaluation scores summary
+    COALESCE(et.indicators_evaluated, 0) as indicators_evaluated,
+    COALESCE(et.yes_count, 0) as yes_count,
+    COALESCE(et.some_practice_count, 0) as some_practice_count,
+    COALESCE(et.no_count, 0) as no_count,
+
+    -- Student assessment summary
+    COALESCE(ast.assessments_conducted, 0) as assessments_conducted,
+    ast.avg_student_score
+
+FROM inspection_sessions ins
+LEFT JOIN inspection_evaluation_totals et ON et.inspection_id = ins.id
+LEFT JOIN (
+    SELECT
+        inspection_session_id,
+        COUNT(*) as assessments_conducted,
+        SUM(score_sum) / NULLIF(SUM(score_count), 0) as avg_student_score
+    FROM assessment_score_totals
+    GROUP BY inspection_session_id
+) ast ON ast.inspection_session_id = ins.id
+WHERE ins.is_active = true;
+
+-- Populate from any data already present
+SELECT rebuild_inspection_summary_totals();
+
+-- Add comments for documentation
+COMMENT ON TABLE inspection_evaluation_totals IS 'Per-session evaluation indicator counters maintained by triggers on inspection_evaluation_scores';
+COMMENT ON TABLE assessment_score_totals IS 'Per-assessment student score sum/count maintained by triggers on student_assessment_sessions and student_scores';
+COMMENT ON VIEW inspection_complete_summary_fast IS 'inspection_complete_summary computed from maintained totals; the original view is the reference path';
+COMMENT ON FUNCTION rebuild_inspection_summary_totals(UUID[]) IS 'Recompute summary totals from source tables (all sessions when called without arguments)';
@@ -0,0 +1,353 @@
+-- Range-partitioned inspection_sessions (one partition per calendar year of inspection_date)
+-- Date-bounded reports prune to the partitions they need, and old years can be
+-- detached without rewriting the table.
+--
+-- This file only prepares inspection_sessions_partitioned next to the existing
+-- table. repartition.py mirrors new writes into it, copies existing rows in
+-- throttled batches and finally swaps the two tables with
+-- swap_partitioned_inspection_sessions().
+--
+-- A partitioned table's primary key must include the partition key, so it
+-- becomes (id, inspection_date) and foreign keys can no longer reference id
+-- alone. After the swap, the REFERENCES inspection_sessions(id) ON DELETE
+-- CASCADE constraints of the dependent tables are replaced by the triggers
+-- defined below.
+
+-- Drop leftovers of an earlier, unfinished repartition. run_migrations()
+-- reapplies this step whenever an earlier step is reapplied, so nothing is
+-- dropped once the swap has happened: inspection_sessions_unpartitioned is the
+-- only rollback copy and is never dropped here, only by hand.
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'inspection_sessions'::regclass) = 'p' THEN
+        RAISE NOTICE 'inspection_sessions is already partitioned; keeping the repartition tables';
+        RETURN;
+    END IF;
+    IF to_regclass('inspection_sessions_repartition') IS NOT NULL THEN
+        IF EXISTS (SELECT 1 FROM inspection_sessions_repartition WHERE swapped_at IS NOT NULL) THEN
+            RAISE NOTICE 'inspection_sessions was swapped already; keeping the repartition tables';
+            RETURN;
+        END IF;
+    END IF;
+    DROP TABLE IF EXISTS inspection_sessions_partitioned CASCADE;
+    DROP TABLE IF EXISTS inspection_sessions_repartition;
+END;
+$$;
+
+-- inspection_complete_summary (create_helper_functions) groups by ins.id alone,
+-- which only covers the other columns while id is the whole primary key.
+-- Group by (id, inspection_date) so the view survives the swap unchanged.
+CREATE OR REPLACE VIEW inspection_complete_summary AS
+SELECT 
+    -- Inspection session info
+    ins.id as inspection_id,
+    ins.inspection_date,
+    ins.province,
+    ins.district,
+    ins.commune,
+    ins.school,
+    ins.name_of_teacher,
+    ins.sex as teacher_gender,
+    ins.employment_type,
+    ins.grade,
+    ins.subject,
+    ins.level as evaluation_level,
+    ins.total_students,
+    ins.total_present,
+    ins.total_absent,
+    ROUND((ins.total_present::decimal / NULLIF(ins.total_students, 0)) * 100, 2) as attendance_rate,
+    
+    -- Evaluation scores summary
+    COUNT(DISTINCT ies.field_id) as indicators_evaluated,
+    COUNT(DISTINCT ies.field_id) FILTER (WHERE ies.score = 'yes') as yes_count,
+    COUNT(DISTINCT ies.field_id) FILTER (WHERE ies.score = 'some_practice') as some_practice_count,
+    COUNT(DISTINCT ies.field_id) FILTER (WHERE ies.score = 'no') as no_count,
+    
+    -- Student assessment summary
+    COUNT(DISTINCT sas.assessment_id) as assessments_conducted,
+    AVG(sc.score) as avg_student_score
+    
+FROM inspection_sessions ins
+LEFT JOIN inspection_evaluation_scores ies ON ies.inspection_session_id = ins.id
+LEFT JOIN student_assessment_sessions sas ON sas.inspection_session_id = ins.id
+LEFT JOIN student_scores sc ON sc.assessment_id = sas.assessment_id
+WHERE ins.is_active = true
+GROUP BY ins.id, ins.inspection_date;
+
+-- Create yearly partitions of p_parent for p_from_year..p_to_year (existing ones are kept)
+CREATE OR REPLACE FUNCTION create_inspection_sessions_partitions(
+    p_parent REGCLASS,
+    p_from_year INTEGER,
+    p_to_year INTEGER
+)
+RETURNS INTEGER AS $$
+DECLARE
+    v_year INTEGER;
+    v_partition TEXT;
+    v_created INTEGER := 0;
+BEGIN
+    FOR v_year IN p_from_year..p_to_year LOOP
+        v_partition := format('inspection_sessions_y%s', v_year);
+        IF to_regclass(v_partition) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+                v_partition, p_parent, make_date(v_year, 1, 1), make_date(v_year + 1, 1, 1)
+            );
+            v_created := v_created + 1;
+        END IF;
+    END LOOP;
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replaces REFERENCES inspection_sessions(id) on the dependent tables after the swap
+CREATE OR REPLACE FUNCTION check_inspection_session_reference()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_missing UUID;
+BEGIN
+    -- Lock the referenced sessions as a foreign key check would
+    PERFORM 1 FROM inspection_sessions ins
+    WHERE ins.id IN (SELECT n.inspection_session_id FROM new_rows n)
+    FOR KEY SHARE;
+
+    SELECT n.inspection_session_id INTO v_missing
+    FROM new_rows n
+    WHERE n.inspection_session_id IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM inspection_sessions ins WHERE ins.id = n.inspection_session_id)
+    LIMIT 1;
+
+    IF v_missing IS NOT NULL THEN
+        RAISE EXCEPTION 'insert or update on table "%" violates reference to inspection_sessions', TG_TABLE_NAME
+            USING ERRCODE = 'foreign_key_violation',
+                  DETAIL = format('Key (inspection_session_id)=(%s) is not present in table "inspection_sessions".', v_missing);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replaces ON DELETE CASCADE; the dependent tables are passed as trigger arguments
+CREATE OR REPLACE FUNCTION cascade_inspection_session_delete()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_table TEXT;
+BEGIN
+    FOREACH v_table IN ARRAY TG_ARGV LOOP
+        IF TG_OP = 'TRUNCATE' THEN
+            EXECUTE format('TRUNCATE %I CASCADE', v_table);
+        ELSE
+            -- id is only unique together with inspection_date: keep children of ids still present
+            EXECUTE format($sql$
+                DELETE FROM %I c
+                USING old_rows o
+                WHERE c.inspection_session_id = o.id
+                  AND NOT EXISTS (SELECT 1 FROM inspection_sessions ins WHERE ins.id = o.id)
+            $sql$, v_table);
+        END IF;
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create the partitioned table, its partitions and indexes, the mirror trigger
+-- function and the progress table (skipped once inspection_sessions is partitioned or swapped)
+DO $$
+DECLARE
+    v_columns TEXT;
+    v_values TEXT;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'inspection_sessions'::regclass) = 'p' THEN
+        RAISE NOTICE 'inspection_sessions is already partitioned';
+        RETURN;
+    END IF;
+    IF to_regclass('inspection_sessions_repartition') IS NOT NULL THEN
+        RAISE NOTICE 'inspection_sessions_repartition records a swap; drop it by hand to repartition again';
+        RETURN;
+    END IF;
+
+    CREATE TABLE inspection_sessions_partitioned (
+        LIKE inspection_sessions
+        INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED INCLUDING COMMENTS
+    ) PARTITION BY RANGE (inspection_date);
+
+    ALTER TABLE inspection_sessions_partitioned ADD PRIMARY KEY (id, inspection_date);
+
+    -- Catches mistyped dates outside the yearly partitions
+    CREATE TABLE inspection_sessions_default PARTITION OF inspection_sessions_partitioned DEFAULT;
+    PERFORM create_inspection_sessions_partitions(
+        'inspection_sessions_partitioned', 2020, EXTRACT(YEAR FROM CURRENT_DATE)::integer + 1
+    );
+
+    -- Partial indexes matching the is_active = true filter of every view and report
+    CREATE INDEX idx_inspection_sessions_part_date ON inspection_sessions_partitioned(inspection_date)
+        WHERE is_active = true;
+    CREATE INDEX idx_inspection_sessions_part_location ON inspection_sessions_partitioned(province, district, commune)
+        WHERE is_active = true;
+    CREATE INDEX idx_inspection_sessions_part_teacher_date ON inspection_sessions_partitioned(name_of_teacher, inspection_date);
+    CREATE INDEX idx_inspection_sessions_part_school_date ON inspection_sessions_partitioned(school, inspection_date);
+
+    COMMENT ON TABLE inspection_sessions_partitioned IS 'Main table storing teacher evaluation/inspection session data, partitioned by inspection_date';
+
+    -- Generated columns cannot be inserted, so the mirror copies every other column
+    SELECT
+        string_agg(quote_ident(attname), ', ' ORDER BY attnum),
+        string_agg('NEW.' || quote_ident(attname), ', ' ORDER BY attnum)
+    INTO v_columns, v_values
+    FROM pg_attribute
+    WHERE attrelid = 'inspection_sessions'::regclass
+      AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+
+    EXECUTE format($fn$
+        CREATE OR REPLACE FUNCTION mirror_inspection_sessions()
+        RETURNS TRIGGER AS $body$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM inspection_sessions_partitioned
+                WHERE id = OLD.id AND inspection_date = OLD.inspection_date;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO inspection_sessions_partitioned (%s) VALUES (%s);
+            END IF;
+            RETURN NULL;
+        END;
+        $body$ LANGUAGE plpgsql;
+    $fn$, v_columns, v_values);
+
+    -- Keyset position of repartition.py's backfill
+    CREATE TABLE inspection_sessions_repartition (
+        id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        last_id UUID,
+        rows_copied BIGINT NOT NULL DEFAULT 0,
+        batches INTEGER NOT NULL DEFAULT 0,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        swapped_at TIMESTAMP
+    );
+    INSERT INTO inspection_sessions_repartition DEFAULT VALUES;
+END;
+$$;
+
+-- Swap the backfilled partitioned table in for inspection_sessions
+-- Runs in one transaction under ACCESS EXCLUSIVE locks; the old table is kept
+-- as inspection_sessions_unpartitioned until it is dropped by hand.
+CREATE OR REPLACE FUNCTION swap_partitioned_inspection_sessions()
+RETURNS TEXT AS $$
+DECLARE
+    v_old_count BIGINT;
+    v_new_count BIGINT;
+    v_views TEXT[];
+    v_triggers TEXT[];
+    v_children TEXT[] := '{}';
+    v_statement TEXT;
+    v_fk RECORD;
+BEGIN
+    IF to_regclass('inspection_sessions_partitioned') IS NULL THEN
+        RAISE EXCEPTION 'inspection_sessions_partitioned does not exist (already swapped?)';
+    END IF;
+
+    LOCK TABLE inspection_sessions, inspection_sessions_partitioned IN ACCESS EXCLUSIVE MODE;
+
+    SELECT COUNT(*) INTO v_old_count FROM inspection_sessions;
+    SELECT COUNT(*) INTO v_new_count FROM inspection_sessions_partitioned;
+    IF v_old_count <> v_new_count THEN
+        RAISE EXCEPTION 'inspection_sessions has % rows but only % were copied; finish the backfill first',
+            v_old_count, v_new_count;
+    END IF;
+
+    -- Views bind to the table, not its name: capture them (dependencies first) to recreate after the rename
+    WITH RECURSIVE dependents(view_oid, depth) AS (
+        SELECT DISTINCT r.ev_class, 1
+        FROM pg_depend d
+        JOIN pg_rewrite r ON r.oid = d.objid
+        WHERE d.refobjid = 'inspection_sessions'::regclass AND r.ev_class <> d.refobjid
+        UNION
+        SELECT r.ev_class, dependents.depth + 1
+        FROM dependents
+        JOIN pg_depend d ON d.refobjid = dependents.view_oid
+        JOIN pg_rewrite r ON r.oid = d.objid
+        WHERE r.ev_class <> dependents.view_oid
+    )
+    SELECT COALESCE(array_agg(
+        format('CREATE OR REPLACE VIEW %s AS %s', v.view_oid::regclass, pg_get_viewdef(v.view_oid))
+        ORDER BY v.depth
+    ), '{}')
+    INTO v_views
+    FROM (SELECT view_oid, MAX(depth) AS depth FROM dependents GROUP BY view_oid) v
+    JOIN pg_class c ON c.oid = v.view_oid AND c.relkind = 'v';
+
+    -- Triggers move to the new table (the mirror trigger is dropped with the old one's)
+    SELECT COALESCE(array_agg(pg_get_triggerdef(t.oid) ORDER BY t.tgname), '{}')
+    INTO v_triggers
+    FROM pg_trigger t
+    WHERE t.tgrelid = 'inspection_sessions'::regclass
+      AND NOT t.tgisinternal
+      AND t.tgname <> 'trigger_mirror_inspection_sessions';
+
+    FOR v_statement IN
+        SELECT t.tgname FROM pg_trigger t
+        WHERE t.tgrelid = 'inspection_sessions'::regclass AND NOT t.tgisinternal
+    LOOP
+        EXECUTE format('DROP TRIGGER %I ON inspection_sessions', v_statement);
+    END LOOP;
+
+    -- Foreign keys to inspection_sessions(id) become reference-check triggers
+    FOR v_fk IN
+        SELECT con.conrelid::regclass AS child, con.conname, a.attname
+        FROM pg_constraint con
+        JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = con.conkey[1]
+        WHERE con.contype = 'f' AND con.confrelid = 'inspection_sessions'::regclass
+    LOOP
+        IF v_fk.attname <> 'inspection_session_id' THEN
+            RAISE EXCEPTION '% references inspection_sessions through %, expected inspection_session_id',
+                v_fk.child, v_fk.attname;
+        END IF;
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', v_fk.child, v_fk.conname);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER INSERT ON %s REFERENCING NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION check_inspection_session_reference()',
+            'trigger_' || v_fk.child || '_session_ref_insert', v_fk.child
+        );
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER UPDATE ON %s REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION check_inspection_session_reference()',
+            'trigger_' || v_fk.child || '_session_ref_update', v_fk.child
+        );
+        v_children := v_children || v_fk.child::text;
+    END LOOP;
+
+    ALTER TABLE inspection_sessions RENAME TO inspection_sessions_unpartitioned;
+    ALTER TABLE inspection_sessions_partitioned RENAME TO inspection_sessions;
+
+    FOREACH v_statement IN ARRAY v_triggers LOOP
+        EXECUTE v_statement;
+    END LOOP;
+
+    -- Named to fire before trigger_inspection_totals_delete, as the foreign key cascade did
+    IF array_length(v_children, 1) > 0 THEN
+        EXECUTE format(
+            'CREATE TRIGGER trigger_inspection_cascade_delete AFTER DELETE ON inspection_sessions '
+            'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT '
+            'EXECUTE FUNCTION cascade_inspection_session_delete(%s)',
+            (SELECT string_agg(quote_literal(c), ', ') FROM unnest(v_children) c)
+        );
+        EXECUTE format(
+            'CREATE TRIGGER trigger_inspection_cascade_truncate AFTER TRUNCATE ON inspection_sessions '
+            'FOR EACH STATEMENT EXECUTE FUNCTION cascade_inspection_session_delete(%s)',
+            (SELECT string_agg(quote_literal(c), ', ') FROM unnest(v_children) c)
+        );
+    END IF;
+
+    FOREACH v_statement IN ARRAY v_views LOOP
+        EXECUTE v_statement;
+    END LOOP;
+
+    UPDATE inspection_sessions_repartition SET swapped_at = CURRENT_TIMESTAMP;
+
+    RETURN format(
+        'swapped %s rows; recreated %s view(s) and %s trigger(s); %s reference(s) now enforced by triggers',
+        v_new_count, array_length(v_views, 1), array_length(v_triggers, 1), array_length(v_children, 1)
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION swap_partitioned_inspection_sessions() IS 'Swap the backfilled inspection_sessions_partitioned in for inspection_sessions (run through repartition.py swap)';
@@ -0,0 +1,218 @@
+-- Trigram search indexes for school, teacher and indicator lookup
+-- The search functions filter with column ILIKE '%' || term || '%'. A leading
+-- wildcard cannot use a btree index, so every search scans inspection_sessions.
+-- pg_trgm (enabled in 00_enable_extensions.sql) GIN indexes answer these
+-- substring searches from the index instead.
+--
+-- Khmer: pg_trgm only builds trigrams from characters the database locale
+-- classifies as letters. Under the C/C.UTF-8 locales used by most servers no
+-- Khmer character qualifies, so a Khmer search term yields no trigrams and the
+-- index cannot narrow the search. The indexes are therefore built on
+-- search_key(column), which spells each Khmer character as two ASCII letters.
+-- Substrings stay substrings, so
+--     search_key(column) LIKE '%' || search_key(term) || '%'
+-- holds whenever column ILIKE '%' || term || '%' does, and the functions below
+-- keep their ILIKE as the exact check on the rows the index returns.
+
+-- The indexes need pg_trgm's GIN operator class. Stop with a clear message when
+-- the installed pg_trgm does not provide it rather than half-applying the step.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_opclass WHERE opcname = 'gin_trgm_ops') THEN
+        RAISE EXCEPTION 'pg_trgm does not provide the gin_trgm_ops operator class'
+            USING HINT = 'Install the PostgreSQL contrib package for this server version, then DROP EXTENSION pg_trgm; CREATE EXTENSION pg_trgm;';
+    END IF;
+END;
+$$;
+
+-- Re-applying the step (e.g. when an earlier step is re-applied) replaces the
+-- functions in place and keeps the indexes: nothing is dropped, so neither the
+-- objects depending on these functions nor the GIN indexes are rebuilt under a
+-- blocking lock. A change to search_key() or to an index definition therefore
+-- needs a new step that rebuilds the indexes (under a new name or REINDEX).
+
+-- Lower-cased text without the invisible characters Khmer text carries between
+-- words (zero-width space/non-joiner/joiner, BOM, inherent vowels U+17B4/U+17B5)
+CREATE OR REPLACE FUNCTION search_text(p_text TEXT)
+RETURNS TEXT AS $$
+    SELECT lower(translate(p_text, E'\u200B\u200C\u200D\uFEFF\u17B4\u17B5', ''));
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+-- search_text() with every Khmer character (U+1780-U+17FF) spelled as two
+-- ASCII letters: a-p for the high bits, q-x for the low three bits
+CREATE OR REPLACE FUNCTION search_key(p_text TEXT)
+RETURNS TEXT AS $$
+    SELECT CASE WHEN t !~ '[\u1780-\u17FF]' THEN t ELSE (
+        SELECT string_agg(
+            CASE WHEN ascii(c) BETWEEN 6016 AND 6143
+                THEN chr(97 + (ascii(c) - 6016) / 8) || chr(113 + (ascii(c) - 6016) % 8)
+                ELSE c
+            END, '' ORDER BY position)
+        FROM unnest(string_to_array(t, NULL)) WITH ORDINALITY AS chars(c, position)
+    ) END
+    FROM search_text(p_text) AS t;
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+-- All searchable indicator text of a master_fields row
+CREATE OR REPLACE FUNCTION indicator_search_document(
+    p_main TEXT, p_main_en TEXT, p_sub TEXT, p_sub_en TEXT
+)
+RETURNS TEXT AS $$
+    SELECT search_key(
+        COALESCE(p_main, '') || ' ' || COALESCE(p_main_en, '') || ' ' ||
+        COALESCE(p_sub, '') || ' ' || COALESCE(p_sub_en, '')
+    );
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Trigram indexes (every search filters on is_active = true)
+CREATE INDEX IF NOT EXISTS idx_inspection_sessions_school_trgm ON inspection_sessions
+    USING GIN (search_key(school) gin_trgm_ops) WHERE is_active = true;
+CREATE INDEX IF NOT EXISTS idx_inspection_sessions_teacher_trgm ON inspection_sessions
+    USING GIN (search_key(name_of_teacher) gin_trgm_ops) WHERE is_active = true;
+CREATE INDEX IF NOT EXISTS idx_master_fields_search_trgm ON master_fields
+    USING GIN (indicator_search_document(indicator_main, indicator_main_en, indicator_sub, indicator_sub_en) gin_trgm_ops)
+    WHERE is_active = true;
+
+-- The partitioned table prepared by 05 gets the same indexes before it is swapped in
+DO $$
+BEGIN
+    IF to_regclass('inspection_sessions_partitioned') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS idx_inspection_sessions_part_school_trgm ON inspection_sessions_partitioned
+            USING GIN (search_key(school) gin_trgm_ops) WHERE is_active = true;
+        CREATE INDEX IF NOT EXISTS idx_inspection_sessions_part_teacher_trgm ON inspection_sessions_partitioned
+            USING GIN (search_key(name_of_teacher) gin_trgm_ops) WHERE is_active = true;
+    END IF;
+END;
+$$;
+
+-- Search functions: the search_key() condition uses the index, the ILIKE keeps the original result
+CREATE OR REPLACE FUNCTION get_teacher_inspection_history(p_teacher_name VARCHAR)
+RETURNS TABLE (
+    session_id UUID,
+    inspection_date DATE,
+    school VARCHAR,
+    subject VARCHAR,
+    grade INTEGER,
+    total_students INTEGER,
+    attendance_rate DECIMAL,
+    level INTEGER,
+    inspector_name VARCHAR
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        ins.id,
+        ins.inspection_date,
+        ins.school,
+        ins.subject,
+        ins.grade,
+        ins.total_students,
+        CASE
+            WHEN ins.total_students > 0 THEN
+                ROUND((ins.total_present::decimal / ins.total_students) * 100, 2)
+            ELSE 0
+        END as attendance_rate,
+        ins.level,
+        ins.inspector_name
+    FROM inspection_sessions ins
+    WHERE ins.is_active = true
+      AND (strpos(p_teacher_name, '_') > 0
+           OR search_key(ins.name_of_teacher) LIKE '%' || search_key(p_teacher_name) || '%')
+      AND ins.name_of_teacher ILIKE '%' || p_teacher_name || '%'
+    ORDER BY ins.inspection_date DESC;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION get_assessment_summary(
+    p_school VARCHAR DEFAULT NULL,
+    p_teacher VARCHAR DEFAULT NULL,
+    p_start_date DATE DEFAULT NULL,
+    p_end_date DATE DEFAULT NULL
+)
+RETURNS TABLE (
+    inspection_date DATE,
+    school VARCHAR,
+    teacher_name VARCHAR,
+    grade INTEGER,
+    subject VARCHAR,
+    num_students_assessed BIGINT,
+    avg_score DECIMAL,
+    min_score DECIMAL,
+    max_score DECIMAL,
+    subjects_assessed TEXT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        ins.inspection_date,
+        ins.school,
+        ins.name_of_teacher,
+        ins.grade,
+        ins.subject,
+        COUNT(DISTINCT ast.student_id) as num_students_assessed,
+        ROUND(AVG(sc.score), 2) as avg_score,
+        MIN(sc.score) as min_score,
+        MAX(sc.score) as max_score,
+        STRING_AGG(DISTINCT asub.subject_name_km, ', ') as subjects_assessed
+    FROM inspection_sessions ins
+    JOIN student_assessment_sessions sas ON sas.inspection_session_id = ins.id
+    JOIN assessment_students ast ON ast.assessment_id = sas.assessment_id
+    JOIN assessment_subjects asub ON asub.assessment_id = sas.assessment_id
+    LEFT JOIN student_scores sc ON sc.assessment_id = sas.assessment_id
+        AND sc.student_id = ast.student_id
+    WHERE ins.is_active = true
+      AND sas.is_active = true
+      AND (p_school IS NULL OR strpos(p_school, '_') > 0
+           OR search_key(ins.school) LIKE '%' || search_key(p_school) || '%')
+      AND (p_school IS NULL OR ins.school ILIKE '%' || p_school || '%')
+      AND (p_teacher IS NULL OR strpos(p_teacher, '_') > 0
+           OR search_key(ins.name_of_teacher) LIKE '%' || search_key(p_teacher) || '%')
+      AND (p_teacher IS NULL OR ins.name_of_teacher ILIKE '%' || p_teacher || '%')
+      AND (p_start_date IS NULL OR ins.inspection_date >= p_start_date)
+      AND (p_end_date IS NULL OR ins.inspection_date <= p_end_date)
+    GROUP BY
+        ins.inspection_date,
+        ins.school,
+        ins.name_of_teacher,
+        ins.grade,
+        ins.subject
+    ORDER BY ins.inspection_date DESC;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION search_indicators(p_search_term TEXT)
+RETURNS TABLE (
+    field_id INTEGER,
+    sequence INTEGER,
+    main_indicator_km VARCHAR(100),
+    main_indicator_en VARCHAR(200),
+    sub_indicator_km TEXT,
+    sub_indicator_en TEXT,
+    evaluation_level INTEGER
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        mf.field_id,
+        mf.indicator_sequence,
+        mf.indicator_main,
+        mf.indicator_main_en,
+        mf.indicator_sub,
+        mf.indicator_sub_en,
+        mf.evaluation_level
+    FROM master_fields mf
+    WHERE mf.is_active = true
+      AND (strpos(p_search_term, '_') > 0
+           OR indicator_search_document(mf.indicator_main, mf.indicator_main_en, mf.indicator_sub, mf.indicator_sub_en)
+              LIKE '%' || search_key(p_search_term) || '%')
+      AND (
+        mf.indicator_main ILIKE '%' || p_search_term || '%' OR
+        mf.indicator_main_en ILIKE '%' || p_search_term || '%' OR
+        mf.indicator_sub ILIKE '%' || p_search_term || '%' OR
+        mf.indicator_sub_en ILIKE '%' || p_search_term || '%'
+      )
+    ORDER BY mf.indicator_sequence;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION search_key(TEXT) IS 'Trigram index key: lower-cased, invisible characters removed, Khmer spelled in ASCII';
@@ -0,0 +1,32 @@
+-- Change notifications for master_fields
+-- indicator_catalogue.py keeps the evaluation indicators in memory and reloads
+-- them when it receives a notification on the master_fields_changed channel.
+-- NOTIFY is delivered on commit only, so a rolled back edit never invalidates
+-- a cache, and readers that reload see the committed rows.
+
+DROP TRIGGER IF EXISTS trigger_notify_master_fields_changed ON master_fields;
+DROP FUNCTION IF EXISTS notify_master_fields_changed CASCADE;
+
+-- The existing BEFORE UPDATE trigger also announces the edited field_id
+CREATE OR REPLACE FUNCTION update_master_fields_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    PERFORM pg_notify('master_fields_changed', NEW.field_id::text);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+-- Inserts, deletes and truncates change the catalogue as a whole
+CREATE OR REPLACE FUNCTION notify_master_fields_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('master_fields_changed', lower(TG_OP));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_notify_master_fields_changed
+    AFTER INSERT OR DELETE OR TRUNCATE ON master_fields
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_master_fields_changed();
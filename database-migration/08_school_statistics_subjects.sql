@@ -0,0 +1,38 @@
+-- get_school_statistics() with a working subjects_taught column
+-- The function returns subjects_taught TEXT[], but ARRAY_AGG over the VARCHAR
+-- subject column returns VARCHAR[], so every call failed with "structure of
+-- query does not match function result type". The array is cast to TEXT[].
+-- The school filter is the plain ILIKE of 01_inspection_sessions.sql, so this
+-- step does not depend on 06_search_indexes.sql (search_key()) and applies on
+-- servers where 06 cannot.
+
+CREATE OR REPLACE FUNCTION get_school_statistics(p_school_name VARCHAR)
+RETURNS TABLE (
+    total_inspections BIGINT,
+    unique_teachers BIGINT,
+    avg_class_size DECIMAL,
+    avg_attendance_rate DECIMAL,
+    subjects_taught TEXT[],
+    grades_covered INTEGER[],
+    latest_inspection DATE,
+    employment_distribution JSONB
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        COUNT(*) as total_inspections,
+        COUNT(DISTINCT ins.name_of_teacher) as unique_teachers,
+        ROUND(AVG(ins.total_students), 2) as avg_class_size,
+        ROUND(AVG(CASE WHEN ins.total_students > 0 THEN (ins.total_present::decimal / ins.total_students) * 100 ELSE 0 END), 2) as avg_attendance_rate,
+        ARRAY_AGG(DISTINCT ins.subject)::TEXT[] as subjects_taught,
+        ARRAY_AGG(DISTINCT ins.grade ORDER BY ins.grade) as grades_covered,
+        MAX(ins.inspection_date) as latest_inspection,
+        jsonb_build_object(
+            'official', COUNT(*) FILTER (WHERE ins.employment_type = 'official'),
+            'contract', COUNT(*) FILTER (WHERE ins.employment_type = 'contract')
+        ) as employment_distribution
+    FROM inspection_sessions ins
+    WHERE ins.is_active = true
+      AND ins.school ILIKE '%' || p_school_name || '%';
+END;
+$$ LANGUAGE plpgsql;
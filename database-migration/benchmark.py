@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Benchmark the reporting functions and views at national scale
+
+Builds the schema through run_migration.py on a local PostgreSQL database. It
+then grows the data set with synthetic inspection forms (skewed across
+provinces, districts and schools, with evaluation and student score matrices)
+in steps such as 10k, 100k and 1M sessions. At each scale every reporting
+function and view is timed and the report is written as JSON.
+
+Scales are cumulative: each scale only adds the sessions missing to reach it,
+so a rerun against the same database continues where the last one stopped.
+
+Usage:
+    python3 benchmark.py --dsn "dbname=plp_456_bench" --scales 10000,100000 --output bench.json
+"""
+
+import sys
+import json
+import math
+import time
+import random
+import itertools
+import argparse
+import logging
+from datetime import date, timedelta, datetime, timezone
+
+from run_migration import connect, run_migrations
+from bulk_import import SESSION_COLUMNS, bulk_import
+
+# Provinces with a rough weight for their share of schools
+PROVINCES = [
+    ('Phnom Penh', 14), ('Siem Reap', 8), ('Battambang', 8), ('Kampong Cham', 8),
+    ('Prey Veng', 7), ('Kandal', 7), ('Takeo', 6), ('Banteay Meanchey', 5),
+    ('Kampong Speu', 5), ('Kampong Thom', 4), ('Tbong Khmum', 4), ('Svay Rieng', 4),
+    ('Kampot', 4), ('Pursat', 3), ('Kampong Chhnang', 3), ('Preah Vihear', 2),
+    ('Oddar Meanchey', 2), ('Kratie', 2), ('Pailin', 1), ('Kep', 1),
+    ('Koh Kong', 1), ('Mondulkiri', 1), ('Ratanakiri', 1), ('Stung Treng', 1),
+    ('Preah Sihanouk', 1)
+]
+
+SUBJECTS = ['Khmer', 'Mathematics', 'Science', 'Social Studies', 'Physical Education']
+
+ASSESSMENT_SUBJECTS = [
+    {'name_km': 'អំណាន', 'name_en': 'Reading', 'order': 1},
+    {'name_km': 'សរសេរ', 'name_en': 'Writing', 'order': 2},
+    {'name_km': 'តារាងគុណ', 'name_en': 'Multiplication', 'order': 3}
+]
+
+# Indicators evaluated per level (field_id ranges from 02_master_fields.sql)
+LEVEL_INDICATORS = {1: range(1, 6), 2: range(1, 14), 3: range(1, 23)}
+
+SCORE_WEIGHTS = [('yes', 6), ('some_practice', 3), ('no', 1)]
+
+FIRST_DATE = date(2021, 11, 1)
+DAYS = 4 * 365
+
+def weighted_choice(rng, pairs):
+    """Pick a value from (value, weight) pairs"""
+    values, weights = zip(*pairs)
+    return rng.choices(values, weights=weights)[0]
+
+def build_geography(rng):
+    """Province -> district -> (commune, school, teachers) tree with Zipf-like school sizes"""
+    geography = []
+    for province, weight in PROVINCES:
+        for d in range(rng.randint(6, 14)):
+            district = f"{province} District {d + 1}"
+            for s in range(weight * rng.randint(3, 6)):
+                commune = f"{district} Commune {s // 4 + 1}"
+                school = f"{district} Primary School {s + 1}"
+                teachers = [f"Teacher {school} #{t + 1}" for t in range(rng.randint(4, 30))]
+                # Schools earlier in the list are visited far more often
+                geography.append(((province, district, commune, school, teachers), weight / (s + 1)))
+    return geography
+
+def synthetic_forms(rng, geography, count):
+    """Yield count synthetic forms in bulk_import's form dict layout"""
+    schools, weights = zip(*geography)
+    cum_weights = list(itertools.accumulate(weights))
+    for _ in range(count):
+        province, district, commune, school, teachers = rng.choices(schools, cum_weights=cum_weights)[0]
+        level = rng.choices([1, 2, 3], weights=[5, 3, 2])[0]
+        total_male = rng.randint(8, 30)
+        total_female = rng.randint(8, 30)
+        total_absent = rng.randint(0, 5)
+        inspection_date = FIRST_DATE + timedelta(days=rng.randrange(DAYS))
+        academic_start = inspection_date.year if inspection_date.month >= 11 else inspection_date.year - 1
+
+        session = {column: None for column in SESSION_COLUMNS}
+        session.update({
+            'province': province, 'district': district, 'commune': commune, 'school': school,
+            'name_of_teacher': rng.choice(teachers),
+            'sex': rng.choice(['M', 'F']),
+            'employment_type': rng.choices(['official', 'contract'], weights=[4, 1])[0],
+            'session_time': rng.choice(['morning', 'afternoon', 'both']),
+            'subject': rng.choice(SUBJECTS),
+            'inspection_date': inspection_date.isoformat(),
+            'grade': rng.choices(range(1, 7), weights=[6, 5, 5, 4, 3, 3])[0],
+            'total_male': total_male,
+            'total_female': total_female,
+            'total_absent': total_absent,
+            'total_absent_female': rng.randint(0, total_absent),
+            'level': level,
+            'inspector_name': f"Inspector {district}",
+            'academic_year': f"{academic_start}-{academic_start + 1}",
+            'semester': 1 if inspection_date.month >= 11 or inspection_date.month <= 3 else 2,
+        })
+
+        evaluations = {
+            str(field_id): weighted_choice(rng, SCORE_WEIGHTS) for field_id in LEVEL_INDICATORS[level]
+        }
+
+        assessment = None
+        if rng.random() < 0.6:
+            students = [
+                {'identifier': f"សិស្សទី{n}", 'order': n, 'gender': rng.choice(['M', 'F'])}
+                for n in range(1, rng.randint(4, 10) + 1)
+            ]
+            assessment = {
+                'subjects': ASSESSMENT_SUBJECTS,
+                'students': students,
+                'scores': {
+                    f"subject_{subject['order']}": {
+                        f"student_{student['order']}": round(min(100, max(0, rng.gauss(68, 16))), 2)
+                        for student in students
+                    }
+                    for subject in ASSESSMENT_SUBJECTS
+                }
+            }
+
+        yield {'id': None, 'session': session, 'evaluations': evaluations, 'student_assessment': assessment}
+
+def sample_pools(conn, rng, size=200):
+    """Sample real parameter values for the query catalogue"""
+    pools = {}
+    # REPEATABLE keeps the sample stable for a given rng state
+    sample_seed = rng.randrange(2 ** 31)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT DISTINCT province, district FROM inspection_sessions ORDER BY province, district;"
+        )
+        pools['districts'] = cursor.fetchall()
+        cursor.execute(
+            "SELECT school, name_of_teacher FROM inspection_sessions "
+            "TABLESAMPLE SYSTEM (1) REPEATABLE (%s) LIMIT %s;",
+            (sample_seed, size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            cursor.execute(
+                "SELECT school, name_of_teacher FROM inspection_sessions ORDER BY id LIMIT %s;", (size,)
+            )
+            rows = cursor.fetchall()
+        pools['schools'] = [r[0] for r in rows]
+        pools['teachers'] = [r[1] for r in rows]
+        cursor.execute(
+            "SELECT assessment_id FROM student_assessment_sessions "
+            "TABLESAMPLE SYSTEM (1) REPEATABLE (%s) LIMIT %s;",
+            (sample_seed, size)
+        )
+        pools['assessments'] = [r[0] for r in cursor.fetchall()]
+        if not pools['assessments']:
+            cursor.execute(
+                "SELECT assessment_id FROM student_assessment_sessions ORDER BY assessment_id LIMIT %s;",
+                (size,)
+            )
+            pools['assessments'] = [r[0] for r in cursor.fetchall()]
+        cursor.execute("SELECT MIN(inspection_date), MAX(inspection_date) FROM inspection_sessions;")
+        pools['date_range'] = cursor.fetchone()
+    conn.rollback()
+    return pools
+
+def random_window(pools, rng, days):
+    """A random [start, end] window of the given length inside the data's date range"""
+    first, last = pools['date_range']
+    span = max((last - first).days - days, 0)
+    start = first + timedelta(days=rng.randint(0, span))
+    return start, start + timedelta(days=days)
+
+def teacher_fragment(pools, rng):
+    """A partial teacher name, as typed into a search box"""
+    name = rng.choice(pools['teachers'])
+    return name[-12:]
+
+# Representative calls: name -> (SQL, parameter factory taking (pools, rng))
+QUERY_CATALOGUE = {
+    'get_inspections_by_date_range': (
+        "SELECT * FROM get_inspections_by_date_range(%s, %s, %s, NULL);",
+        lambda pools, rng: random_window(pools, rng, 30) + (rng.choice(pools['districts'])[0],)
+    ),
+    'get_teacher_inspection_history': (
+        "SELECT * FROM get_teacher_inspection_history(%s);",
+        lambda pools, rng: (teacher_fragment(pools, rng),)
+    ),
+    'get_school_statistics': (
+        "SELECT * FROM get_school_statistics(%s);",
+        lambda pools, rng: (rng.choice(pools['schools']),)
+    ),
+    'get_assessment_summary': (
+        "SELECT * FROM get_assessment_summary(%s, NULL, %s, %s);",
+        lambda pools, rng: (rng.choice(pools['schools']),) + random_window(pools, rng, 365)
+    ),
+    'calculate_student_performance': (
+        "SELECT * FROM calculate_student_performance(%s);",
+        lambda pools, rng: (rng.choice(pools['assessments']),)
+    ),
+    'inspection_location_stats': (
+        "SELECT * FROM inspection_location_stats WHERE province = %s;",
+        lambda pools, rng: (rng.choice(pools['districts'])[0],)
+    ),
+    'inspection_location_stats_all': (
+        "SELECT * FROM inspection_location_stats;",
+        lambda pools, rng: ()
+    ),
+    'inspection_complete_summary': (
+        "SELECT * FROM inspection_complete_summary WHERE province = %s AND district = %s;",
+        lambda pools, rng: rng.choice(pools['districts'])
+    ),
+    'inspection_complete_summary_fast': (
+        "SELECT * FROM inspection_complete_summary_fast WHERE province = %s AND district = %s;",
+        lambda pools, rng: rng.choice(pools['districts'])
+    ),
+}
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def latency_stats(samples_ms):
+    """min/mean/p50/p95/p99/max of a list of latencies in milliseconds"""
+    ordered = sorted(samples_ms)
+    return {
+        'iterations': len(ordered),
+        'min_ms': round(ordered[0], 3),
+        'mean_ms': round(sum(ordered) / len(ordered), 3),
+        'p50_ms': round(percentile(ordered, 50), 3),
+        'p95_ms': round(percentile(ordered, 95), 3),
+        'p99_ms': round(percentile(ordered, 99), 3),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+def time_queries(conn, rng, iterations, warmup=2, names=None):
+    """Time each catalogue query with sampled parameters; returns {name: stats}"""
+    pools = sample_pools(conn, rng)
+    results = {}
+    with conn.cursor() as cursor:
+        for name, (sql, make_params) in QUERY_CATALOGUE.items():
+            if names and name not in names:
+                continue
+            samples = []
+            rows = 0
+            try:
+                for i in range(warmup + iterations):
+                    params = make_params(pools, rng)
+                    started = time.perf_counter()
+                    cursor.execute(sql, params)
+                    fetched = cursor.fetchall()
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    if i >= warmup:
+                        samples.append(elapsed_ms)
+                        rows += len(fetched)
+            except Exception as e:
+                conn.rollback()
+                logging.error(f"  {name}: {e}")
+                results[name] = {'error': str(e)}
+                continue
+            conn.rollback()
+            stats = latency_stats(samples)
+            stats['avg_rows'] = round(rows / iterations, 1)
+            results[name] = stats
+            logging.info(
+                f"  {name:<34} p50 {stats['p50_ms']:>9.2f} ms  p95 {stats['p95_ms']:>9.2f} ms  "
+                f"p99 {stats['p99_ms']:>9.2f} ms  rows {stats['avg_rows']}"
+            )
+    return results
+
+def table_counts(conn):
+    """Row counts of the benchmarked tables"""
+    counts = {}
+    with conn.cursor() as cursor:
+        for table in ['inspection_sessions', 'inspection_evaluation_scores',
+                      'student_assessment_sessions', 'student_scores']:
+            cursor.execute(f"SELECT COUNT(*) FROM {table};")
+            counts[table] = cursor.fetchone()[0]
+    conn.rollback()
+    return counts
+
+def grow_to(conn, rng, geography, target, batch_size):
+    """Add synthetic sessions until inspection_sessions holds target rows"""
+    current = table_counts(conn)['inspection_sessions']
+    missing = target - current
+    if missing <= 0:
+        logging.info(f"Already at {current} sessions; nothing to generate for scale {target}")
+        return 0.0
+    logging.info(f"Generating {missing} synthetic sessions ({current} -> {target})")
+    started = time.monotonic()
+    bulk_import(conn, synthetic_forms(rng, geography, missing), batch_size=batch_size)
+    with conn.cursor() as cursor:
+        conn.autocommit = True
+        cursor.execute("ANALYZE;")
+        conn.autocommit = False
+    return time.monotonic() - started
+
+def setup_schema(conn):
+    """Build (or bring up to date) the schema through run_migration.py"""
+    results = run_migrations(conn)
+    if not all(r['status'] in ('applied', 'skipped') for r in results):
+        raise RuntimeError("schema migration failed; see migration.log")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MENTOR reporting functions on synthetic data")
+    parser.add_argument('--dsn', required=True, help="local benchmark database (never production)")
+    parser.add_argument('--scales', default='10000,100000,1000000',
+                        help="comma-separated inspection session counts")
+    parser.add_argument('--iterations', type=int, default=20, help="timed calls per query")
+    parser.add_argument('--batch-size', type=int, default=5000, help="forms per COPY batch")
+    parser.add_argument('--seed', type=int, default=456, help="random seed for data and parameters")
+    parser.add_argument('--output', default='benchmark_report.json', help="JSON report path")
+    args = parser.parse_args()
+
+    scales = sorted(int(s) for s in args.scales.split(','))
+    rng = random.Random(args.seed)
+    geography = build_geography(rng)
+
+    try:
+        conn = connect(args.dsn)
+        setup_schema(conn)
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW server_version;")
+            server_version = cursor.fetchone()[0]
+        conn.rollback()
+
+        report = {
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'server_version': server_version,
+            'seed': args.seed,
+            'iterations': args.iterations,
+            'scales': []
+        }
+        for scale in scales:
+            load_seconds = grow_to(conn, rng, geography, scale, args.batch_size)
+            logging.info(f"Timing queries at {scale} sessions")
+            report['scales'].append({
+                'sessions': scale,
+                'load_seconds': round(load_seconds, 2),
+                'row_counts': table_counts(conn),
+                'queries': time_queries(conn, rng, args.iterations)
+            })
+        conn.close()
+    except Exception as e:
+        logging.error(f"Benchmark failed: {e}")
+        sys.exit(1)
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+        file.write('\n')
+    logging.info(f"Benchmark report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
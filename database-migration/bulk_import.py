@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Bulk importer for digitised paper evaluation forms
+
+Streams CSV or JSONL form exports through COPY into temporary staging tables
+and moves each batch into inspection_sessions, inspection_evaluation_scores and
+the normalized student assessment tables with set-based INSERT ... SELECT.
+It writes the same rows as create_complete_inspection(), but without one
+function call per form.
+
+JSONL input: one form per line, shaped like the create_complete_inspection()
+arguments:
+    {"location": {...}, "teacher": {...}, "lesson": {...}, "students": {...},
+     "inspection": {...}, "evaluations": {"1": "yes", ...},
+     "student_assessment": {"subjects": [...], "students": [...], "scores": {...}}}
+
+CSV input: one form per row. Columns are named after inspection_sessions
+columns (province, school, name_of_teacher, inspection_date, ...). Evaluations
+are indicator_<field_id> columns. An optional student_assessment column holds
+the same JSON object as above.
+
+Usage:
+    python3 bulk_import.py forms.jsonl --batch-size 5000 --commit-every 4
+"""
+
+import csv
+import io
+import json
+import sys
+import time
+import uuid
+import argparse
+import logging
+
+from run_migration import connect
+
+# inspection_sessions columns written by create_complete_inspection()
+SESSION_COLUMNS = [
+    'province', 'district', 'commune', 'village', 'cluster', 'school',
+    'name_of_teacher', 'sex', 'employment_type',
+    'session_time', 'subject', 'chapter', 'lesson', 'title', 'sub_title',
+    'inspection_date', 'start_time', 'end_time', 'grade',
+    'total_male', 'total_female', 'total_absent', 'total_absent_female',
+    'level', 'inspector_name', 'inspector_position', 'inspector_organization',
+    'academic_year', 'semester', 'lesson_duration_minutes', 'general_notes'
+]
+
+# JSONL section/key -> inspection_sessions column, as in create_complete_inspection()
+JSON_FIELD_MAP = {
+    'location': {
+        'province': 'province', 'district': 'district', 'commune': 'commune',
+        'village': 'village', 'cluster': 'cluster', 'school': 'school'
+    },
+    'teacher': {'name': 'name_of_teacher', 'sex': 'sex', 'employment_type': 'employment_type'},
+    'lesson': {
+        'session_time': 'session_time', 'subject': 'subject', 'chapter': 'chapter',
+        'lesson': 'lesson', 'title': 'title', 'sub_title': 'sub_title', 'grade': 'grade'
+    },
+    'students': {
+        'total_male': 'total_male', 'total_female': 'total_female',
+        'total_absent': 'total_absent', 'total_absent_female': 'total_absent_female'
+    },
+    'inspection': {
+        'date': 'inspection_date', 'start_time': 'start_time', 'end_time': 'end_time',
+        'level': 'level', 'inspector_name': 'inspector_name',
+        'inspector_position': 'inspector_position',
+        'inspector_organization': 'inspector_organization',
+        'academic_year': 'academic_year', 'semester': 'semester',
+        'lesson_duration_minutes': 'lesson_duration_minutes', 'notes': 'general_notes'
+    }
+}
+
+# Staging table name -> (target table, columns copied)
+STAGING_TABLES = {
+    'stage_inspection_sessions': ('inspection_sessions', ['id'] + SESSION_COLUMNS),
+    'stage_evaluation_scores': (
+        'inspection_evaluation_scores', ['inspection_session_id', 'field_id', 'score']
+    ),
+    'stage_assessment_sessions': (
+        'student_assessment_sessions', ['assessment_id', 'inspection_session_id', 'notes']
+    ),
+    'stage_assessment_subjects': (
+        'assessment_subjects',
+        ['subject_id', 'assessment_id', 'subject_name_km', 'subject_name_en', 'subject_order']
+    ),
+    'stage_assessment_students': (
+        'assessment_students',
+        ['student_id', 'assessment_id', 'student_identifier', 'student_name',
+         'student_order', 'student_gender']
+    ),
+    'stage_student_scores': (
+        'student_scores', ['assessment_id', 'subject_id', 'student_id', 'score']
+    ),
+}
+
+# Set-based moves from staging into the real tables, parents first
+MOVE_SQL = [
+    """
+    INSERT INTO inspection_sessions (id, {columns})
+    SELECT id, {select_columns} FROM stage_inspection_sessions;
+    """.format(
+        columns=', '.join(SESSION_COLUMNS),
+        select_columns=', '.join(
+            "COALESCE(session_time, 'morning')" if c == 'session_time' else c
+            for c in SESSION_COLUMNS
+        )
+    ),
+    """
+    INSERT INTO inspection_evaluation_scores (inspection_session_id, field_id, score)
+    SELECT inspection_session_id, field_id, score FROM stage_evaluation_scores
+    ON CONFLICT (inspection_session_id, field_id) DO UPDATE
+    SET score = EXCLUDED.score, updated_at = CURRENT_TIMESTAMP;
+    """,
+    """
+    INSERT INTO student_assessment_sessions (assessment_id, inspection_session_id, notes)
+    SELECT assessment_id, inspection_session_id, notes FROM stage_assessment_sessions;
+    """,
+    """
+    INSERT INTO assessment_subjects (subject_id, assessment_id, subject_name_km, subject_name_en, subject_order)
+    SELECT subject_id, assessment_id, subject_name_km, subject_name_en, subject_order
+    FROM stage_assessment_subjects;
+    """,
+    """
+    INSERT INTO assessment_students (student_id, assessment_id, student_identifier, student_name, student_order, student_gender)
+    SELECT student_id, assessment_id, student_identifier, student_name, student_order, student_gender
+    FROM stage_assessment_students;
+    """,
+    """
+    INSERT INTO student_scores (assessment_id, subject_id, student_id, score)
+    SELECT assessment_id, subject_id, student_id, score FROM stage_student_scores;
+    """,
+]
+
+def create_staging_tables(conn):
+    """Create session-local staging tables typed like their targets"""
+    with conn.cursor() as cursor:
+        for stage, (target, columns) in STAGING_TABLES.items():
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {stage} AS "
+                f"SELECT {', '.join(columns)} FROM {target} WITH NO DATA;"
+            )
+    conn.commit()
+
+def read_jsonl_forms(path):
+    """Yield forms from a JSONL export, converted to flat form dicts"""
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            session = {}
+            for section, fields in JSON_FIELD_MAP.items():
+                values = record.get(section) or {}
+                for key, column in fields.items():
+                    session[column] = values.get(key)
+            yield {
+                'id': record.get('id'),
+                'session': session,
+                'evaluations': record.get('evaluations') or {},
+                'student_assessment': record.get('student_assessment')
+            }
+
+def read_csv_forms(path):
+    """Yield forms from a CSV export, converted to flat form dicts"""
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        for row in csv.DictReader(file):
+            evaluations = {
+                key[len('indicator_'):]: value
+                for key, value in row.items()
+                if key.startswith('indicator_') and value
+            }
+            assessment = row.get('student_assessment')
+            yield {
+                'id': row.get('id') or None,
+                'session': {column: row.get(column) for column in SESSION_COLUMNS},
+                'evaluations': evaluations,
+                'student_assessment': json.loads(assessment) if assessment else None
+            }
+
+def form_rows(form, buffers):
+    """Append one form's rows to the per-staging-table row lists; returns row count"""
+    session_id = form['id'] or str(uuid.uuid4())
+    session = form['session']
+    buffers['stage_inspection_sessions'].append(
+        [session_id] + [session.get(column) for column in SESSION_COLUMNS]
+    )
+    count = 1
+
+    # One score per indicator; later keys win, like ON CONFLICT in the function
+    scores = {}
+    for field_id, score in form['evaluations'].items():
+        scores[int(field_id)] = score
+    for field_id, score in scores.items():
+        buffers['stage_evaluation_scores'].append([session_id, field_id, score])
+    count += len(scores)
+
+    assessment = form['student_assessment']
+    if assessment:
+        count += assessment_rows(session_id, assessment, buffers)
+    return count
+
+def assessment_rows(session_id, assessment, buffers):
+    """Rows for one student assessment, mapped like insert_student_assessment()"""
+    assessment_id = str(uuid.uuid4())
+    buffers['stage_assessment_sessions'].append([assessment_id, session_id, assessment.get('notes')])
+    count = 1
+
+    student_ids = {}
+    for student in assessment.get('students') or []:
+        student_id = str(uuid.uuid4())
+        student_ids[f"student_{student.get('order')}"] = student_id
+        buffers['stage_assessment_students'].append([
+            student_id, assessment_id, student.get('identifier'), student.get('name'),
+            student.get('order'), student.get('gender')
+        ])
+        count += 1
+
+    scores = assessment.get('scores') or {}
+    for subject in assessment.get('subjects') or []:
+        subject_id = str(uuid.uuid4())
+        buffers['stage_assessment_subjects'].append([
+            subject_id, assessment_id, subject.get('name_km'), subject.get('name_en'),
+            subject.get('order')
+        ])
+        count += 1
+        subject_scores = scores.get(f"subject_{subject.get('order')}") or {}
+        for student_key, student_id in student_ids.items():
+            score = subject_scores.get(student_key)
+            if score is None:
+                continue
+            buffers['stage_student_scores'].append([assessment_id, subject_id, student_id, score])
+            count += 1
+    return count
+
+def copy_rows(cursor, stage, rows):
+    """COPY a list of rows into a staging table as CSV"""
+    if not rows:
+        return
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    columns = STAGING_TABLES[stage][1]
+    cursor.copy_expert(
+        f"COPY {stage} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+    )
+
+def load_batch(conn, buffers):
+    """COPY one batch into staging, move it into the real tables, clear staging"""
+    with conn.cursor() as cursor:
+        for stage, rows in buffers.items():
+            copy_rows(cursor, stage, rows)
+        for sql in MOVE_SQL:
+            cursor.execute(sql)
+        cursor.execute(f"TRUNCATE {', '.join(STAGING_TABLES)};")
+
+def empty_buffers():
+    """Fresh per-staging-table row lists"""
+    return {stage: [] for stage in STAGING_TABLES}
+
+def bulk_import(conn, forms, batch_size=5000, commit_every=1, skip=0):
+    """Load forms in batches of batch_size, committing every commit_every batches.
+
+    Returns (forms_loaded, rows_loaded). On error the uncommitted batches are
+    rolled back; rerun with skip set to the logged committed form count.
+    """
+    create_staging_tables(conn)
+    buffers = empty_buffers()
+    pending_forms = 0
+    batches_since_commit = 0
+    committed_forms = 0
+    loaded_forms = 0
+    loaded_rows = 0
+    started = time.monotonic()
+
+    def report():
+        elapsed = max(time.monotonic() - started, 1e-9)
+        logging.info(
+            f"Committed {committed_forms} forms, {loaded_rows} rows "
+            f"({loaded_rows / elapsed:,.0f} rows/s, {committed_forms / elapsed:,.0f} forms/s)"
+        )
+
+    try:
+        for index, form in enumerate(forms):
+            if index < skip:
+                continue
+            loaded_rows += form_rows(form, buffers)
+            pending_forms += 1
+            if pending_forms >= batch_size:
+                load_batch(conn, buffers)
+                loaded_forms += pending_forms
+                buffers = empty_buffers()
+                pending_forms = 0
+                batches_since_commit += 1
+                if batches_since_commit >= commit_every:
+                    conn.commit()
+                    committed_forms = skip + loaded_forms
+                    batches_since_commit = 0
+                    report()
+
+        if pending_forms:
+            load_batch(conn, buffers)
+            loaded_forms += pending_forms
+        if pending_forms or batches_since_commit:
+            conn.commit()
+            committed_forms = skip + loaded_forms
+            report()
+        return loaded_forms, loaded_rows
+    except Exception:
+        conn.rollback()
+        logging.error(f"Import failed; {committed_forms} forms were committed. Resume with --skip {committed_forms}")
+        raise
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import digitised evaluation forms via COPY")
+    parser.add_argument('path', help="CSV or JSONL export of evaluation forms")
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help="input format (default: from the file extension)")
+    parser.add_argument('--batch-size', type=int, default=5000, help="forms per COPY batch")
+    parser.add_argument('--commit-every', type=int, default=1, help="batches per transaction")
+    parser.add_argument('--skip', type=int, default=0, help="skip the first N forms (resume)")
+    parser.add_argument('--dsn', help="connection string (default: run_migration DB_CONFIG)")
+    args = parser.parse_args()
+
+    input_format = args.format or ('csv' if args.path.lower().endswith('.csv') else 'jsonl')
+    forms = read_csv_forms(args.path) if input_format == 'csv' else read_jsonl_forms(args.path)
+
+    try:
+        conn = connect(args.dsn)
+        forms_loaded, rows_loaded = bulk_import(
+            conn, forms, batch_size=args.batch_size,
+            commit_every=args.commit_every, skip=args.skip
+        )
+        conn.close()
+        logging.info(f"Imported {forms_loaded} forms ({rows_loaded} rows)")
+    except Exception as e:
+        logging.error(f"Bulk import failed: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Chunked parallel converter between the two student assessment representations
+
+03_dynamic_student_assessment.sql stores an assessment either as one
+dynamic_student_assessments row (JSONB subjects, students and score matrix) or
+as normalized rows in student_assessment_sessions, assessment_subjects,
+assessment_students and student_scores. This script copies assessments from
+one form to the other:
+
+  to-normalized  dynamic_student_assessments -> normalized tables
+  to-jsonb       normalized tables -> dynamic_student_assessments
+
+The source is split into assessment_id ranges of --chunk-size assessments.
+A pool of --workers processes, each with its own connection, converts one range
+per transaction using multi-row INSERTs. The ranges and their state are kept in
+assessment_conversion_chunks. A chunk is marked done in the same transaction as
+its rows, so an interrupted run resumes with the chunks that did not commit.
+assessment_ids are random UUIDs, so assessments added after planning land in
+ranges that may already be done: a rerun reopens every done chunk that still
+has unconverted source rows. Assessments already present in the target (same
+assessment_id) are skipped, which makes reconverting a chunk or a rerun with
+--restart safe.
+
+Usage:
+    python3 convert_assessments.py to-normalized --workers 4 --chunk-size 500
+    python3 convert_assessments.py to-jsonb --workers 4
+    python3 convert_assessments.py status
+"""
+
+import sys
+import time
+import uuid
+import argparse
+import logging
+from decimal import Decimal, InvalidOperation
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from psycopg2.extras import Json, execute_values
+
+from run_migration import connect
+
+DIRECTIONS = {
+    'to-normalized': ('dynamic_student_assessments', 'student_assessment_sessions'),
+    'to-jsonb': ('student_assessment_sessions', 'dynamic_student_assessments'),
+}
+
+CHECKPOINT_SQL = """
+    CREATE TABLE IF NOT EXISTS assessment_conversion_chunks (
+        direction VARCHAR(20) NOT NULL,
+        chunk_no INTEGER NOT NULL,
+        lower_id UUID NOT NULL,
+        upper_id UUID,
+        status VARCHAR(10) NOT NULL DEFAULT 'pending',
+        assessments INTEGER,
+        rows_written INTEGER,
+        duration_ms INTEGER,
+        converted_at TIMESTAMP,
+        PRIMARY KEY (direction, chunk_no)
+    );
+"""
+
+# Lower bound of every chunk_size-th source row
+BOUNDS_SQL = """
+    SELECT assessment_id FROM (
+        SELECT assessment_id, row_number() OVER (ORDER BY assessment_id) as rn
+        FROM {table}
+    ) ordered
+    WHERE (rn - 1) %% %s = 0
+    ORDER BY assessment_id;
+"""
+
+# Reopens done chunks whose range gained source rows missing from the target
+REOPEN_SQL = """
+    UPDATE assessment_conversion_chunks c
+    SET status = 'pending'
+    WHERE c.direction = %s AND c.status = 'done'
+      AND EXISTS (
+          SELECT 1 FROM {source} src
+          WHERE src.assessment_id >= c.lower_id
+            AND (c.upper_id IS NULL OR src.assessment_id < c.upper_id)
+            AND NOT EXISTS (SELECT 1 FROM {target} t WHERE t.assessment_id = src.assessment_id)
+      );
+"""
+
+# Lower bound of the first chunk, so the ranges cover every UUID
+MIN_UUID = '00000000-0000-0000-0000-000000000000'
+
+# score_text is VARCHAR(20)
+SCORE_TEXT_LENGTH = 20
+
+# Set in each worker process by init_worker()
+worker_conn = None
+
+def ensure_checkpoint_table(conn):
+    """Create the chunk checkpoint table if needed"""
+    with conn.cursor() as cursor:
+        cursor.execute(CHECKPOINT_SQL)
+    conn.commit()
+
+def plan_chunks(conn, direction, chunk_size, restart=False):
+    """Split the source into assessment_id ranges, or reopen the chunks of an existing plan that gained rows"""
+    source, target = DIRECTIONS[direction]
+    with conn.cursor() as cursor:
+        if restart:
+            cursor.execute("DELETE FROM assessment_conversion_chunks WHERE direction = %s;", (direction,))
+        cursor.execute("SELECT COUNT(*) FROM assessment_conversion_chunks WHERE direction = %s;", (direction,))
+        if cursor.fetchone()[0]:
+            cursor.execute(
+                "UPDATE assessment_conversion_chunks SET lower_id = %s WHERE direction = %s AND chunk_no = 0;",
+                (MIN_UUID, direction)
+            )
+            cursor.execute(REOPEN_SQL.format(source=source, target=target), (direction,))
+            reopened = cursor.rowcount
+            conn.commit()
+            logging.info(f"Resuming the existing {direction} plan ({reopened} done chunks reopened for new rows)")
+            return
+        cursor.execute(BOUNDS_SQL.format(table=source), (chunk_size,))
+        bounds = [row[0] for row in cursor.fetchall()] or [MIN_UUID]
+        # The ranges run from the smallest UUID to an open end, so every assessment
+        # added later falls in some chunk (see REOPEN_SQL for chunks already done)
+        bounds[0] = MIN_UUID
+        execute_values(cursor, """
+            INSERT INTO assessment_conversion_chunks (direction, chunk_no, lower_id, upper_id)
+            VALUES %s;
+        """, [
+            (direction, number, lower, bounds[number + 1] if number + 1 < len(bounds) else None)
+            for number, lower in enumerate(bounds)
+        ])
+    conn.commit()
+    logging.info(f"Planned {len(bounds)} {direction} chunks of up to {chunk_size} assessments")
+
+def pending_chunks(conn, direction):
+    """(chunk_no, lower_id, upper_id) of chunks not yet converted"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT chunk_no, lower_id, upper_id FROM assessment_conversion_chunks
+            WHERE direction = %s AND status <> 'done'
+            ORDER BY chunk_no;
+        """, (direction,))
+        chunks = cursor.fetchall()
+    conn.rollback()
+    return chunks
+
+def range_filter(column, lower, upper):
+    """WHERE clause and parameters for one assessment_id range"""
+    if upper is None:
+        return f"{column} >= %s", (lower,)
+    return f"{column} >= %s AND {column} < %s", (lower, upper)
+
+def score_columns(value):
+    """(score, score_text) for one JSON matrix value"""
+    if value is None:
+        return None, None
+    if isinstance(value, bool):
+        return None, str(value).lower()
+    try:
+        return Decimal(str(value)), None
+    except InvalidOperation:
+        return None, str(value)[:SCORE_TEXT_LENGTH]
+
+def json_number(value):
+    """Decimal as a JSON-serialisable int or float"""
+    if value is None:
+        return None
+    return int(value) if value == value.to_integral_value() else float(value)
+
+def normalized_rows(record):
+    """Rows for one dynamic_student_assessments record, mapped like insert_student_assessment()"""
+    assessment_id, session_id, subjects, students, scores, assessment_date, assessment_type, \
+        notes, created_at, is_active = record
+    session = (assessment_id, session_id, assessment_type, assessment_date, notes, created_at, is_active)
+
+    student_rows = []
+    student_ids = {}
+    for student in students or []:
+        student_id = str(uuid.uuid4())
+        student_ids[f"student_{student.get('order')}"] = student_id
+        student_rows.append((
+            student_id, assessment_id, student.get('identifier'), student.get('order'),
+            student.get('name'), student.get('gender')
+        ))
+
+    subject_rows = []
+    score_rows = []
+    for subject in subjects or []:
+        subject_id = str(uuid.uuid4())
+        max_score = subject.get('max_score')
+        subject_rows.append((
+            subject_id, assessment_id, subject.get('name_km'), subject.get('name_en'),
+            subject.get('order'), 100 if max_score is None else max_score
+        ))
+        subject_scores = (scores or {}).get(f"subject_{subject.get('order')}") or {}
+        for student_key, student_id in student_ids.items():
+            if student_key not in subject_scores:
+                continue
+            score, score_text = score_columns(subject_scores[student_key])
+            score_rows.append((assessment_id, subject_id, student_id, score, score_text))
+    return session, subject_rows, student_rows, score_rows
+
+def convert_to_normalized(cursor, lower, upper):
+    """Expand one range of JSONB assessments into the normalized tables; returns (assessments, rows)"""
+    where, params = range_filter('d.assessment_id', lower, upper)
+    cursor.execute(f"""
+        SELECT d.assessment_id, d.inspection_session_id, d.subjects, d.students, d.scores,
+               d.assessment_date, d.assessment_type, d.notes, d.created_at, d.is_active
+        FROM dynamic_student_assessments d
+        WHERE {where}
+          AND NOT EXISTS (
+              SELECT 1 FROM student_assessment_sessions s WHERE s.assessment_id = d.assessment_id
+          );
+    """, params)
+    records = cursor.fetchall()
+
+    sessions, subjects, students, scores = [], [], [], []
+    for record in records:
+        session, subject_rows, student_rows, score_rows = normalized_rows(record)
+        sessions.append(session)
+        subjects.extend(subject_rows)
+        students.extend(student_rows)
+        scores.extend(score_rows)
+
+    # Parents first, one multi-row INSERT per table
+    execute_values(cursor, """
+        INSERT INTO student_assessment_sessions
+            (assessment_id, inspection_session_id, assessment_type, assessment_date, notes, created_at, is_active)
+        VALUES %s;
+    """, sessions, page_size=1000)
+    execute_values(cursor, """
+        INSERT INTO assessment_subjects
+            (subject_id, assessment_id, subject_name_km, subject_name_en, subject_order, max_score)
+        VALUES %s;
+    """, subjects, page_size=1000)
+    execute_values(cursor, """
+        INSERT INTO assessment_students
+            (student_id, assessment_id, student_identifier, student_order, student_name, student_gender)
+        VALUES %s;
+    """, students, page_size=1000)
+    execute_values(cursor, """
+        INSERT INTO student_scores (assessment_id, subject_id, student_id, score, score_text)
+        VALUES %s;
+    """, scores, page_size=1000)
+    return len(sessions), len(sessions) + len(subjects) + len(students) + len(scores)
+
+def convert_to_jsonb(cursor, lower, upper):
+    """Fold one range of normalized assessments into dynamic_student_assessments; returns (assessments, rows)"""
+    where, params = range_filter('s.assessment_id', lower, upper)
+    cursor.execute(f"""
+        SELECT s.assessment_id, s.inspection_session_id, s.assessment_date, s.assessment_type,
+               s.notes, s.created_at, s.is_active
+        FROM student_assessment_sessions s
+        WHERE {where}
+          AND NOT EXISTS (
+              SELECT 1 FROM dynamic_student_assessments d WHERE d.assessment_id = s.assessment_id
+          )
+        ORDER BY s.assessment_id;
+    """, params)
+    sessions = cursor.fetchall()
+    if not sessions:
+        return 0, 0
+    ids = [row[0] for row in sessions]
+
+    cursor.execute("""
+        SELECT assessment_id, subject_name_km, subject_name_en, subject_order, max_score
+        FROM assessment_subjects WHERE assessment_id = ANY(%s::uuid[])
+        ORDER BY assessment_id, subject_order;
+    """, (ids,))
+    subjects = {}
+    for assessment_id, name_km, name_en, order, max_score in cursor.fetchall():
+        subjects.setdefault(assessment_id, []).append({
+            'name_km': name_km, 'name_en': name_en, 'order': order, 'max_score': json_number(max_score)
+        })
+
+    cursor.execute("""
+        SELECT assessment_id, student_identifier, student_name, student_gender, student_order
+        FROM assessment_students WHERE assessment_id = ANY(%s::uuid[])
+        ORDER BY assessment_id, student_order;
+    """, (ids,))
+    students = {}
+    for assessment_id, identifier, name, gender, order in cursor.fetchall():
+        students.setdefault(assessment_id, []).append({
+            'identifier': identifier, 'name': name, 'gender': gender, 'order': order
+        })
+
+    cursor.execute("""
+        SELECT sc.assessment_id, subj.subject_order, stud.student_order, sc.score, sc.score_text
+        FROM student_scores sc
+        JOIN assessment_subjects subj ON subj.subject_id = sc.subject_id
+        JOIN assessment_students stud ON stud.student_id = sc.student_id
+        WHERE sc.assessment_id = ANY(%s::uuid[]);
+    """, (ids,))
+    matrices = {}
+    for assessment_id, subject_order, student_order, score, score_text in cursor.fetchall():
+        matrix = matrices.setdefault(assessment_id, {})
+        matrix.setdefault(f"subject_{subject_order}", {})[f"student_{student_order}"] = (
+            json_number(score) if score is not None else score_text
+        )
+
+    execute_values(cursor, """
+        INSERT INTO dynamic_student_assessments
+            (assessment_id, inspection_session_id, subjects, students, scores,
+             assessment_date, assessment_type, notes, created_at, is_active)
+        VALUES %s;
+    """, [
+        (assessment_id, session_id, Json(subjects.get(assessment_id, [])),
+         Json(students.get(assessment_id, [])), Json(matrices.get(assessment_id, {})),
+         assessment_date, assessment_type, notes, created_at, is_active)
+        for assessment_id, session_id, assessment_date, assessment_type, notes, created_at, is_active in sessions
+    ], page_size=1000)
+    return len(sessions), len(sessions)
+
+CONVERTERS = {
+    'to-normalized': convert_to_normalized,
+    'to-jsonb': convert_to_jsonb,
+}
+
+def init_worker(dsn):
+    """Open this worker process's connection"""
+    global worker_conn
+    worker_conn = connect(dsn)
+
+def convert_chunk(direction, chunk_no, lower, upper):
+    """Convert one chunk and mark it done in the same transaction; returns (chunk_no, assessments, rows)"""
+    started = time.monotonic()
+    try:
+        with worker_conn.cursor() as cursor:
+            assessments, rows = CONVERTERS[direction](cursor, lower, upper)
+            cursor.execute("""
+                UPDATE assessment_conversion_chunks
+                SET status = 'done', assessments = COALESCE(assessments, 0) + %s,
+                    rows_written = COALESCE(rows_written, 0) + %s,
+                    duration_ms = %s, converted_at = CURRENT_TIMESTAMP
+                WHERE direction = %s AND chunk_no = %s;
+            """, (assessments, rows, int((time.monotonic() - started) * 1000), direction, chunk_no))
+        worker_conn.commit()
+        return chunk_no, assessments, rows
+    except Exception:
+        worker_conn.rollback()
+        raise
+
+def convert(dsn, direction, workers=4, chunk_size=500, restart=False):
+    """Plan and convert all pending chunks; returns (assessments, rows, failed chunk numbers)"""
+    conn = connect(dsn)
+    ensure_checkpoint_table(conn)
+    # Held until this run ends, so two runs never convert the same chunk
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s));", (f"convert_assessments {direction}",))
+        locked = cursor.fetchone()[0]
+    conn.commit()
+    if not locked:
+        conn.close()
+        raise RuntimeError(f"another {direction} conversion is running")
+    try:
+        plan_chunks(conn, direction, chunk_size, restart)
+        chunks = pending_chunks(conn, direction)
+        if not chunks:
+            logging.info(f"Nothing to convert: every {direction} chunk is done")
+            return 0, 0, []
+        return run_chunks(dsn, direction, chunks, workers)
+    finally:
+        conn.close()
+
+def run_chunks(dsn, direction, chunks, workers):
+    """Convert chunks on a process pool; returns (assessments, rows, failed chunk numbers)"""
+    source, target = DIRECTIONS[direction]
+    logging.info(f"Converting {len(chunks)} chunks from {source} to {target} with {workers} workers")
+    started = time.monotonic()
+    assessments = rows = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(dsn,)) as pool:
+        futures = {
+            pool.submit(convert_chunk, direction, chunk_no, str(lower), upper and str(upper)): chunk_no
+            for chunk_no, lower, upper in chunks
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                _, chunk_assessments, chunk_rows = future.result()
+            except Exception as e:
+                failed.append(futures[future])
+                logging.error(f"  Chunk {futures[future]} failed: {e}")
+                continue
+            assessments += chunk_assessments
+            rows += chunk_rows
+            elapsed = max(time.monotonic() - started, 1e-9)
+            logging.info(
+                f"  {done}/{len(chunks)} chunks: {assessments} assessments, {rows} rows "
+                f"({rows / elapsed:,.0f} rows/s)"
+            )
+    return assessments, rows, sorted(failed)
+
+def print_status(conn):
+    """Chunk progress per direction"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT direction, COUNT(*), COUNT(*) FILTER (WHERE status = 'done'),
+                   COALESCE(SUM(assessments), 0), COALESCE(SUM(rows_written), 0), MAX(converted_at)
+            FROM assessment_conversion_chunks
+            GROUP BY direction ORDER BY direction;
+        """)
+        rows = cursor.fetchall()
+    conn.rollback()
+    if not rows:
+        print("No conversion has been planned")
+    for direction, chunks, done, assessments, written, last in rows:
+        print(f"{direction:<14} {done}/{chunks} chunks done, {assessments} assessments, "
+              f"{written} rows written, last chunk at {last or '-'}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert student assessments between JSONB and normalized tables")
+    parser.add_argument('command', choices=sorted(DIRECTIONS) + ['status'])
+    parser.add_argument('--workers', type=int, default=4, help="worker processes (one connection each)")
+    parser.add_argument('--chunk-size', type=int, default=500, help="assessments per chunk")
+    parser.add_argument('--restart', action='store_true',
+                        help="discard the saved plan and re-plan (already converted assessments are skipped)")
+    parser.add_argument('--dsn', help="connection string (default: run_migration DB_CONFIG)")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'status':
+            conn = connect(args.dsn)
+            ensure_checkpoint_table(conn)
+            print_status(conn)
+            conn.close()
+            return
+        assessments, rows, failed = convert(
+            args.dsn, args.command, args.workers, args.chunk_size, args.restart
+        )
+    except Exception as e:
+        logging.error(f"Conversion failed: {e}")
+        sys.exit(1)
+
+    logging.info(f"Converted {assessments} assessments ({rows} rows)")
+    if failed:
+        logging.error(f"{len(failed)} chunk(s) failed: {failed}. Rerun the same command to retry them")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Streaming export of reporting data for ministry dumps
+
+Exports inspection_complete_summary, inspection_location_stats or the student
+score matrix (one row per student, subject and assessment) to CSV, gzip'd CSV
+or Parquet. Memory use is constant whatever the row count:
+  - CSV and CSV.gz stream COPY (query) TO STDOUT straight into the file,
+  - Parquet reads a server-side named cursor in chunks of --chunk-size rows
+    and writes one row group per chunk (requires pyarrow).
+
+Filters are added to the query only when given, so date-bounded exports
+prune to the partitions they need once inspection_sessions is partitioned.
+
+Usage:
+    python3 export_summaries.py complete_summary --format csv.gz --province "Kandal"
+    python3 export_summaries.py student_scores --format parquet --from 2024-01-01 --to 2024-12-31
+    python3 export_summaries.py location_stats --output location_stats.csv
+"""
+
+import os
+import sys
+import gzip
+import time
+import resource
+import argparse
+import logging
+from decimal import Decimal
+
+from run_migration import connect
+
+# Dataset -> (query template, {filter: column}); {where} receives the filters
+DATASETS = {
+    'complete_summary': (
+        """
+        SELECT * FROM {source}
+        WHERE true {where}
+        ORDER BY inspection_date, inspection_id
+        """,
+        {'province': 'province', 'district': 'district', 'date': 'inspection_date'}
+    ),
+    # Same aggregates as the inspection_location_stats view, filtered before grouping
+    'location_stats': (
+        """
+        SELECT
+            province,
+            district,
+            commune,
+            COUNT(*) as total_inspections,
+            COUNT(DISTINCT school) as unique_schools,
+            COUNT(DISTINCT name_of_teacher) as unique_teachers,
+            AVG(total_students) as avg_class_size,
+            AVG(CASE WHEN total_students > 0 THEN (total_present::decimal / total_students) * 100 ELSE 0 END) as avg_attendance_rate,
+            MIN(inspection_date) as first_inspection,
+            MAX(inspection_date) as last_inspection
+        FROM inspection_sessions
+        WHERE is_active = true {where}
+        GROUP BY province, district, commune
+        ORDER BY province, district, commune
+        """,
+        {'province': 'province', 'district': 'district', 'date': 'inspection_date'}
+    ),
+    'student_scores': (
+        """
+        SELECT
+            ins.id as inspection_id,
+            ins.inspection_date,
+            ins.province,
+            ins.district,
+            ins.school,
+            ins.name_of_teacher,
+            sas.assessment_id,
+            sas.assessment_date,
+            ast.student_order,
+            ast.student_identifier,
+            ast.student_gender,
+            asub.subject_order,
+            asub.subject_name_km,
+            asub.subject_name_en,
+            sc.score,
+            sc.score_text
+        FROM student_scores sc
+        JOIN student_assessment_sessions sas ON sas.assessment_id = sc.assessment_id
+        JOIN assessment_students ast ON ast.student_id = sc.student_id
+        JOIN assessment_subjects asub ON asub.subject_id = sc.subject_id
+        JOIN inspection_sessions ins ON ins.id = sas.inspection_session_id
+        WHERE ins.is_active = true
+          AND sas.is_active = true {where}
+        ORDER BY ins.inspection_date, sas.assessment_id, ast.student_order, asub.subject_order
+        """,
+        {'province': 'ins.province', 'district': 'ins.district', 'date': 'ins.inspection_date'}
+    ),
+}
+
+FORMATS = ('csv', 'csv.gz', 'parquet')
+
+# Parquet scale of unconstrained numeric columns (AVG, ROUND results); PostgreSQL
+# computes averages to at least 16 fractional digits
+UNCONSTRAINED_NUMERIC_SCALE = 16
+
+def build_query(dataset, province=None, district=None, date_from=None, date_to=None, fast=False):
+    """(sql, params) for a dataset with only the given filters applied"""
+    template, columns = DATASETS[dataset]
+    clauses = []
+    params = []
+    if province:
+        clauses.append(f"{columns['province']} = %s")
+        params.append(province)
+    if district:
+        clauses.append(f"{columns['district']} = %s")
+        params.append(district)
+    if date_from:
+        clauses.append(f"{columns['date']} >= %s")
+        params.append(date_from)
+    if date_to:
+        clauses.append(f"{columns['date']} <= %s")
+        params.append(date_to)
+    where = ''.join(f"\n          AND {clause}" for clause in clauses)
+    source = 'inspection_complete_summary_fast' if fast else 'inspection_complete_summary'
+    return template.format(where=where, source=source), params
+
+def peak_memory_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+def export_csv(conn, sql, params, path, compress):
+    """Stream COPY ... TO STDOUT into a (gzip'd) CSV file; returns rows written"""
+    with conn.cursor() as cursor:
+        copy_sql = f"COPY ({cursor.mogrify(sql, params).decode('utf-8')}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+        opener = gzip.open if compress else open
+        with opener(path, 'wb') as file:
+            cursor.copy_expert(copy_sql, file)
+        rows = cursor.rowcount
+    conn.rollback()
+    return rows
+
+def arrow_type(pa, column, type_names):
+    """Arrow type for a cursor.description column
+
+    numeric stays exact: numeric(p, s) becomes decimal(p, s) and unconstrained
+    numeric (AVG, ROUND and other computed values) becomes
+    decimal(38, UNCONSTRAINED_NUMERIC_SCALE).
+    """
+    name = type_names.get(column.type_code, 'text')
+    if name in ('int2', 'int4', 'int8'):
+        return pa.int64()
+    if name == 'numeric':
+        if column.precision is not None and 0 < column.precision <= 76 and 0 <= column.scale <= column.precision:
+            if column.precision <= 38:
+                return pa.decimal128(column.precision, column.scale)
+            return pa.decimal256(column.precision, column.scale)
+        return pa.decimal128(38, UNCONSTRAINED_NUMERIC_SCALE)
+    if name in ('float4', 'float8'):
+        return pa.float64()
+    if name == 'bool':
+        return pa.bool_()
+    if name == 'date':
+        return pa.date32()
+    if name in ('timestamp', 'timestamptz'):
+        return pa.timestamp('us')
+    return pa.string()
+
+def export_parquet(conn, sql, params, path, chunk_size):
+    """Stream a named cursor into a Parquet file one row group per chunk; returns rows written"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    rows = 0
+    writer = None
+    with conn.cursor(name='export_summaries') as cursor:
+        cursor.itersize = chunk_size
+        cursor.execute(sql, params)
+        chunk = cursor.fetchmany(chunk_size)
+        with conn.cursor() as types:
+            types.execute(
+                "SELECT oid, typname FROM pg_type WHERE oid = ANY(%s);",
+                ([column.type_code for column in cursor.description],)
+            )
+            type_names = dict(types.fetchall())
+        schema = pa.schema([
+            (column.name, arrow_type(pa, column, type_names)) for column in cursor.description
+        ])
+        uuid_columns = [i for i, column in enumerate(cursor.description) if type_names.get(column.type_code) == 'uuid']
+        float_columns = [i for i, field in enumerate(schema) if pa.types.is_floating(field.type)]
+        # Values are rounded to the column scale; numeric(p, s) already has it
+        decimal_columns = [
+            (i, Decimal(1).scaleb(-field.type.scale)) for i, field in enumerate(schema)
+            if pa.types.is_decimal(field.type)
+        ]
+        try:
+            writer = pq.ParquetWriter(path, schema, compression='snappy')
+            while chunk:
+                columns = [list(values) for values in zip(*chunk)]
+                for i in uuid_columns:
+                    columns[i] = [None if v is None else str(v) for v in columns[i]]
+                for i in float_columns:
+                    columns[i] = [None if v is None else float(v) for v in columns[i]]
+                for i, exponent in decimal_columns:
+                    columns[i] = [None if v is None else v.quantize(exponent) for v in columns[i]]
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+                rows += len(chunk)
+                chunk = cursor.fetchmany(chunk_size)
+        finally:
+            if writer is not None:
+                writer.close()
+    conn.rollback()
+    return rows
+
+def export(conn, dataset, output_format, path, chunk_size=10000, **filters):
+    """Export one dataset to path; returns rows written"""
+    sql, params = build_query(dataset, **filters)
+    started = time.monotonic()
+    if output_format == 'parquet':
+        rows = export_parquet(conn, sql, params, path, chunk_size)
+    else:
+        rows = export_csv(conn, sql, params, path, compress=output_format == 'csv.gz')
+    elapsed = time.monotonic() - started
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    logging.info(
+        f"Exported {rows} {dataset} rows to {path} ({size_mb:.1f} MB) in {elapsed:.1f}s "
+        f"({rows / max(elapsed, 1e-9):.0f} rows/s, peak memory {peak_memory_mb():.0f} MB)"
+    )
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream reporting data to CSV, gzip'd CSV or Parquet")
+    parser.add_argument('dataset', choices=sorted(DATASETS))
+    parser.add_argument('--format', choices=FORMATS, default='csv', help="output format")
+    parser.add_argument('--output', help="output file (default: <dataset>.<format>)")
+    parser.add_argument('--province', help="only this province")
+    parser.add_argument('--district', help="only this district")
+    parser.add_argument('--from', dest='date_from', help="first inspection date (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='date_to', help="last inspection date (YYYY-MM-DD)")
+    parser.add_argument('--fast', action='store_true',
+                        help="complete_summary: read inspection_complete_summary_fast instead")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="rows per Parquet row group")
+    parser.add_argument('--dsn', help="connection string (default: run_migration DB_CONFIG)")
+    args = parser.parse_args()
+
+    path = args.output or f"{args.dataset}.{args.format}"
+    try:
+        conn = connect(args.dsn)
+        export(
+            conn, args.dataset, args.format, path, args.chunk_size,
+            province=args.province, district=args.district,
+            date_from=args.date_from, date_to=args.date_to, fast=args.fast
+        )
+        conn.close()
+    except Exception as e:
+        logging.error(f"Export failed: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Index usage audit and consolidation advisor
+
+Every form submission inserts into inspection_sessions, and every index on the
+table adds to the cost of that write. This script reads pg_stat_user_indexes,
+index sizes and column statistics (optionally after replaying the benchmark
+query catalogue) and reports indexes that are:
+  - unused: no scans during the replayed workload (--run-workload), or no
+    scans in statistics covering at least --min-stats-age days,
+  - redundant: same columns as another index, or a leading prefix of a composite,
+  - low-cardinality: a single column with only a handful of distinct values
+    (reported only: such an index is dropped when it is also unused).
+
+Unused and redundant indexes are proposed for removal; a redundant one is
+served by the composite that covers it. An index with scans is never dropped
+without a replacement. Lifetime scan counts of zero mean nothing on a fresh
+database or right after a statistics reset, so without --run-workload no
+index is called unused until the statistics are --min-stats-age days old. An expression index
+(e.g. the search_key() GIN indexes of 06) is reported with its definition but
+never proposed for removal: its columns are unknown.
+
+With --partial, used btree indexes are also rebuilt as partial indexes
+WHERE is_active = true. Only do this when every query that needs the index
+filters on is_active = true: any other query loses the index.
+
+The proposals are written as a migration that uses CREATE/DROP INDEX
+CONCURRENTLY, so the table stays writable while it runs.
+
+Usage:
+    python3 index_advisor.py --dsn "dbname=plp_456_bench" --run-workload
+    python3 index_advisor.py --dsn "dbname=plp_456" --output index_consolidation.sql
+    python3 index_advisor.py --dsn "dbname=plp_456" --partial --apply
+"""
+
+import sys
+import time
+import random
+import argparse
+import logging
+from datetime import datetime, timezone
+
+from run_migration import connect
+from benchmark import time_queries
+
+# Filter shared by every view and reporting function on the table
+ACTIVE_PREDICATE = 'is_active = true'
+
+# Leading columns with at most this many distinct values are low-cardinality
+LOW_CARDINALITY = 10
+
+# Days of statistics needed before zero lifetime scans count as unused
+MIN_STATS_AGE_DAYS = 7
+
+INDEX_SQL = """
+    SELECT
+        i.relname as index_name,
+        ARRAY(
+            SELECT a.attname
+            FROM unnest(x.indkey) WITH ORDINALITY AS k(attnum, position)
+            JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum
+            ORDER BY k.position
+        )::text[] as columns,
+        0 = ANY(x.indkey::int2[]) as has_expressions,
+        pg_get_indexdef(x.indexrelid) as definition,
+        am.amname as method,
+        x.indisunique as is_unique,
+        x.indisprimary as is_primary,
+        pg_get_expr(x.indpred, x.indrelid) as predicate,
+        pg_relation_size(x.indexrelid) as size_bytes,
+        COALESCE(s.idx_scan, 0) as idx_scan,
+        COALESCE(s.idx_tup_read, 0) as idx_tup_read
+    FROM pg_index x
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_am am ON am.oid = i.relam
+    LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = x.indexrelid
+    WHERE x.indrelid = %s::regclass
+    ORDER BY i.relname;
+"""
+
+def index_inventory(conn, table):
+    """Indexes of table with their columns, size and cumulative scan counts
+
+    indkey is 0 for an expression, so the columns of an expression index are
+    unknown: they are left empty and the index is described by its definition.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_stat_clear_snapshot();")
+        cursor.execute(INDEX_SQL, (table,))
+        columns = [desc[0] for desc in cursor.description]
+        indexes = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    conn.rollback()
+    for index in indexes:
+        if index['has_expressions']:
+            index['columns'] = []
+    return indexes
+
+def table_profile(conn, table):
+    """Row count, write counters, active fraction and per-column distinct counts"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT n_live_tup, n_tup_ins, n_tup_upd, n_tup_del, pg_total_relation_size(relid),
+                   (SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()),
+                   pg_postmaster_start_time(), now()
+            FROM pg_stat_user_tables WHERE relid = %s::regclass;
+        """, (table,))
+        live, inserts, updates, deletes, total_size, stats_reset, started, now = cursor.fetchone()
+        cursor.execute(f"SELECT COUNT(*), COUNT(*) FILTER (WHERE {ACTIVE_PREDICATE}) FROM {table};")
+        rows, active = cursor.fetchone()
+        cursor.execute("""
+            SELECT attname, n_distinct FROM pg_stats
+            WHERE schemaname = 'public' AND tablename = %s;
+        """, (table,))
+        # Negative n_distinct is a fraction of the row count
+        distinct = {
+            name: (n if n >= 0 else -n * rows) for name, n in cursor.fetchall()
+        }
+    conn.rollback()
+    return {
+        'rows': rows,
+        'live_tuples': live,
+        'writes': inserts + updates + deletes,
+        'total_size_bytes': total_size,
+        'active_fraction': round(active / rows, 4) if rows else None,
+        'stats_reset': stats_reset.isoformat() if stats_reset else None,
+        # Statistics may be older when never reset, but not reliably: count from server start
+        'stats_age_days': round((now - (stats_reset or started)).total_seconds() / 86400, 2),
+        'distinct': distinct
+    }
+
+def run_workload(dsn, table, iterations, seed):
+    """Replay the benchmark catalogue on its own connection; returns idx_scan deltas"""
+    probe = connect(dsn)
+    before = {i['index_name']: i['idx_scan'] for i in index_inventory(probe, table)}
+
+    workload = connect(dsn)
+    logging.info(f"Replaying the benchmark query catalogue ({iterations} calls per query)")
+    time_queries(workload, random.Random(seed), iterations)
+    # Backends flush their statistics on exit
+    workload.close()
+    time.sleep(1)
+
+    after = {i['index_name']: i['idx_scan'] for i in index_inventory(probe, table)}
+    probe.close()
+    return {name: after.get(name, 0) - scans for name, scans in before.items()}
+
+def is_droppable(index):
+    """Indexes that back a constraint, or whose columns are unknown, are never proposed for removal"""
+    return bool(index['columns']) and not (index['is_unique'] or index['is_primary'])
+
+def covering_index(index, indexes, unused):
+    """Another kept btree index whose leading columns repeat this one's, if any"""
+    for other in indexes:
+        if other is index or other['method'] != 'btree' or index['method'] != 'btree':
+            continue
+        if not index['columns'] or not other['columns']:
+            continue
+        if other['index_name'] in unused:
+            continue
+        if other['predicate'] != index['predicate']:
+            continue
+        width = len(index['columns'])
+        if other['columns'][:width] != index['columns']:
+            continue
+        # Identical definitions: keep the alphabetically first one
+        if len(other['columns']) == width and other['index_name'] > index['index_name']:
+            continue
+        return other
+    return None
+
+def audit(indexes, profile, workload_scans=None, min_stats_age_days=MIN_STATS_AGE_DAYS):
+    """Classify each index; returns a list of findings dicts
+
+    reasons justify dropping the index; notes are reported only.
+    """
+    def workload_for(index):
+        return workload_scans.get(index['index_name']) if workload_scans is not None else None
+
+    # Zero scans only count once the workload was replayed or the statistics are old enough
+    trusted = workload_scans is not None or profile['stats_age_days'] >= min_stats_age_days
+
+    def is_unused(index):
+        return trusted and index['idx_scan'] == 0 and not workload_for(index)
+
+    unused = {index['index_name'] for index in indexes if is_droppable(index) and is_unused(index)}
+    findings = []
+    for index in indexes:
+        scans = index['idx_scan']
+        workload = workload_for(index)
+        reasons = []
+        notes = []
+        if is_droppable(index):
+            if index['index_name'] in unused:
+                reasons.append('unused')
+            covering = covering_index(index, indexes, unused)
+            if covering is not None:
+                reasons.append(f"redundant with {covering['index_name']}")
+            leading = profile['distinct'].get(index['columns'][0])
+            if len(index['columns']) == 1 and leading is not None and leading <= LOW_CARDINALITY:
+                notes.append(f"low-cardinality ({int(leading)} distinct values)")
+        findings.append({
+            'index': index['index_name'],
+            'columns': index['columns'],
+            'definition': index['definition'],
+            'predicate': index['predicate'],
+            'size_bytes': index['size_bytes'],
+            'idx_scan': scans,
+            'workload_scans': workload,
+            'reasons': reasons,
+            'notes': notes
+        })
+    return findings
+
+def propose(table, indexes, findings, partial=False):
+    """(create, drop) statement lists that consolidate the table's indexes
+
+    Used, non-redundant btree indexes are only rebuilt as partial indexes when
+    partial is set.
+    """
+    by_name = {index['index_name']: index for index in indexes}
+    creates = []
+    drops = []
+    for finding in findings:
+        index = by_name[finding['index']]
+        if not is_droppable(index):
+            continue
+        if finding['reasons']:
+            drops.append(f"DROP INDEX CONCURRENTLY IF EXISTS {index['index_name']};")
+            continue
+        if partial and index['method'] == 'btree' and index['predicate'] is None:
+            # Used and not redundant: rebuild it to cover only rows the reports read
+            partial_name = f"{index['index_name']}_active"
+            if partial_name not in by_name:
+                creates.append(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partial_name} "
+                    f"ON {table}({', '.join(index['columns'])}) WHERE {ACTIVE_PREDICATE};"
+                )
+                drops.append(f"DROP INDEX CONCURRENTLY IF EXISTS {index['index_name']};")
+    return creates, drops
+
+def render_migration(table, creates, drops, profile):
+    """Migration file text: new indexes first, so queries always have one to use"""
+    lines = [
+        f"-- Index consolidation for {table}",
+        f"-- Generated by index_advisor.py on {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M UTC')}",
+        f"-- {profile['rows']} rows, {profile['active_fraction']} active; statistics since {profile['stats_reset'] or 'cluster start'}",
+        "-- CONCURRENTLY cannot run inside a transaction block: apply with",
+        "--     psql -f <this file>   or   python3 index_advisor.py --dsn <database> --apply",
+        ""
+    ]
+    if creates:
+        lines.append(f"-- Partial replacements (--partial: only for queries filtering on {ACTIVE_PREDICATE})")
+        lines.extend(creates)
+        lines.append("")
+    if drops:
+        lines.append("-- Unused, redundant or superseded indexes")
+        lines.extend(drops)
+        lines.append("")
+    lines.append(f"ANALYZE {table};")
+    return '\n'.join(lines) + '\n'
+
+def apply_statements(dsn, statements):
+    """Run statements one by one in autocommit mode, as CONCURRENTLY requires"""
+    conn = connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        for statement in statements:
+            started = time.monotonic()
+            cursor.execute(statement)
+            logging.info(f"  {statement} ({time.monotonic() - started:.2f}s)")
+    conn.close()
+
+def print_report(table, profile, findings, creates, drops):
+    """Human-readable summary of the audit"""
+    total = sum(f['size_bytes'] for f in findings)
+    print(f"\nIndexes on {table}: {len(findings)} ({total / 1024 / 1024:.1f} MB), "
+          f"{profile['rows']} rows, {profile['writes']} writes since statistics reset")
+    print(f"Active rows: {profile['active_fraction']}; statistics cover {profile['stats_age_days']} days")
+    print("-" * 100)
+    for f in findings:
+        workload = '-' if f['workload_scans'] is None else f['workload_scans']
+        print(
+            f"{f['index']:<40} {f['size_bytes'] / 1024:>10.0f} kB  scans {f['idx_scan']:>8}  "
+            f"workload {workload:>6}  {'; '.join(f['reasons']) or 'keep'}"
+            + (f" ({'; '.join(f['notes'])})" if f['notes'] else '')
+        )
+        if not f['columns']:
+            print(f"    {f['definition']}")
+    reclaimed = sum(f['size_bytes'] for f in findings if f['reasons'])
+    print("-" * 100)
+    print(f"{len(creates)} index(es) to create, {len(drops)} to drop; "
+          f"{reclaimed / 1024 / 1024:.1f} MB of unused or redundant indexes")
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit and consolidate indexes on a table")
+    parser.add_argument('--dsn', help="connection string (default: run_migration DB_CONFIG)")
+    parser.add_argument('--table', default='inspection_sessions', help="table to audit")
+    parser.add_argument('--run-workload', action='store_true',
+                        help="replay the benchmark query catalogue and count index scans it causes")
+    parser.add_argument('--iterations', type=int, default=20, help="workload calls per query")
+    parser.add_argument('--seed', type=int, default=456, help="random seed for workload parameters")
+    parser.add_argument('--min-stats-age', type=float, default=MIN_STATS_AGE_DAYS,
+                        help="without --run-workload, days of statistics needed to call an index unused")
+    parser.add_argument('--partial', action='store_true',
+                        help=f"rebuild used btree indexes as partial indexes WHERE {ACTIVE_PREDICATE}")
+    parser.add_argument('--output', default='index_consolidation.sql', help="migration file to write")
+    parser.add_argument('--apply', action='store_true', help="run the proposed statements now (requires --dsn)")
+    args = parser.parse_args()
+    if args.apply and not args.dsn:
+        parser.error("--apply changes indexes; name the database explicitly with --dsn")
+
+    try:
+        workload_scans = None
+        if args.run_workload:
+            workload_scans = run_workload(args.dsn, args.table, args.iterations, args.seed)
+        conn = connect(args.dsn)
+        indexes = index_inventory(conn, args.table)
+        profile = table_profile(conn, args.table)
+        conn.close()
+    except Exception as e:
+        logging.error(f"Index audit failed: {e}")
+        sys.exit(1)
+
+    if workload_scans is None and profile['stats_age_days'] < args.min_stats_age:
+        logging.warning(
+            f"Statistics cover {profile['stats_age_days']} days, less than --min-stats-age "
+            f"{args.min_stats_age:g}: no index is reported unused; use --run-workload"
+        )
+    findings = audit(indexes, profile, workload_scans, args.min_stats_age)
+    creates, drops = propose(args.table, indexes, findings, args.partial)
+    print_report(args.table, profile, findings, creates, drops)
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        file.write(render_migration(args.table, creates, drops, profile))
+    logging.info(f"Proposed migration written to {args.output}")
+
+    if args.apply and (creates or drops):
+        try:
+            apply_statements(args.dsn, creates + drops + [f"ANALYZE {args.table};"])
+        except Exception as e:
+            logging.error(f"Applying index changes failed: {e}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+In-process cache of the evaluation indicators in master_fields
+
+Every evaluation form render calls get_indicators_by_level(), reads
+master_fields_grouped or runs search_indicators(), although the 22 indicators
+almost never change. IndicatorCatalogue loads master_fields once and answers
+these lookups from memory:
+  - by_level(level)        rows of get_indicators_by_level(level)
+  - grouped()              rows of master_fields_grouped
+  - search(term)           rows of search_indicators(term), term taken literally
+  - by_sequence(sequence), by_field_id(field_id), by_main(indicator_main)
+
+The catalogue LISTENs on master_fields_changed, which 07_master_fields_notify.sql
+signals from the master_fields triggers when an edit commits. Every lookup
+first checks for pending notifications without blocking, so a committed edit
+is visible on the next lookup after it arrives. If the connection drops,
+notifications may have been missed, so the catalogue reconnects and reloads.
+
+Usage:
+    python3 indicator_catalogue.py --level 2
+    python3 indicator_catalogue.py --watch
+    python3 indicator_catalogue.py --benchmark 10000
+"""
+
+import sys
+import time
+import select
+import argparse
+import logging
+import threading
+
+import psycopg2
+
+from run_migration import connect
+
+CHANNEL = 'master_fields_changed'
+
+CATALOGUE_SQL = """
+    SELECT field_id, indicator_sequence, indicator_main, indicator_main_en,
+           indicator_sub, indicator_sub_en, evaluation_level, scoring_options,
+           ai_context, is_active
+    FROM master_fields
+    ORDER BY indicator_sequence;
+"""
+
+class IndicatorCatalogue:
+    """master_fields held in memory, reloaded on change notifications"""
+
+    def __init__(self, dsn=None):
+        self.dsn = dsn
+        self.conn = None
+        self.lock = threading.Lock()
+        self.rows = None
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'notifications': 0, 'reconnects': 0}
+
+    def open(self):
+        """Connect and LISTEN; the catalogue is loaded by the first lookup"""
+        self.conn = connect(self.dsn)
+        self.conn.autocommit = True
+        # Listen before loading, so an edit committed during the load is not missed
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL};")
+        self.rows = None
+
+    def close(self):
+        """Close the listening connection"""
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+
+    def load(self):
+        """Read master_fields into memory"""
+        with self.conn.cursor() as cursor:
+            cursor.execute(CATALOGUE_SQL)
+            columns = [desc[0] for desc in cursor.description]
+            self.rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def check_notifications(self):
+        """Drop the cached rows if a change was committed since the last check"""
+        try:
+            self.conn.poll()
+        except psycopg2.OperationalError as e:
+            logging.warning(f"Indicator catalogue connection lost ({str(e).strip()}); reconnecting")
+            self.stats['reconnects'] += 1
+            self.close()
+            self.open()
+            return
+        if self.conn.notifies:
+            self.stats['notifications'] += len(self.conn.notifies)
+            self.conn.notifies.clear()
+            if self.rows is not None:
+                self.stats['refreshes'] += 1
+                self.rows = None
+
+    def current(self):
+        """The cached rows, loading them on a miss"""
+        with self.lock:
+            if self.conn is None or self.conn.closed:
+                self.open()
+            self.check_notifications()
+            if self.rows is None:
+                self.stats['misses'] += 1
+                self.load()
+            else:
+                self.stats['hits'] += 1
+            return self.rows
+
+    def active(self):
+        """Active indicators in sequence order"""
+        return [row for row in self.current() if row['is_active']]
+
+    def by_level(self, level):
+        """Same rows as get_indicators_by_level(level)"""
+        return [
+            {
+                'field_id': row['field_id'],
+                'sequence': row['indicator_sequence'],
+                'main_indicator_km': row['indicator_main'],
+                'main_indicator_en': row['indicator_main_en'],
+                'sub_indicator_km': row['indicator_sub'],
+                'sub_indicator_en': row['indicator_sub_en'],
+                'ai_context': row['ai_context'],
+            }
+            for row in self.active() if row['evaluation_level'] == level
+        ]
+
+    def grouped(self):
+        """Same rows as the master_fields_grouped view"""
+        groups = {}
+        for row in self.active():
+            key = (row['indicator_main'], row['indicator_main_en'], row['evaluation_level'])
+            groups.setdefault(key, []).append(row)
+        return [
+            {
+                'indicator_main': main,
+                'indicator_main_en': main_en,
+                'evaluation_level': level,
+                'sub_indicator_count': len(rows),
+                'sub_indicators': [
+                    {
+                        'sequence': row['indicator_sequence'],
+                        'sub_indicator_km': row['indicator_sub'],
+                        'sub_indicator_en': row['indicator_sub_en'],
+                        'ai_context': row['ai_context'],
+                    }
+                    for row in rows
+                ],
+            }
+            # Rows are in sequence order, so groups are in order of their first sequence
+            for (main, main_en, level), rows in groups.items()
+        ]
+
+    def search(self, term):
+        """Same rows as search_indicators(term), with term matched literally"""
+        needle = term.lower()
+        return [
+            {
+                'field_id': row['field_id'],
+                'sequence': row['indicator_sequence'],
+                'main_indicator_km': row['indicator_main'],
+                'main_indicator_en': row['indicator_main_en'],
+                'sub_indicator_km': row['indicator_sub'],
+                'sub_indicator_en': row['indicator_sub_en'],
+                'evaluation_level': row['evaluation_level'],
+            }
+            for row in self.active()
+            if any(
+                needle in (row[column] or '').lower()
+                for column in ('indicator_main', 'indicator_main_en', 'indicator_sub', 'indicator_sub_en')
+            )
+        ]
+
+    def by_sequence(self, sequence):
+        """The indicator with this sequence number, or None"""
+        return next((row for row in self.current() if row['indicator_sequence'] == sequence), None)
+
+    def by_field_id(self, field_id):
+        """The indicator with this field_id, or None"""
+        return next((row for row in self.current() if row['field_id'] == field_id), None)
+
+    def by_main(self, indicator_main):
+        """Active sub-indicators of a main indicator (Khmer or English name)"""
+        return [
+            row for row in self.active()
+            if indicator_main in (row['indicator_main'], row['indicator_main_en'])
+        ]
+
+    def wait(self, timeout):
+        """Block until a notification arrives or timeout seconds pass"""
+        if self.conn is None or self.conn.closed:
+            self.open()
+        select.select([self.conn], [], [], timeout)
+
+def benchmark(catalogue, dsn, calls):
+    """Time by_level() against get_indicators_by_level() on a connection"""
+    conn = connect(dsn)
+    with conn.cursor() as cursor:
+        started = time.perf_counter()
+        for call in range(calls):
+            cursor.execute("SELECT * FROM get_indicators_by_level(%s);", (call % 3 + 1,))
+            cursor.fetchall()
+        database_ms = (time.perf_counter() - started) * 1000
+    conn.close()
+    started = time.perf_counter()
+    for call in range(calls):
+        catalogue.by_level(call % 3 + 1)
+    cached_ms = (time.perf_counter() - started) * 1000
+    logging.info(
+        f"{calls} lookups: get_indicators_by_level {database_ms / calls:.3f} ms/call, "
+        f"catalogue {cached_ms / calls:.4f} ms/call"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory evaluation indicator catalogue")
+    parser.add_argument('--level', type=int, choices=[1, 2, 3], help="print the indicators of a level")
+    parser.add_argument('--watch', action='store_true', help="print the catalogue again on every change")
+    parser.add_argument('--benchmark', type=int, metavar='CALLS', help="compare with get_indicators_by_level()")
+    parser.add_argument('--dsn', help="connection string (default: run_migration DB_CONFIG)")
+    args = parser.parse_args()
+
+    catalogue = IndicatorCatalogue(args.dsn)
+    try:
+        if args.benchmark:
+            benchmark(catalogue, args.dsn, args.benchmark)
+        elif args.watch:
+            logging.info(f"{len(catalogue.active())} active indicators; waiting for changes (Ctrl+C to stop)")
+            while True:
+                catalogue.wait(60)
+                refreshes = catalogue.stats['refreshes']
+                rows = catalogue.active()
+                if catalogue.stats['refreshes'] != refreshes:
+                    logging.info(f"master_fields changed: {len(rows)} active indicators")
+        else:
+            for row in catalogue.by_level(args.level) if args.level else catalogue.active():
+                print(f"{row['sequence'] if args.level else row['indicator_sequence']:>3}  "
+                      f"{row['sub_indicator_en'] if args.level else row['indicator_sub_en']}")
+        logging.info(f"Catalogue counters: {catalogue.stats}")
+    except KeyboardInterrupt:
+        logging.info(f"Catalogue counters: {catalogue.stats}")
+    except Exception as e:
+        logging.error(f"Indicator catalogue failed: {e}")
+        sys.exit(1)
+    finally:
+        catalogue.close()
+
+if __name__ == "__main__":
+    main()
@@ -216,8 +216,28 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
--- 9. Verify migration
-\echo 'Step 9: Verifying migration...'
+-- 9. Create incrementally maintained summary tables
+\echo 'Step 9: Creating summary aggregate tables...'
+\i 04_inspection_summary_aggregates.sql
+
+-- 10. Prepare the partitioned inspection_sessions (repartition.py moves the rows)
+\echo 'Step 10: Preparing partitioned inspection sessions table...'
+\i 05_partitioned_inspection_sessions.sql
+
+-- 11. Create trigram search indexes and the search functions that use them
+\echo 'Step 11: Creating search indexes...'
+\i 06_search_indexes.sql
+
+-- 12. Notify indicator caches when master_fields changes
+\echo 'Step 12: Creating master fields change notifications...'
+\i 07_master_fields_notify.sql
+
+-- 13. Fix the subjects_taught type of get_school_statistics()
+\echo 'Step 13: Updating get_school_statistics...'
+\i 08_school_statistics_subjects.sql
+
+-- 14. Verify migration
+\echo 'Step 14: Verifying migration...'
 
 -- Check tables exist
 SELECT 
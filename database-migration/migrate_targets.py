@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Apply the migrations to several databases at once
+
+Production, staging and the per-province training copies all carry the same
+schema. Instead of running run_migration.py against each of them in turn,
+this script migrates all of them concurrently, so a rollout takes about as
+long as the slowest database:
+
+  - Targets come from a JSON file ({"name": "dsn", ...}) given with --targets,
+    or from the MIGRATION_TARGETS environment variable as name=dsn entries
+    separated by semicolons.
+  - At most --parallel targets are migrated at a time, each in its own thread.
+    Each target keeps one pooled connection, reused for the ledger, every step
+    and the verification. A broken connection is replaced on the next attempt.
+  - A target whose migration fails is retried up to --retries times with
+    exponential backoff. The ledger records every applied step, so a retry
+    resumes at the first pending step. A target refusing an edited step
+    (see --reapply-changed) is not retried.
+  - run_migrations() takes an advisory lock per database, so this script and
+    run_migration.py never migrate the same database at the same time. A
+    target locked by another runner is retried like a failed one.
+
+At the end a consolidated report lists every step's duration per target and
+each target's outcome, and --report writes it as JSON.
+
+Usage:
+    python3 migrate_targets.py --targets targets.json --parallel 8
+    MIGRATION_TARGETS="staging=host=10.0.0.5 dbname=plp_456;training_kandal=host=10.0.1.7 dbname=plp_456" \\
+        python3 migrate_targets.py --report rollout.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2 import pool
+
+from run_migration import run_migrations, verify_migration, migration_steps
+
+TARGETS_ENV = 'MIGRATION_TARGETS'
+
+# Base delay of the backoff between attempts on one target
+RETRY_DELAY_S = 2.0
+
+def load_targets(path=None):
+    """{name: dsn} from a JSON file, or from MIGRATION_TARGETS"""
+    if path:
+        with open(path, 'r', encoding='utf-8') as file:
+            targets = json.load(file)
+        if not isinstance(targets, dict):
+            raise ValueError(f"{path} must contain a JSON object of name: dsn")
+        return targets
+    targets = {}
+    for entry in os.environ.get(TARGETS_ENV, '').split(';'):
+        if entry.strip():
+            name, _, dsn = entry.strip().partition('=')
+            if not dsn:
+                raise ValueError(f"{TARGETS_ENV} entry {entry.strip()!r} is not name=dsn")
+            targets[name.strip()] = dsn.strip()
+    return targets
+
+class TargetPrefix(logging.Filter):
+    """Prefix log lines written by a target's thread with the target name"""
+
+    def __init__(self, names):
+        super().__init__()
+        self.names = set(names)
+
+    def filter(self, record):
+        name = threading.current_thread().name
+        if name in self.names:
+            record.msg = f"[{name}] {record.msg}"
+        return True
+
+class Target:
+    """One database to migrate, with its pooled connection"""
+
+    def __init__(self, name, dsn):
+        self.name = name
+        self.dsn = dsn
+        self.pool = pool.SimpleConnectionPool(0, 1, dsn)
+
+    def getconn(self):
+        """The pooled connection, usable and not inside a transaction"""
+        conn = self.pool.getconn()
+        if conn.closed:
+            self.pool.putconn(conn, close=True)
+            conn = self.pool.getconn()
+        conn.rollback()
+        return conn
+
+    def putconn(self, conn, broken=False):
+        """Return the connection to the pool, discarding it when broken"""
+        self.pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def close(self):
+        """Close the pooled connection"""
+        self.pool.closeall()
+
+def migrate_target(target, retries, reapply_changed, online):
+    """Migrate one target; returns its report entry"""
+    threading.current_thread().name = target.name
+    entry = {'target': target.name, 'status': None, 'attempts': 0, 'steps': [], 'errors': []}
+    started = time.monotonic()
+    for attempt in range(retries + 1):
+        entry['attempts'] = attempt + 1
+        if attempt:
+            delay = RETRY_DELAY_S * 2 ** (attempt - 1) * (1 + random.random())
+            logging.warning(f"Retrying in {delay:.1f}s (attempt {attempt + 1} of {retries + 1})")
+            time.sleep(delay)
+        conn = None
+        broken = False
+        try:
+            conn = target.getconn()
+            results = run_migrations(conn, reapply_changed=reapply_changed, online=online)
+            # Keep the durations of steps applied by earlier attempts
+            applied = {step['step']: step for step in entry['steps'] if step['status'] == 'applied'}
+            entry['steps'] = [
+                applied[result['step']] if result['status'] == 'skipped' and result['step'] in applied else result
+                for result in results
+            ]
+            failed = [result for result in results if result['status'] not in ('applied', 'skipped')]
+            if not failed:
+                entry['status'] = 'migrated' if verify_migration(conn) else 'verification failed'
+                break
+            if failed[0]['status'] == 'locked':
+                entry['errors'].append("another migration is running against this database")
+            else:
+                entry['errors'].append(f"step {failed[0]['step']} {failed[0]['status']}")
+            if failed[0]['status'] == 'changed':
+                entry['status'] = 'refused changed step'
+                break
+            entry['status'] = 'failed'
+        except (psycopg2.Error, RuntimeError) as e:
+            broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            logging.error(f"Attempt {attempt + 1} failed: {str(e).strip()}")
+            entry['errors'].append(str(e).strip())
+            entry['status'] = 'failed'
+        finally:
+            if conn is not None:
+                target.putconn(conn, broken)
+    entry['duration_ms'] = int((time.monotonic() - started) * 1000)
+    logging.info(f"Finished: {entry['status']} after {entry['attempts']} attempt(s), {entry['duration_ms']} ms")
+    return entry
+
+def migrate_all(targets, parallel=4, retries=2, reapply_changed=False, online=None):
+    """Migrate every target concurrently; returns the consolidated report"""
+    prefix = TargetPrefix(targets)
+    logging.getLogger().addFilter(prefix)
+    started = time.monotonic()
+    opened = {name: Target(name, dsn) for name, dsn in targets.items()}
+    try:
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            futures = [
+                executor.submit(migrate_target, target, retries, reapply_changed, online)
+                for target in opened.values()
+            ]
+            entries = [future.result() for future in futures]
+    finally:
+        for target in opened.values():
+            target.close()
+        logging.getLogger().removeFilter(prefix)
+    return {
+        'duration_ms': int((time.monotonic() - started) * 1000),
+        'steps': [step_name for step_name, _ in migration_steps() or []],
+        'targets': entries,
+    }
+
+def print_report(report):
+    """Log a step x target table of durations, then each target's outcome"""
+    entries = report['targets']
+    width = max([len(entry['target']) for entry in entries] + [10])
+    logging.info("Step durations (ms; '-' skipped, '!' failed or refused, blank not reached):")
+    logging.info(f"  {'step':<40} " + ' '.join(f"{entry['target']:>{width}}" for entry in entries))
+    for step_name in report['steps']:
+        cells = []
+        for entry in entries:
+            result = next((step for step in entry['steps'] if step['step'] == step_name), None)
+            if result is None:
+                cells.append('')
+            elif result['status'] == 'applied':
+                cells.append(str(result['duration_ms']))
+            elif result['status'] == 'skipped':
+                cells.append('-')
+            else:
+                cells.append('!')
+        logging.info(f"  {step_name:<40} " + ' '.join(f"{cell:>{width}}" for cell in cells))
+    for entry in entries:
+        line = f"  {entry['target']:<{width}} {entry['status']:<22} {entry['attempts']} attempt(s) {entry['duration_ms']:>8} ms"
+        if entry['status'] != 'migrated' and entry['errors']:
+            line += f"  last error: {entry['errors'][-1]}"
+        logging.info(line)
+    logging.info(f"Total wall time: {report['duration_ms']} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply MENTOR database migrations to several databases concurrently")
+    parser.add_argument('--targets', help=f"JSON file of name: dsn (default: ${TARGETS_ENV})")
+    parser.add_argument('--only', help="comma-separated target names to migrate")
+    parser.add_argument('--parallel', type=int, default=4, help="targets migrated at the same time")
+    parser.add_argument('--retries', type=int, default=2, help="extra attempts per failing target")
+    parser.add_argument('--reapply-changed', action='store_true',
+                        help="re-run steps whose SQL changed after they were applied")
+    parser.add_argument('--online', action='store_true',
+                        help="split steps into statements, build indexes CONCURRENTLY and retry on lock timeouts")
+    parser.add_argument('--report', help="write the consolidated report as JSON")
+    args = parser.parse_args()
+
+    try:
+        targets = load_targets(args.targets)
+    except (OSError, ValueError) as e:
+        logging.error(f"Cannot read targets: {e}")
+        sys.exit(1)
+    if args.only:
+        names = args.only.split(',')
+        unknown = [name for name in names if name not in targets]
+        if unknown:
+            parser.error(f"unknown targets: {', '.join(unknown)}")
+        targets = {name: targets[name] for name in names}
+    if not targets:
+        parser.error(f"no targets: give --targets or set {TARGETS_ENV}")
+
+    online = None
+    if args.online:
+        from online_ddl import LOCK_TIMEOUT_MS, STATEMENT_TIMEOUT_MS, LOCK_RETRIES
+        online = {
+            'lock_timeout_ms': LOCK_TIMEOUT_MS,
+            'statement_timeout_ms': STATEMENT_TIMEOUT_MS,
+            'retries': LOCK_RETRIES
+        }
+
+    logging.info(f"Migrating {len(targets)} target(s), {args.parallel} at a time")
+    report = migrate_all(targets, args.parallel, args.retries, args.reapply_changed, online)
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        logging.info(f"Report written to {args.report}")
+    failed = [entry['target'] for entry in report['targets'] if entry['status'] != 'migrated']
+    if failed:
+        logging.error(f"{len(failed)} target(s) not migrated: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
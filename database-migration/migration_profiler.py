@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Per-statement profiling of migration steps
+
+apply_step() sends a whole migration file to the server at once, so a slow
+deploy only shows up as one slow step. The profiler splits each step into
+statements (online_ddl.split_statements) and runs them one at a time in the
+step's transaction, recording for each statement:
+
+  - wall time, and the rows it affected with its command tag
+  - WAL bytes, as the difference of pg_current_wal_insert_lsn() around the
+    statement. The WAL position is server-wide, so on a busy server this
+    includes other sessions' writes. On a scratch database it does not.
+  - time spent waiting, by wait event, sampled from pg_stat_activity every
+    SAMPLE_INTERVAL_MS on a second connection. Lock waits also record the
+    blocking backends and the lock that was requested.
+
+In a dry run every step runs in a single transaction that is rolled back at
+the end, and nothing is recorded in the ledger. Point it at a scratch copy of
+production, and the expensive steps show up before they run in production.
+
+Used through run_migration.py:
+    python3 run_migration.py --profile trace.json --profile-top 15
+    python3 run_migration.py --dsn "dbname=plp_456_scratch" --dry-run --profile trace.json
+"""
+
+import re
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+
+from online_ddl import split_statements, strip_comments
+
+SAMPLE_INTERVAL_MS = 20
+
+SAMPLE_SQL = """
+    SELECT a.wait_event_type, a.wait_event, pg_blocking_pids(a.pid),
+           (SELECT string_agg(DISTINCT COALESCE(l.relation::regclass::text, l.locktype) || ' ' || l.mode, ', ')
+            FROM pg_locks l WHERE l.pid = a.pid AND NOT l.granted)
+    FROM pg_stat_activity a
+    WHERE a.pid = %s;
+"""
+
+WAL_SQL = "SELECT pg_current_wal_insert_lsn();"
+
+def statement_label(statement, width=100):
+    """Statement text without comments on one line, shortened to width"""
+    text = ' '.join(re.sub(r'--[^\n]*', '', strip_comments(statement)).split())
+    return text if len(text) <= width else text[:width - 3] + '...'
+
+class WaitSampler(threading.Thread):
+    """Samples the wait events of one backend and adds them to the running statement"""
+
+    def __init__(self, dsn, pid, interval_ms=SAMPLE_INTERVAL_MS):
+        super().__init__(daemon=True)
+        from run_migration import connect
+
+        self.conn = connect(dsn)
+        self.conn.autocommit = True
+        self.pid = pid
+        self.interval = interval_ms / 1000
+        self.statement = None
+        self.stopping = threading.Event()
+
+    def run(self):
+        last = time.monotonic()
+        with self.conn.cursor() as cursor:
+            while not self.stopping.wait(self.interval):
+                cursor.execute(SAMPLE_SQL, (self.pid,))
+                row = cursor.fetchone()
+                now = time.monotonic()
+                elapsed_ms = (now - last) * 1000
+                last = now
+                statement = self.statement
+                if statement is None or row is None or row[0] is None:
+                    continue
+                wait_type, wait_event, blocking, requested = row
+                key = f"{wait_type}:{wait_event}"
+                statement['waits_ms'][key] = statement['waits_ms'].get(key, 0) + elapsed_ms
+                if wait_type == 'Lock':
+                    statement['lock_wait_ms'] += elapsed_ms
+                    statement['blocked_by'] = sorted(set(statement['blocked_by']) | set(blocking or []))
+                    if requested:
+                        statement['lock_requested'] = requested
+
+    def stop(self):
+        """Stop sampling and close the sampling connection"""
+        self.stopping.set()
+        self.join()
+        self.conn.close()
+
+class MigrationProfiler:
+    """Runs migration steps statement by statement and keeps the trace"""
+
+    def __init__(self, dsn=None, dry_run=False, sample_interval_ms=SAMPLE_INTERVAL_MS):
+        self.dsn = dsn
+        self.dry_run = dry_run
+        self.sample_interval_ms = sample_interval_ms
+        self.sampler = None
+        self.trace = {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'dry_run': dry_run,
+            'steps': [],
+        }
+
+    def start(self, conn):
+        """Start sampling the backend of conn"""
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid();")
+            pid = cursor.fetchone()[0]
+        conn.commit()
+        self.sampler = WaitSampler(self.dsn, pid, self.sample_interval_ms)
+        self.sampler.start()
+
+    def apply_step(self, conn, step_name, sql_content, checksum):
+        """Execute one step statement by statement; returns duration_ms, or None on failure
+
+        Outside a dry run the step is recorded in the ledger and committed like
+        run_migration.apply_step(). In a dry run the transaction stays open for
+        the next step and finish() rolls it back.
+        """
+        from run_migration import record_step
+
+        if self.sampler is None:
+            self.start(conn)
+        statements = split_statements(sql_content)
+        step = {'step': step_name, 'duration_ms': None, 'statements': []}
+        self.trace['steps'].append(step)
+        logging.info(f"Profiling migration: {step_name} ({len(statements)} statements)")
+        started = time.monotonic()
+        try:
+            with conn.cursor() as cursor:
+                for index, statement in enumerate(statements, 1):
+                    entry = {
+                        'index': index, 'statement': statement_label(statement), 'command': None,
+                        'rows': None, 'duration_ms': None, 'wal_bytes': None,
+                        'lock_wait_ms': 0, 'waits_ms': {}, 'blocked_by': [],
+                    }
+                    step['statements'].append(entry)
+                    cursor.execute(WAL_SQL)
+                    wal_before = cursor.fetchone()[0]
+                    self.sampler.statement = entry
+                    statement_started = time.monotonic()
+                    try:
+                        cursor.execute(statement)
+                    finally:
+                        entry['duration_ms'] = round((time.monotonic() - statement_started) * 1000, 1)
+                        self.sampler.statement = None
+                    entry['command'] = cursor.statusmessage
+                    entry['rows'] = cursor.rowcount if cursor.rowcount >= 0 else None
+                    cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), %s);", (wal_before,))
+                    entry['wal_bytes'] = int(cursor.fetchone()[0])
+                duration_ms = int((time.monotonic() - started) * 1000)
+                if not self.dry_run:
+                    record_step(cursor, step_name, checksum, duration_ms)
+            if not self.dry_run:
+                conn.commit()
+            step['duration_ms'] = duration_ms
+            logging.info(f"Successfully executed: {step_name} ({duration_ms} ms)")
+            return duration_ms
+        except Exception as e:
+            conn.rollback()
+            step['error'] = str(e).strip()
+            logging.error(f"Error executing {step_name}: {e}")
+            return None
+
+    def finish(self, conn):
+        """Stop sampling; in a dry run, roll back every profiled step"""
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+        if self.dry_run and not conn.closed:
+            conn.rollback()
+            logging.info("Dry run: all profiled steps rolled back")
+        for step in self.trace['steps']:
+            for entry in step['statements']:
+                entry['lock_wait_ms'] = round(entry['lock_wait_ms'], 1)
+                entry['waits_ms'] = {key: round(ms, 1) for key, ms in entry['waits_ms'].items()}
+
+    def write_trace(self, path):
+        """Write the full trace as JSON"""
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.trace, file, indent=2)
+        logging.info(f"Migration trace written to {path}")
+
+    def print_summary(self, top=10):
+        """Log per-step totals and the top slowest statements"""
+        entries = [
+            (entry, step['step'])
+            for step in self.trace['steps']
+            for entry in step['statements']
+            if entry['duration_ms'] is not None
+        ]
+        if not entries:
+            logging.info("No statements were profiled")
+            return
+        logging.info("Profiled steps:")
+        for step in self.trace['steps']:
+            statements = step['statements']
+            logging.info(
+                f"  {step['step']:<40} {len(statements):>4} statements "
+                f"{sum(e['duration_ms'] or 0 for e in statements):>10.1f} ms "
+                f"{sum(e['lock_wait_ms'] for e in statements):>9.1f} ms lock wait "
+                f"{sum(e['wal_bytes'] or 0 for e in statements) / 1048576:>9.2f} MB WAL"
+                + (f"  FAILED: {step['error']}" if 'error' in step else '')
+            )
+        logging.info(f"Top {min(top, len(entries))} slowest statements:")
+        logging.info(f"  {'ms':>10} {'lock ms':>9} {'WAL MB':>8} {'rows':>9}  step / statement")
+        for entry, step_name in sorted(entries, key=lambda item: item[0]['duration_ms'], reverse=True)[:top]:
+            rows = '' if entry['rows'] is None else entry['rows']
+            logging.info(
+                f"  {entry['duration_ms']:>10.1f} {entry['lock_wait_ms']:>9.1f} "
+                f"{(entry['wal_bytes'] or 0) / 1048576:>8.2f} {rows:>9}  "
+                f"{step_name} #{entry['index']}: {entry['statement']}"
+            )
+            if entry['blocked_by']:
+                logging.info(
+                    f"  {'':>10} waited for {entry.get('lock_requested', 'a lock')} "
+                    f"held by pid {', '.join(str(pid) for pid in entry['blocked_by'])}"
+                )
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Online (non-blocking) execution of migration steps
+
+By default run_migration.py sends a whole step to the server as one statement
+inside one transaction. Every lock that step takes is then held until the end
+of the step, and a plain CREATE INDEX blocks form submissions for the whole
+build. Online mode splits each step into statements and runs them as follows:
+
+  - CREATE INDEX becomes CREATE INDEX CONCURRENTLY and runs outside any
+    transaction. A build that fails leaves an INVALID index, which is dropped
+    before the build is retried.
+  - The other statements run in short transactions between the index builds.
+  - lock_timeout and statement_timeout are set on the session, so a statement
+    that queues behind an inspector's transaction gives up instead of blocking
+    every writer queued behind it. The transaction is then retried with
+    exponential backoff.
+  - Each lock that blocks writers (SHARE and stronger on a table) is recorded
+    from the statement that took it until commit, so the report shows exactly
+    how long writers were blocked.
+
+In a step containing DROP TABLE or a DROP ... CASCADE, committing the drop on
+its own would leave the objects it removes (and everything depending on them)
+missing if a later statement fails. All statements of such a step except its
+non-unique CREATE INDEX statements therefore run as one retried transaction
+with the same timeouts. Once it commits, the indexes are built CONCURRENTLY
+as above. A unique index stays in the transaction, since a later statement
+may depend on it (ON CONFLICT).
+
+Used through run_migration.py:
+    python3 run_migration.py --online --lock-timeout 2000 --statement-timeout 300000
+"""
+
+import re
+import time
+import random
+import logging
+
+import psycopg2
+from psycopg2 import errors
+
+# Locks that conflict with the ROW EXCLUSIVE lock taken by INSERT/UPDATE/DELETE
+WRITE_BLOCKING_MODES = (
+    'ShareLock', 'ShareRowExclusiveLock', 'ExclusiveLock', 'AccessExclusiveLock'
+)
+
+LOCKS_SQL = """
+    SELECT DISTINCT COALESCE(c.relname, '(dropped relations)'), l.mode
+    FROM pg_locks l
+    LEFT JOIN pg_class c ON c.oid = l.relation
+    WHERE l.pid = pg_backend_pid()
+      AND l.granted
+      AND l.locktype = 'relation'
+      AND l.mode = ANY(%s)
+      AND (c.oid IS NULL OR (c.relkind IN ('r', 'p') AND c.relpersistence <> 't'));
+"""
+
+CREATE_INDEX_RE = re.compile(
+    r'^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(?!CONCURRENTLY\b)(IF\s+NOT\s+EXISTS\s+)?(\w+)\s+ON\s+(?:ONLY\s+)?(\w+)',
+    re.I
+)
+
+DOLLAR_TAG_RE = re.compile(r'\$([A-Za-z_][A-Za-z0-9_]*)?\$')
+
+# Statements that remove objects a later statement of the step recreates
+DESTRUCTIVE_RE = re.compile(r'^\s*DROP\s+(?:TABLE\b|.*\bCASCADE\s*;?\s*$)', re.I | re.S)
+
+# Defaults for the run_migration.py options
+LOCK_TIMEOUT_MS = 2000
+STATEMENT_TIMEOUT_MS = 300000
+LOCK_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+
+def split_statements(sql):
+    """Split SQL into statements, respecting quotes, dollar quotes and comments"""
+    statements = []
+    start = 0
+    i = 0
+    length = len(sql)
+    while i < length:
+        char = sql[i]
+        if char == '-' and sql.startswith('--', i):
+            newline = sql.find('\n', i)
+            i = length if newline == -1 else newline + 1
+        elif char == '/' and sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = length if end == -1 else end + 2
+        elif char in ("'", '"'):
+            # Doubled quotes inside a literal are consumed as an empty literal next to it
+            end = sql.find(char, i + 1)
+            i = length if end == -1 else end + 1
+        elif char == '$':
+            match = DOLLAR_TAG_RE.match(sql, i)
+            if match:
+                end = sql.find(match.group(0), match.end())
+                i = length if end == -1 else end + len(match.group(0))
+            else:
+                i += 1
+        elif char == ';':
+            statements.append(sql[start:i + 1])
+            i += 1
+            start = i
+        else:
+            i += 1
+    statements.append(sql[start:])
+    return [s.strip() for s in statements if strip_comments(s).strip()]
+
+def strip_comments(statement):
+    """Statement text without leading -- and /* */ comments"""
+    text = statement.lstrip()
+    while text.startswith('--') or text.startswith('/*'):
+        if text.startswith('--'):
+            newline = text.find('\n')
+            text = '' if newline == -1 else text[newline + 1:].lstrip()
+        else:
+            end = text.find('*/')
+            text = '' if end == -1 else text[end + 2:].lstrip()
+    return text
+
+def index_build(cursor, statement):
+    """(index name, CONCURRENTLY statement) for a CREATE INDEX that can run online, else None"""
+    text = strip_comments(statement)
+    match = CREATE_INDEX_RE.match(text)
+    if not match:
+        return None
+    index_name, table = match.group(3), match.group(4)
+    # Partitioned tables do not support concurrent builds
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+    row = cursor.fetchone()
+    if row is not None and row[0] == 'p':
+        return None
+    return index_name, re.sub(r'^(\s*CREATE\s+(?:UNIQUE\s+)?INDEX)\s', r'\1 CONCURRENTLY ', text, count=1, flags=re.I)
+
+def deferrable_index(statement):
+    """True for a non-unique CREATE INDEX, which nothing later in its step can depend on"""
+    match = CREATE_INDEX_RE.match(strip_comments(statement))
+    return bool(match) and not match.group(1)
+
+def set_timeouts(conn, lock_timeout_ms, statement_timeout_ms):
+    """Set lock_timeout and statement_timeout for the session"""
+    conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SET lock_timeout = %s;", (f"{lock_timeout_ms}ms",))
+        cursor.execute("SET statement_timeout = %s;", (f"{statement_timeout_ms}ms",))
+    conn.autocommit = autocommit
+
+def reset_timeouts(conn):
+    """Restore the server defaults for lock_timeout and statement_timeout"""
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("RESET lock_timeout;")
+        cursor.execute("RESET statement_timeout;")
+    conn.autocommit = autocommit
+
+def run_transaction(conn, statements, ledger_row=None):
+    """Run statements in one transaction; returns [(relation, mode, held_ms)] of write-blocking locks"""
+    from run_migration import record_step
+
+    held_since = {}
+    with conn.cursor() as cursor:
+        for statement in statements:
+            started = time.monotonic()
+            cursor.execute(statement)
+            cursor.execute(LOCKS_SQL, (list(WRITE_BLOCKING_MODES),))
+            for relation, mode in cursor.fetchall():
+                strongest = held_since.get(relation)
+                if strongest is None:
+                    held_since[relation] = (mode, started)
+                elif WRITE_BLOCKING_MODES.index(mode) > WRITE_BLOCKING_MODES.index(strongest[0]):
+                    held_since[relation] = (mode, strongest[1])
+        if ledger_row is not None:
+            record_step(cursor, *ledger_row)
+    conn.commit()
+    committed = time.monotonic()
+    return [
+        (relation, mode, int((committed - since) * 1000))
+        for relation, (mode, since) in held_since.items()
+    ]
+
+def build_index(conn, index_name, statement):
+    """Run a CREATE INDEX CONCURRENTLY in autocommit mode; returns its duration in ms"""
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            # IF NOT EXISTS would keep an INVALID index left by an interrupted build
+            cursor.execute("""
+                SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(%s) AND NOT indisvalid;
+            """, (index_name,))
+            if cursor.fetchone():
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};")
+            started = time.monotonic()
+            try:
+                cursor.execute(statement)
+            except psycopg2.Error:
+                # A failed concurrent build leaves an INVALID index behind
+                cursor.execute("""
+                    SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(%s) AND NOT indisvalid;
+                """, (index_name,))
+                if cursor.fetchone():
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};")
+                raise
+            return int((time.monotonic() - started) * 1000)
+    finally:
+        conn.autocommit = False
+
+def with_retries(action, description, retries, backoff_base):
+    """Call action(), retrying with exponential backoff when a lock cannot be acquired"""
+    for attempt in range(retries + 1):
+        try:
+            return action()
+        except errors.LockNotAvailable as e:
+            if attempt == retries:
+                raise
+            delay = backoff_base * (2 ** attempt) * (1 + random.random())
+            logging.warning(
+                f"  {description}: lock not available ({str(e).strip()}); "
+                f"retry {attempt + 1}/{retries} in {delay:.1f}s"
+            )
+            time.sleep(delay)
+
+def apply_step_online(conn, step_name, sql_content, checksum, lock_timeout_ms=LOCK_TIMEOUT_MS,
+                      statement_timeout_ms=STATEMENT_TIMEOUT_MS, retries=LOCK_RETRIES,
+                      backoff_base=BACKOFF_BASE_SECONDS):
+    """Execute one step online; returns (duration_ms, lock report) or (None, lock report) on failure
+
+    The step is recorded in the ledger after its last statements, so a step
+    that fails part way is run again from the start on the next migration.
+    In steps with a destructive statement (DESTRUCTIVE_RE) every statement but
+    the deferrable index builds runs in one transaction, before the builds.
+    """
+    locks = []
+    started = time.monotonic()
+    try:
+        set_timeouts(conn, lock_timeout_ms, statement_timeout_ms)
+        statements = split_statements(sql_content)
+        logging.info(f"Executing migration online: {step_name} ({len(statements)} statements)")
+
+        def flush(pending):
+            """Run the statements collected so far as one retried transaction"""
+            def transaction():
+                try:
+                    return run_transaction(conn, pending)
+                except Exception:
+                    conn.rollback()
+                    raise
+
+            held = with_retries(transaction, f"{step_name}: transaction", retries, backoff_base)
+            for relation, mode, held_ms in held:
+                logging.info(f"  {mode} on {relation} held for {held_ms} ms")
+                locks.append({'relation': relation, 'mode': mode, 'held_ms': held_ms})
+
+        def build(statement):
+            """Build one index concurrently; returns False when it cannot run online"""
+            with conn.cursor() as cursor:
+                online = index_build(cursor, statement)
+            conn.rollback()
+            if online is None:
+                return False
+            index_name, concurrent_sql = online
+            duration_ms = with_retries(
+                lambda: build_index(conn, index_name, concurrent_sql),
+                f"{step_name}: {index_name}", retries, backoff_base
+            )
+            logging.info(f"  Built {index_name} concurrently in {duration_ms} ms (writes not blocked)")
+            locks.append({'relation': index_name, 'mode': 'CONCURRENTLY', 'held_ms': 0,
+                          'duration_ms': duration_ms})
+            return True
+
+        destructive = [s for s in statements if DESTRUCTIVE_RE.match(strip_comments(s))]
+        if destructive:
+            deferred = [s for s in statements if deferrable_index(s)]
+            logging.warning(
+                f"  {step_name} drops objects ({strip_comments(destructive[0]).splitlines()[0][:60]}); "
+                f"running its other statements as one transaction, then {len(deferred)} index build(s)"
+            )
+            flush([s for s in statements if not deferrable_index(s)])
+            for statement in deferred:
+                if not build(statement):
+                    flush([statement])
+        else:
+            pending = []
+            for statement in statements:
+                if not CREATE_INDEX_RE.match(strip_comments(statement)):
+                    pending.append(statement)
+                    continue
+                # Earlier statements may create the table, so commit them first
+                if pending:
+                    flush(pending)
+                    pending = []
+                if not build(statement):
+                    pending.append(statement)
+            if pending:
+                flush(pending)
+
+        duration_ms = int((time.monotonic() - started) * 1000)
+        run_transaction(conn, [], ledger_row=(step_name, checksum, duration_ms))
+        logging.info(f"Successfully executed: {step_name} ({duration_ms} ms)")
+        return duration_ms, locks
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error executing {step_name} online: {e}")
+        return None, locks
+    finally:
+        if not conn.closed:
+            conn.autocommit = False
+            reset_timeouts(conn)
+
+def print_lock_report(results):
+    """Log the longest write-blocking lock holds across all applied steps"""
+    holds = [
+        (lock['held_ms'], result['step'], lock['relation'], lock['mode'])
+        for result in results
+        for lock in result.get('locks') or []
+        if lock['mode'] != 'CONCURRENTLY'
+    ]
+    if not holds:
+        logging.info("No write-blocking locks were held")
+        return
+    logging.info("Write-blocking locks held (longest first):")
+    for held_ms, step, relation, mode in sorted(holds, reverse=True)[:15]:
+        logging.info(f"  {held_ms:>8} ms  {mode:<22} {relation:<36} {step}")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Query plan regression gate for migrations
+
+Runs EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) over the benchmark query
+catalogue on a scratch database that has just been migrated. Each plan is
+reduced to its shape (node types, relations, indexes), its scan type per
+relation, its join strategies and its total buffer count. These are compared
+with the baselines in plan_baselines.json.
+
+The baselines are recorded before the change under test: --update-baselines
+explains the scratch database as it is and does not apply pending steps. The
+committed plan_baselines.json was recorded on the schema of 00-03 plus the
+evaluation scores table and helper functions, as it was before steps 04-08,
+so it also catches regressions those steps introduce. Queries on objects that
+did not exist yet are stored with their error and skipped by the check.
+
+A query regresses when it:
+  - falls back to a Seq Scan on a relation that its baseline reached by index,
+  - replaces a hash or merge join with a nested loop, or
+  - reads more than BUFFER_RATIO times its baseline buffers (and at least
+    MIN_BUFFER_GROWTH more).
+
+plpgsql reporting functions only show up as a Function Scan at the top level.
+For those, the RETURN QUERY body is read from pg_proc and explained as a
+prepared statement with the same arguments, so the gate sees the plan the
+function actually runs.
+
+Used through run_migration.py:
+    python3 run_migration.py --dsn "dbname=plp_456_scratch" --plan-check --update-baselines  # before the change
+    python3 run_migration.py --dsn "dbname=plp_456_scratch" --plan-check                     # migrate and check
+"""
+
+import os
+import re
+import json
+import random
+import difflib
+import logging
+
+from run_migration import MIGRATION_DIR
+from benchmark import QUERY_CATALOGUE, build_geography, grow_to, sample_pools
+
+BASELINE_FILE = os.path.join(MIGRATION_DIR, 'plan_baselines.json')
+
+# Buffer growth that counts as a regression
+BUFFER_RATIO = 2.0
+MIN_BUFFER_GROWTH = 1000
+
+JOIN_NODES = ('Nested Loop', 'Hash Join', 'Merge Join')
+
+# Fixed seed so baselines and checks sample the same parameters
+PLAN_SEED = 456
+
+def function_name(sql):
+    """Name of the function called in a catalogue query, if any"""
+    match = re.search(r'FROM\s+(\w+)\s*\(', sql)
+    return match.group(1) if match else None
+
+def function_body_query(cursor, name):
+    """(RETURN QUERY body with $n parameters, argument types) of a plpgsql function, or None"""
+    cursor.execute("""
+        SELECT p.prosrc, p.proargnames[1:p.pronargs], p.proargtypes::regtype[]::text[]
+        FROM pg_proc p
+        JOIN pg_language l ON l.oid = p.prolang
+        WHERE p.proname = %s AND l.lanname = 'plpgsql'
+        LIMIT 1;
+    """, (name,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    source, arg_names, arg_types = row
+    match = re.search(r'RETURN\s+QUERY\s+(.*?);\s*END\s*;', source, re.S | re.I)
+    if not match:
+        return None
+    body = match.group(1)
+    for position, arg_name in enumerate(arg_names or [], start=1):
+        body = re.sub(rf'\b{re.escape(arg_name)}\b', f'${position}', body)
+    return body, arg_types
+
+def explain(cursor, sql, params):
+    """EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) one catalogue query; returns the plan JSON"""
+    name = function_name(sql)
+    inner = function_body_query(cursor, name) if name else None
+    if inner is not None:
+        body, arg_types = inner
+        cursor.execute("DEALLOCATE ALL;")
+        cursor.execute(f"PREPARE plan_check_query({', '.join(arg_types)}) AS {body}")
+        placeholders = ', '.join(['%s'] * len(arg_types))
+        cursor.execute(
+            f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) EXECUTE plan_check_query({placeholders})",
+            call_arguments(sql, params, len(arg_types))
+        )
+    else:
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql.rstrip().rstrip(';')}", params)
+    plan = cursor.fetchone()[0]
+    return plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+
+def call_arguments(sql, params, arg_count):
+    """Function arguments in call order: params, literal NULLs, then omitted defaults"""
+    call = sql[sql.index('(') + 1:sql.rindex(')')]
+    values = iter(params)
+    arguments = []
+    for token in [t.strip() for t in call.split(',') if t.strip()]:
+        arguments.append(None if token.upper() == 'NULL' else next(values))
+    return tuple(arguments) + (None,) * (arg_count - len(arguments))
+
+def summarize(plan):
+    """Reduce an EXPLAIN JSON plan to the parts the gate compares"""
+    shape = []
+    scans = {}
+    joins = []
+
+    def walk(node, depth):
+        label = node['Node Type']
+        if node.get('Join Type') and node['Node Type'] in JOIN_NODES:
+            label += f" ({node['Join Type']})"
+        relation = node.get('Relation Name')
+        if relation:
+            label += f" on {relation}"
+            scans.setdefault(relation, set()).add(node['Node Type'])
+        if node.get('Index Name'):
+            label += f" using {node['Index Name']}"
+        shape.append('  ' * depth + label)
+        if node['Node Type'] in JOIN_NODES:
+            joins.append(node['Node Type'])
+        for child in node.get('Plans', []):
+            walk(child, depth + 1)
+
+    root = plan['Plan']
+    walk(root, 0)
+    buffers = root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0)
+    return {
+        'shape': shape,
+        'scans': {relation: sorted(types) for relation, types in scans.items()},
+        'joins': joins,
+        'buffers': buffers,
+        'execution_ms': round(plan.get('Execution Time', 0.0), 3)
+    }
+
+def compare(name, baseline, current):
+    """List of human-readable regressions of current against baseline"""
+    problems = []
+    for relation, types in current['scans'].items():
+        before = baseline['scans'].get(relation)
+        if before and 'Seq Scan' in types and 'Seq Scan' not in before:
+            problems.append(f"falls back to Seq Scan on {relation} (baseline: {', '.join(before)})")
+
+    lost_fast_joins = (
+        sum(1 for j in baseline['joins'] if j != 'Nested Loop')
+        - sum(1 for j in current['joins'] if j != 'Nested Loop')
+    )
+    gained_nested_loops = current['joins'].count('Nested Loop') - baseline['joins'].count('Nested Loop')
+    if lost_fast_joins > 0 and gained_nested_loops > 0:
+        problems.append(
+            f"join strategy changed to Nested Loop ({', '.join(baseline['joins'])} -> {', '.join(current['joins'])})"
+        )
+
+    if (current['buffers'] > baseline['buffers'] * BUFFER_RATIO
+            and current['buffers'] - baseline['buffers'] >= MIN_BUFFER_GROWTH):
+        problems.append(f"reads {current['buffers']} buffers (baseline {baseline['buffers']})")
+
+    if problems:
+        diff = difflib.unified_diff(
+            baseline['shape'], current['shape'],
+            fromfile=f"{name} (baseline)", tofile=f"{name} (current)", lineterm=''
+        )
+        problems.append('\n'.join(diff))
+    return problems
+
+def load_baselines(path):
+    """Stored plan summaries, or {} when there is no baseline file yet"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def collect_plans(conn):
+    """Summaries of every catalogue query's plan on the current database"""
+    rng = random.Random(PLAN_SEED)
+    pools = sample_pools(conn, rng)
+    plans = {}
+    with conn.cursor() as cursor:
+        for name, (sql, make_params) in QUERY_CATALOGUE.items():
+            try:
+                plans[name] = summarize(explain(cursor, sql, make_params(pools, rng)))
+            except Exception as e:
+                logging.error(f"Could not explain {name}: {e}")
+                plans[name] = {'error': str(e)}
+            conn.rollback()
+    return plans
+
+def plan_check(conn, scale=10000, update_baselines=False, baseline_file=BASELINE_FILE):
+    """Populate the scratch database to scale, then check or record plan baselines"""
+    grow_to(conn, random.Random(PLAN_SEED), build_geography(random.Random(PLAN_SEED)), scale, 5000)
+    plans = collect_plans(conn)
+
+    if update_baselines:
+        with open(baseline_file, 'w', encoding='utf-8') as file:
+            json.dump(plans, file, indent=2, sort_keys=True)
+            file.write('\n')
+        logging.info(f"Recorded plan baselines for {len(plans)} queries in {baseline_file}")
+        return True
+
+    baselines = load_baselines(baseline_file)
+    if not baselines:
+        logging.error(
+            f"No plan baselines in {baseline_file}; record them with --update-baselines "
+            "on a scratch database that does not have the change yet"
+        )
+        return False
+
+    regressions = 0
+    for name, current in plans.items():
+        baseline = baselines.get(name)
+        if 'error' in current:
+            regressions += 1
+            continue
+        if baseline is None or 'error' in baseline:
+            logging.warning(f"  {name}: no usable baseline, skipped")
+            continue
+        problems = compare(name, baseline, current)
+        if problems:
+            regressions += 1
+            logging.error(f"  {name}: plan regression")
+            for problem in problems:
+                logging.error(f"    {problem}")
+        else:
+            logging.info(f"  {name}: ok ({current['buffers']} buffers, baseline {baseline['buffers']})")
+
+    if regressions:
+        logging.error(f"{regressions} query plan(s) regressed")
+        return False
+    logging.info("No query plan regressions")
+    return True
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Refresh driver for the incrementally maintained inspection summary tables
+
+inspection_evaluation_totals and assessment_score_totals are kept up to date by
+triggers (04_inspection_summary_aggregates.sql) and read through
+inspection_complete_summary_fast. This script can rebuild them from the source
+tables, or reconcile the fast view against the original
+inspection_complete_summary view, which stays as the reference path.
+
+Usage:
+    python3 refresh_summaries.py rebuild
+    python3 refresh_summaries.py reconcile --province "Kandal" --fix
+"""
+
+import sys
+import time
+import argparse
+import logging
+
+from run_migration import connect
+
+# Columns compared between the reference view and the fast view
+COUNTER_COLUMNS = [
+    'indicators_evaluated',
+    'yes_count',
+    'some_practice_count',
+    'no_count',
+    'assessments_conducted'
+]
+
+# Decimal places compared for avg_student_score (the two paths divide differently)
+AVG_SCALE = 6
+
+RECONCILE_SQL = """
+    SELECT
+        COALESCE(ref.inspection_id, fast.inspection_id) as inspection_id,
+        {ref_columns},
+        ROUND(ref.avg_student_score, {scale}) as ref_avg_student_score,
+        {fast_columns},
+        ROUND(fast.avg_student_score, {scale}) as fast_avg_student_score
+    FROM (
+        SELECT * FROM inspection_complete_summary
+        WHERE (%(province)s IS NULL OR province = %(province)s)
+          AND (%(district)s IS NULL OR district = %(district)s)
+    ) ref
+    FULL JOIN (
+        SELECT * FROM inspection_complete_summary_fast
+        WHERE (%(province)s IS NULL OR province = %(province)s)
+          AND (%(district)s IS NULL OR district = %(district)s)
+    ) fast ON fast.inspection_id = ref.inspection_id
+    WHERE ref.inspection_id IS NULL
+       OR fast.inspection_id IS NULL
+       OR ({ref_tuple}) IS DISTINCT FROM ({fast_tuple})
+       OR ROUND(ref.avg_student_score, {scale}) IS DISTINCT FROM ROUND(fast.avg_student_score, {scale});
+""".format(
+    ref_columns=', '.join(f"ref.{c} as ref_{c}" for c in COUNTER_COLUMNS),
+    fast_columns=', '.join(f"fast.{c} as fast_{c}" for c in COUNTER_COLUMNS),
+    ref_tuple=', '.join(f"ref.{c}" for c in COUNTER_COLUMNS),
+    fast_tuple=', '.join(f"fast.{c}" for c in COUNTER_COLUMNS),
+    scale=AVG_SCALE
+)
+
+def rebuild(conn, inspection_ids=None):
+    """Recompute the totals tables from source, for all or the given sessions"""
+    started = time.monotonic()
+    with conn.cursor() as cursor:
+        if inspection_ids is None:
+            cursor.execute("SELECT rebuild_inspection_summary_totals();")
+        else:
+            cursor.execute(
+                "SELECT rebuild_inspection_summary_totals(%s::uuid[]);", (list(inspection_ids),)
+            )
+    conn.commit()
+    scope = 'all sessions' if inspection_ids is None else f"{len(inspection_ids)} session(s)"
+    logging.info(f"Rebuilt summary totals for {scope} in {time.monotonic() - started:.2f}s")
+
+def reconcile(conn, province=None, district=None, limit=20):
+    """Compare the fast view with the reference view; returns mismatching session ids"""
+    started = time.monotonic()
+    mismatches = []
+    with conn.cursor() as cursor:
+        cursor.execute(RECONCILE_SQL, {'province': province, 'district': district})
+        columns = [desc[0] for desc in cursor.description]
+        for row in cursor:
+            record = dict(zip(columns, row))
+            mismatches.append(record['inspection_id'])
+            if len(mismatches) <= limit:
+                diffs = [
+                    f"{c}: {record['ref_' + c]} != {record['fast_' + c]}"
+                    for c in COUNTER_COLUMNS + ['avg_student_score']
+                    if record['ref_' + c] != record['fast_' + c]
+                ]
+                logging.warning(f"  {record['inspection_id']}: {'; '.join(diffs)}")
+    conn.rollback()
+
+    elapsed = time.monotonic() - started
+    if mismatches:
+        logging.warning(f"{len(mismatches)} session(s) differ from inspection_complete_summary ({elapsed:.2f}s)")
+    else:
+        logging.info(f"Summary totals match inspection_complete_summary ({elapsed:.2f}s)")
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or reconcile inspection summary totals")
+    parser.add_argument('command', choices=['rebuild', 'reconcile'])
+    parser.add_argument('--province', help="reconcile only this province")
+    parser.add_argument('--district', help="reconcile only this district")
+    parser.add_argument('--fix', action='store_true',
+                        help="rebuild the totals of sessions that fail reconciliation")
+    parser.add_argument('--dsn', help="connection string (default: run_migration DB_CONFIG)")
+    args = parser.parse_args()
+
+    try:
+        conn = connect(args.dsn)
+        if args.command == 'rebuild':
+            rebuild(conn)
+            ok = True
+        else:
+            mismatches = reconcile(conn, args.province, args.district)
+            if mismatches and args.fix:
+                rebuild(conn, mismatches)
+                mismatches = reconcile(conn, args.province, args.district)
+            ok = not mismatches
+        conn.close()
+    except Exception as e:
+        logging.error(f"Summary refresh failed: {e}")
+        sys.exit(1)
+
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
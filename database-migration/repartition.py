@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Online repartitioning of inspection_sessions
+
+Moves an existing inspection_sessions table into the range-partitioned layout
+prepared by 05_partitioned_inspection_sessions.sql while inspectors keep
+submitting forms:
+
+  prepare   create yearly partitions covering the data and install a trigger
+            that mirrors every insert, update and delete into the new table
+  backfill  copy existing rows in keyset batches (resumable; the position is
+            kept in inspection_sessions_repartition). Batch size adapts to
+            --target-ms, and --pause sleeps between batches.
+  verify    compare row counts and row hashes per year between the two tables
+  swap      swap_partitioned_inspection_sessions(): rename the tables, move
+            triggers, recreate views and replace foreign keys with triggers
+  detach    detach the partitions of years before --before-year
+  run       prepare, backfill, verify and swap in one go
+
+Usage:
+    python3 repartition.py run --batch-size 2000 --pause 0.05
+    python3 repartition.py backfill --target-ms 200     # resume after an interruption
+    python3 repartition.py detach --before-year 2022
+"""
+
+import sys
+import time
+import argparse
+import logging
+
+from run_migration import connect
+from online_ddl import set_timeouts, reset_timeouts, with_retries
+
+OLD_TABLE = 'inspection_sessions'
+NEW_TABLE = 'inspection_sessions_partitioned'
+MIRROR_TRIGGER = 'trigger_mirror_inspection_sessions'
+
+# Sorts before every UUID, for the first keyset batch
+FIRST_ID = '00000000-0000-0000-0000-000000000000'
+
+# Adaptive batch size bounds
+MIN_BATCH = 100
+MAX_BATCH = 20000
+
+BATCH_SQL = """
+    WITH batch AS (
+        SELECT {columns} FROM inspection_sessions
+        WHERE id > %(last_id)s
+        ORDER BY id
+        LIMIT %(limit)s
+        FOR SHARE
+    ), copied AS (
+        INSERT INTO inspection_sessions_partitioned ({columns})
+        SELECT {columns} FROM batch
+        ON CONFLICT (id, inspection_date) DO NOTHING
+        RETURNING 1
+    )
+    SELECT
+        (SELECT id FROM batch ORDER BY id DESC LIMIT 1),
+        (SELECT COUNT(*) FROM batch),
+        (SELECT COUNT(*) FROM copied);
+"""
+
+# Row hashes are compared per year; the text form of a row is the same in both tables
+YEAR_HASH_SQL = """
+    SELECT EXTRACT(YEAR FROM t.inspection_date)::integer, COUNT(*), SUM(hashtextextended(t::text, 0))
+    FROM {table} t
+    GROUP BY 1;
+"""
+
+def is_partitioned(cursor):
+    """True once inspection_sessions is the partitioned table"""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = 'inspection_sessions'::regclass;")
+    return cursor.fetchone()[0] == 'p'
+
+def copy_columns(cursor):
+    """Non-generated columns of inspection_sessions, in table order"""
+    cursor.execute("""
+        SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum)
+        FROM pg_attribute
+        WHERE attrelid = 'inspection_sessions'::regclass
+          AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+    """)
+    return cursor.fetchone()[0]
+
+def check_prepared(conn):
+    """Fail early when 05_partitioned_inspection_sessions.sql has not been applied"""
+    with conn.cursor() as cursor:
+        if is_partitioned(cursor):
+            raise RuntimeError("inspection_sessions is already partitioned")
+        cursor.execute("SELECT to_regclass(%s);", (NEW_TABLE,))
+        if cursor.fetchone()[0] is None:
+            raise RuntimeError(f"{NEW_TABLE} is missing; apply 05_partitioned_inspection_sessions.sql first")
+    conn.rollback()
+
+def prepare(conn, retries):
+    """Create partitions for the data's years and install the mirror trigger"""
+    check_prepared(conn)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT MIN(inspection_date), MAX(inspection_date) FROM inspection_sessions;")
+        first, last = cursor.fetchone()
+        if first is not None:
+            cursor.execute(
+                "SELECT create_inspection_sessions_partitions(%s, %s, %s);",
+                (NEW_TABLE, first.year, last.year + 1)
+            )
+            logging.info(f"Created {cursor.fetchone()[0]} partition(s) for {first.year}-{last.year + 1}")
+    conn.commit()
+
+    def install():
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {MIRROR_TRIGGER} ON inspection_sessions;")
+                cursor.execute(f"""
+                    CREATE TRIGGER {MIRROR_TRIGGER}
+                        AFTER INSERT OR UPDATE OR DELETE ON inspection_sessions
+                        FOR EACH ROW EXECUTE FUNCTION mirror_inspection_sessions();
+                """)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    with_retries(install, "installing mirror trigger", retries, 0.5)
+    logging.info("Mirror trigger installed; new writes are copied to the partitioned table")
+
+def progress(conn):
+    """(last_id, rows_copied, batches) of the backfill"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT last_id, rows_copied, batches FROM inspection_sessions_repartition;")
+        row = cursor.fetchone()
+    conn.rollback()
+    return row
+
+def backfill(conn, batch_size, pause, target_ms, retries):
+    """Copy rows in keyset batches until the old table is exhausted; returns rows copied"""
+    check_prepared(conn)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_trigger WHERE tgrelid = 'inspection_sessions'::regclass AND tgname = %s;",
+            (MIRROR_TRIGGER,)
+        )
+        if cursor.fetchone() is None:
+            raise RuntimeError("mirror trigger is missing; run prepare first")
+        batch_sql = BATCH_SQL.format(columns=copy_columns(cursor))
+    conn.rollback()
+
+    last_id, copied_total, batches = progress(conn)
+    if last_id is not None:
+        logging.info(f"Resuming backfill after {last_id} ({copied_total} rows copied so far)")
+
+    started = time.monotonic()
+    copied_now = 0
+    limit = batch_size
+    while True:
+        def copy_batch():
+            try:
+                batch_started = time.monotonic()
+                with conn.cursor() as cursor:
+                    cursor.execute(batch_sql, {'last_id': last_id or FIRST_ID, 'limit': limit})
+                    batch_last, seen, copied = cursor.fetchone()
+                    if batch_last is not None:
+                        cursor.execute("""
+                            UPDATE inspection_sessions_repartition
+                            SET last_id = %s, rows_copied = rows_copied + %s, batches = batches + 1,
+                                updated_at = CURRENT_TIMESTAMP;
+                        """, (batch_last, copied))
+                conn.commit()
+                return batch_last, seen, copied, (time.monotonic() - batch_started) * 1000
+            except Exception:
+                conn.rollback()
+                raise
+
+        batch_last, seen, copied, elapsed_ms = with_retries(copy_batch, "backfill batch", retries, 0.5)
+        if batch_last is None:
+            break
+        last_id = batch_last
+        copied_now += copied
+        batches += 1
+
+        rate = copied_now / max(time.monotonic() - started, 1e-9)
+        logging.info(
+            f"  batch {batches}: {seen} rows read, {copied} copied in {elapsed_ms:.0f} ms "
+            f"(batch size {limit}, {rate:.0f} rows/s)"
+        )
+        if seen < limit:
+            break
+        # Keep each batch's row locks short: shrink slow batches, grow fast ones
+        if target_ms:
+            if elapsed_ms > target_ms * 1.5:
+                limit = max(MIN_BATCH, limit // 2)
+            elif elapsed_ms < target_ms / 2:
+                limit = min(MAX_BATCH, limit * 2)
+        if pause:
+            time.sleep(pause)
+
+    elapsed = time.monotonic() - started
+    logging.info(f"Backfill complete: {copied_now} rows copied in {elapsed:.1f}s")
+    return copied_now
+
+def verify(conn):
+    """Compare per-year row counts and hashes; returns the list of differing years"""
+    check_prepared(conn)
+    with conn.cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+        cursor.execute(YEAR_HASH_SQL.format(table=OLD_TABLE))
+        old = {year: (count, digest) for year, count, digest in cursor.fetchall()}
+        cursor.execute(YEAR_HASH_SQL.format(table=NEW_TABLE))
+        new = {year: (count, digest) for year, count, digest in cursor.fetchall()}
+    conn.rollback()
+
+    differing = []
+    for year in sorted(set(old) | set(new), key=lambda y: (y is None, y)):
+        old_count, old_digest = old.get(year, (0, None))
+        new_count, new_digest = new.get(year, (0, None))
+        if (old_count, old_digest) != (new_count, new_digest):
+            differing.append(year)
+            logging.warning(f"  {year}: {old_count} rows in {OLD_TABLE}, {new_count} in {NEW_TABLE}, hashes differ")
+        else:
+            logging.info(f"  {year}: {old_count} rows match")
+    if differing:
+        logging.warning(f"{len(differing)} year(s) differ")
+    else:
+        logging.info("Partitioned table matches inspection_sessions")
+    return differing
+
+def swap(conn, retries):
+    """Swap the partitioned table in, retrying while locks are unavailable"""
+    def do_swap():
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT swap_partitioned_inspection_sessions();")
+                message = cursor.fetchone()[0]
+            conn.commit()
+            return message
+        except Exception:
+            conn.rollback()
+            raise
+
+    started = time.monotonic()
+    message = with_retries(do_swap, "swap", retries, 1.0)
+    logging.info(f"Swap complete in {(time.monotonic() - started) * 1000:.0f} ms: {message}")
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE inspection_sessions;")
+    conn.autocommit = False
+    logging.info("The old table is kept as inspection_sessions_unpartitioned; drop it once reports are checked")
+
+def detach(conn, before_year, retries):
+    """Detach the yearly partitions older than before_year; returns their names"""
+    with conn.cursor() as cursor:
+        if not is_partitioned(cursor):
+            raise RuntimeError("inspection_sessions is not partitioned yet")
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'inspection_sessions'::regclass
+              AND c.relname ~ '^inspection_sessions_y[0-9]{4}$'
+              AND substring(c.relname from '[0-9]{4}$')::integer < %s
+            ORDER BY c.relname;
+        """, (before_year,))
+        partitions = [r[0] for r in cursor.fetchall()]
+    conn.rollback()
+
+    for partition in partitions:
+        def do_detach():
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"ALTER TABLE inspection_sessions DETACH PARTITION {partition};")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        with_retries(do_detach, f"detaching {partition}", retries, 0.5)
+        logging.info(f"Detached {partition}; archive or drop it separately")
+    return partitions
+
+def main():
+    parser = argparse.ArgumentParser(description="Move inspection_sessions into the partitioned layout online")
+    parser.add_argument('command', choices=['prepare', 'backfill', 'verify', 'swap', 'detach', 'run', 'status'])
+    parser.add_argument('--batch-size', type=int, default=2000, help="rows per backfill batch")
+    parser.add_argument('--pause', type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument('--target-ms', type=int, default=250,
+                        help="adapt the batch size to keep batches near this duration (0 disables)")
+    parser.add_argument('--lock-timeout', type=int, default=2000, help="lock_timeout in ms")
+    parser.add_argument('--statement-timeout', type=int, default=600000, help="statement_timeout in ms")
+    parser.add_argument('--lock-retries', type=int, default=8, help="retries after a lock timeout")
+    parser.add_argument('--before-year', type=int, help="with detach, detach partitions of earlier years")
+    parser.add_argument('--dsn', help="connection string (default: run_migration DB_CONFIG)")
+    args = parser.parse_args()
+    if args.command == 'detach' and args.before_year is None:
+        parser.error("detach needs --before-year")
+
+    try:
+        conn = connect(args.dsn)
+        set_timeouts(conn, args.lock_timeout, args.statement_timeout)
+        ok = True
+        if args.command == 'status':
+            last_id, rows_copied, batches = progress(conn)
+            logging.info(f"Backfill position {last_id}: {rows_copied} rows in {batches} batches")
+        if args.command in ('prepare', 'run'):
+            prepare(conn, args.lock_retries)
+        if args.command in ('backfill', 'run'):
+            backfill(conn, args.batch_size, args.pause, args.target_ms, args.lock_retries)
+        if args.command in ('verify', 'run'):
+            ok = not verify(conn)
+        if args.command == 'swap' or (args.command == 'run' and ok):
+            swap(conn, args.lock_retries)
+        if args.command == 'detach':
+            detach(conn, args.before_year, args.lock_retries)
+        reset_timeouts(conn)
+        conn.close()
+    except Exception as e:
+        logging.error(f"Repartition failed: {e}")
+        sys.exit(1)
+
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,9 @@ Database connection details:
 import psycopg2
 import os
 import sys
+import time
+import hashlib
+import argparse
 from datetime import datetime
 import logging
 
@@ -44,32 +47,51 @@ MIGRATION_FILES = [
     '03_dynamic_student_assessment.sql'
 ]
 
+# Migration files applied after the evaluation scores table and helper functions
+POST_MIGRATION_FILES = [
+    '04_inspection_summary_aggregates.sql',
+    '05_partitioned_inspection_sessions.sql',
+    '06_search_indexes.sql',
+    '07_master_fields_notify.sql',
+    '08_school_statistics_subjects.sql'
+]
+
+# Only one runner may migrate a database at a time
+LOCK_SQL = "SELECT pg_try_advisory_lock(hashtext('run_migration'));"
+UNLOCK_SQL = "SELECT pg_advisory_unlock(hashtext('run_migration'));"
+
+# Migration files live next to this script
+MIGRATION_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Ledger of applied migration steps (step name, content hash, duration)
+LEDGER_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    step_name VARCHAR(255) PRIMARY KEY,
+    checksum CHAR(64) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    duration_ms INTEGER NOT NULL
+);
+
+COMMENT ON TABLE schema_migrations IS 'Ledger of applied migration steps with the SHA-256 of the SQL that was executed';
+"""
+
+def connect(dsn=None):
+    """Open a connection to dsn, or to DB_CONFIG when no DSN is given"""
+    if dsn:
+        return psycopg2.connect(dsn)
+    return psycopg2.connect(**DB_CONFIG)
+
 def read_sql_file(filepath):
     """Read SQL file content"""
     try:
-        with open(filepath, 'r', encoding='utf-8') as file:
+        with open(os.path.join(MIGRATION_DIR, filepath), 'r', encoding='utf-8') as file:
             return file.read()
     except Exception as e:
         logging.error(f"Error reading file {filepath}: {e}")
         return None
 
-def execute_migration(conn, sql_content, filename):
-    """Execute a single migration file"""
-    try:
-        with conn.cursor() as cursor:
-            logging.info(f"Executing migration: {filename}")
-            cursor.execute(sql_content)
-            conn.commit()
-            logging.info(f"Successfully executed: {filename}")
-            return True
-    except Exception as e:
-        conn.rollback()
-        logging.error(f"Error executing {filename}: {e}")
-        return False
-
-def create_evaluation_scores_table(conn):
-    """Create the evaluation scores linking table"""
-    sql = """
+# SQL for the evaluation scores linking table (ledger step: create_evaluation_scores_table)
+EVALUATION_SCORES_SQL = """
     -- Create evaluation scores table to link inspection sessions with master fields
     CREATE TABLE IF NOT EXISTS inspection_evaluation_scores (
         score_id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -96,22 +118,9 @@ def create_evaluation_scores_table(conn):
         FOR EACH ROW 
         EXECUTE FUNCTION update_inspection_sessions_updated_at();
     """
-    
-    try:
-        with conn.cursor() as cursor:
-            logging.info("Creating evaluation scores linking table...")
-            cursor.execute(sql)
-            conn.commit()
-            logging.info("Successfully created evaluation scores table")
-            return True
-    except Exception as e:
-        conn.rollback()
-        logging.error(f"Error creating evaluation scores table: {e}")
-        return False
 
-def create_helper_functions(conn):
-    """Create helper functions and views"""
-    sql = """
+# SQL for helper functions and views (ledger step: create_helper_functions)
+HELPER_FUNCTIONS_SQL = """
     -- Create summary view combining all data
     CREATE OR REPLACE VIEW inspection_complete_summary AS
     SELECT 
@@ -228,18 +237,189 @@ def create_helper_functions(conn):
     END;
     $$ LANGUAGE plpgsql;
     """
-    
+
+def file_steps(filenames):
+    """Return (filename, sql) pairs for migration files, or None if one cannot be read"""
+    steps = []
+    for migration_file in filenames:
+        sql_content = read_sql_file(migration_file)
+        if not sql_content:
+            logging.error(f"Could not read migration file: {migration_file}")
+            return None
+        steps.append((migration_file, sql_content))
+    return steps
+
+def migration_steps():
+    """Return (step_name, sql) pairs in the order they must be applied"""
+    pre_steps = file_steps(MIGRATION_FILES)
+    post_steps = file_steps(POST_MIGRATION_FILES)
+    if pre_steps is None or post_steps is None:
+        return None
+    return pre_steps + [
+        ('create_evaluation_scores_table', EVALUATION_SCORES_SQL),
+        ('create_helper_functions', HELPER_FUNCTIONS_SQL),
+    ] + post_steps
+
+def sql_checksum(sql_content):
+    """SHA-256 of a migration step's SQL"""
+    return hashlib.sha256(sql_content.encode('utf-8')).hexdigest()
+
+def ensure_ledger(conn):
+    """Create the schema_migrations ledger table if it does not exist"""
+    with conn.cursor() as cursor:
+        cursor.execute(LEDGER_SQL)
+    conn.commit()
+
+def load_ledger(conn):
+    """Return {step_name: checksum} for every step recorded in the ledger"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT step_name, checksum FROM schema_migrations;")
+        return dict(cursor.fetchall())
+
+def record_step(cursor, step_name, checksum, duration_ms):
+    """Upsert a ledger row; runs inside the step's own transaction"""
+    cursor.execute("""
+        INSERT INTO schema_migrations (step_name, checksum, applied_at, duration_ms)
+        VALUES (%s, %s, CURRENT_TIMESTAMP, %s)
+        ON CONFLICT (step_name) DO UPDATE
+        SET checksum = EXCLUDED.checksum,
+            applied_at = EXCLUDED.applied_at,
+            duration_ms = EXCLUDED.duration_ms;
+    """, (step_name, checksum, duration_ms))
+
+def apply_step(conn, step_name, sql_content, checksum):
+    """Execute one step and record it in the ledger in the same transaction"""
     try:
         with conn.cursor() as cursor:
-            logging.info("Creating helper functions and views...")
-            cursor.execute(sql)
+            logging.info(f"Executing migration: {step_name}")
+            started = time.monotonic()
+            cursor.execute(sql_content)
+            duration_ms = int((time.monotonic() - started) * 1000)
+            record_step(cursor, step_name, checksum, duration_ms)
             conn.commit()
-            logging.info("Successfully created helper functions")
-            return True
+            logging.info(f"Successfully executed: {step_name} ({duration_ms} ms)")
+            return duration_ms
     except Exception as e:
         conn.rollback()
-        logging.error(f"Error creating helper functions: {e}")
+        logging.error(f"Error executing {step_name}: {e}")
+        return None
+
+def run_migrations(conn, reapply_changed=False, online=None, profiler=None):
+    """Apply pending migration steps, skipping those already applied and unchanged.
+
+    Once any step is (re)applied every later step is applied as well, because
+    the migration files drop their objects with CASCADE and take dependent
+    objects of later steps with them.
+
+    online, when given, is a dict of online_ddl.apply_step_online options; each
+    step is then split into statements and run without blocking writers.
+
+    profiler, when given, is a migration_profiler.MigrationProfiler that runs
+    each step statement by statement and records its timing trace.
+
+    Returns a list of per-step result dicts (step, status, checksum, duration_ms,
+    plus locks in online mode); status is one of applied, skipped, changed or failed.
+
+    The steps run under an advisory lock, so two runners (run_migration.py,
+    migrate_targets.py) never migrate the same database at the same time. When
+    another runner holds it the only result has step None and status locked.
+    """
+    steps = migration_steps()
+    if steps is None:
+        return [{'step': None, 'status': 'failed', 'checksum': None, 'duration_ms': None}]
+
+    with conn.cursor() as cursor:
+        cursor.execute(LOCK_SQL)
+        locked = cursor.fetchone()[0]
+    conn.commit()
+    if not locked:
+        logging.error("Another migration is running against this database")
+        return [{'step': None, 'status': 'locked', 'checksum': None, 'duration_ms': None}]
+
+    try:
+        ensure_ledger(conn)
+        ledger = load_ledger(conn)
+
+        results = []
+        cascade = False
+        for step_name, sql_content in steps:
+            checksum = sql_checksum(sql_content)
+            recorded = ledger.get(step_name)
+            result = {'step': step_name, 'status': None, 'checksum': checksum, 'duration_ms': None}
+            results.append(result)
+
+            if recorded == checksum and not cascade:
+                logging.info(f"Skipping {step_name}: already applied and unchanged")
+                result['status'] = 'skipped'
+                continue
+
+            if recorded is not None and recorded != checksum:
+                logging.warning(
+                    f"{step_name} has changed since it was applied "
+                    f"(ledger {recorded[:12]}, file {checksum[:12]})"
+                )
+                if not reapply_changed:
+                    logging.error(
+                        f"Refusing to re-run edited migration {step_name}; "
+                        "add a new migration step instead, or pass --reapply-changed"
+                    )
+                    result['status'] = 'changed'
+                    break
+
+            if profiler is not None:
+                duration_ms = profiler.apply_step(conn, step_name, sql_content, checksum)
+            elif online is not None:
+                from online_ddl import apply_step_online
+                duration_ms, result['locks'] = apply_step_online(conn, step_name, sql_content, checksum, **online)
+            else:
+                duration_ms = apply_step(conn, step_name, sql_content, checksum)
+            if duration_ms is None:
+                result['status'] = 'failed'
+                break
+            result['status'] = 'applied'
+            result['duration_ms'] = duration_ms
+            cascade = True
+    finally:
+        if not conn.closed:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute(UNLOCK_SQL)
+            conn.commit()
+
+    return results
+
+def baseline_ledger(conn):
+    """Record the current checksum of every step as applied without executing it"""
+    steps = migration_steps()
+    if steps is None:
         return False
+    ensure_ledger(conn)
+    with conn.cursor() as cursor:
+        for step_name, sql_content in steps:
+            record_step(cursor, step_name, sql_checksum(sql_content), 0)
+            logging.info(f"Recorded {step_name} as applied")
+    conn.commit()
+    return True
+
+def print_status(conn):
+    """Log each step's ledger state: pending, applied or changed"""
+    steps = migration_steps()
+    if steps is None:
+        return False
+    ensure_ledger(conn)
+    ledger = load_ledger(conn)
+    clean = True
+    for step_name, sql_content in steps:
+        recorded = ledger.get(step_name)
+        if recorded is None:
+            state = 'pending'
+        elif recorded == sql_checksum(sql_content):
+            state = 'applied'
+        else:
+            state = 'CHANGED since applied'
+            clean = False
+        logging.info(f"  {step_name}: {state}")
+    return clean
 
 def verify_migration(conn):
     """Verify the migration was successful"""
@@ -280,33 +460,112 @@ def verify_migration(conn):
         logging.error(f"Error verifying migration: {e}")
         return False
 
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Apply MENTOR database migrations")
+    parser.add_argument('--status', action='store_true',
+                        help="show which steps are pending, applied or changed and exit")
+    parser.add_argument('--reapply-changed', action='store_true',
+                        help="re-run steps whose SQL changed after they were applied")
+    parser.add_argument('--baseline', action='store_true',
+                        help="record every step as applied without executing it (existing databases)")
+    parser.add_argument('--dsn', help="connection string to use instead of DB_CONFIG")
+    parser.add_argument('--plan-check', action='store_true',
+                        help="after migrating, compare query plans with plan_baselines.json (scratch databases only)")
+    parser.add_argument('--update-baselines', action='store_true',
+                        help="with --plan-check, record the plans of the database as it is, before any "
+                             "pending step, as the new baselines, then exit without migrating")
+    parser.add_argument('--plan-scale', type=int, default=10000,
+                        help="with --plan-check, synthetic inspection sessions to load before explaining")
+    parser.add_argument('--online', action='store_true',
+                        help="split steps into statements, build indexes CONCURRENTLY and retry on lock timeouts")
+    parser.add_argument('--lock-timeout', type=int, default=2000,
+                        help="with --online, lock_timeout in ms for every statement")
+    parser.add_argument('--statement-timeout', type=int, default=300000,
+                        help="with --online, statement_timeout in ms for every statement")
+    parser.add_argument('--lock-retries', type=int, default=5,
+                        help="with --online, retries with exponential backoff after a lock timeout")
+    parser.add_argument('--profile', metavar='TRACE',
+                        help="run steps statement by statement and write a JSON timing trace")
+    parser.add_argument('--profile-top', type=int, default=10,
+                        help="with --profile or --dry-run, slowest statements to list")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="profile the pending steps and roll them back (scratch databases only)")
+    args = parser.parse_args()
+    if args.plan_check and not args.dsn:
+        parser.error("--plan-check loads synthetic data; point it at a scratch database with --dsn")
+    if args.update_baselines and not args.plan_check:
+        parser.error("--update-baselines is a --plan-check option")
+    if args.dry_run and not args.dsn:
+        parser.error("--dry-run runs the steps; point it at a scratch database with --dsn")
+    if args.online and (args.profile or args.dry_run):
+        parser.error("--online commits statement by statement and cannot be profiled or dry-run")
+    return args
+
 def main():
     """Main migration function"""
+    args = parse_args()
     logging.info("Starting database migration for MENTOR")
-    logging.info(f"Connecting to database at {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
+    if args.dsn:
+        logging.info("Connecting to database given by --dsn")
+    else:
+        logging.info(f"Connecting to database at {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
     
     try:
         # Connect to database
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = connect(args.dsn)
         logging.info("Successfully connected to database")
+
+        if args.status:
+            clean = print_status(conn)
+            conn.close()
+            sys.exit(0 if clean else 1)
+
+        if args.baseline:
+            ok = baseline_ledger(conn)
+            conn.close()
+            sys.exit(0 if ok else 1)
+
+        # Baselines describe the schema before the change under test, so they
+        # are recorded without applying the pending steps
+        if args.update_baselines:
+            from plan_regression import plan_check
+            ok = plan_check(conn, scale=args.plan_scale, update_baselines=True)
+            conn.close()
+            sys.exit(0 if ok else 1)
         
-        # Execute each migration file
-        all_success = True
-        for migration_file in MIGRATION_FILES:
-            sql_content = read_sql_file(migration_file)
-            if sql_content:
-                if not execute_migration(conn, sql_content, migration_file):
-                    all_success = False
-                    break
-            else:
-                logging.error(f"Could not read migration file: {migration_file}")
-                all_success = False
-                break
-        
-        # Create additional tables and functions
-        if all_success:
-            all_success = create_evaluation_scores_table(conn) and create_helper_functions(conn)
+        # Execute pending migration steps
+        online = None
+        if args.online:
+            online = {
+                'lock_timeout_ms': args.lock_timeout,
+                'statement_timeout_ms': args.statement_timeout,
+                'retries': args.lock_retries
+            }
+        profiler = None
+        if args.profile or args.dry_run:
+            from migration_profiler import MigrationProfiler
+            profiler = MigrationProfiler(args.dsn, dry_run=args.dry_run)
+        results = run_migrations(conn, reapply_changed=args.reapply_changed, online=online, profiler=profiler)
+        if profiler is not None:
+            profiler.finish(conn)
+            profiler.print_summary(args.profile_top)
+            if args.profile:
+                profiler.write_trace(args.profile)
+        all_success = all(r['status'] in ('applied', 'skipped') for r in results)
+        applied = [r for r in results if r['status'] == 'applied']
+        logging.info(
+            f"Applied {len(applied)} step(s), skipped "
+            f"{sum(1 for r in results if r['status'] == 'skipped')} unchanged step(s)"
+        )
+        if args.online:
+            from online_ddl import print_lock_report
+            print_lock_report(results)
         
+        if args.dry_run:
+            conn.close()
+            sys.exit(0 if all_success else 1)
+
         # Verify migration
         if all_success:
             if verify_migration(conn):
@@ -314,12 +573,21 @@ def main():
                 logging.info("All paper-based evaluation form structures have been migrated to the database.")
             else:
                 logging.error("Migration verification failed")
+                all_success = False
         else:
             logging.error("Migration failed - some steps were not completed")
+
+        # Compare query plans against the stored baselines
+        if all_success and args.plan_check:
+            from plan_regression import plan_check
+            all_success = plan_check(conn, scale=args.plan_scale)
         
         # Close connection
         conn.close()
         logging.info("Database connection closed")
+
+        if not all_success:
+            sys.exit(1)
         
     except psycopg2.Error as e:
         logging.error(f"Database connection error: {e}")
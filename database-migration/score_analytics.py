@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Vectorized student score analytics for district and province reports
+
+calculate_student_performance() and get_assessment_summary() report on one
+assessment or one ILIKE-filtered slice per call. A district report therefore
+makes thousands of calls, and each call scans student_scores again. This
+module loads every score once with binary COPY into NumPy arrays and computes,
+in one pass for every group at the requested level:
+  - score bands (>= 90, 70-89, 50-69, < 50), average and standard deviation,
+    exactly as calculate_student_performance() computes them,
+  - 25th/50th/75th/90th percentiles (percentile_cont interpolation),
+  - the student count and average per gender.
+
+Levels:
+  assessment  one row per assessment subject (calculate_student_performance)
+  session     one row per get_assessment_summary() group
+  school, district, province
+              one row per location and subject, active sessions only
+
+Scores are DECIMAL(5,2), so they are loaded as integer hundredths. Sums,
+averages and the rounding of standard deviations are done in integer
+arithmetic, which makes ROUND(..., 2) results identical to the SQL functions.
+--verify N checks this against the SQL functions for N random groups.
+
+Usage:
+    python3 score_analytics.py province --output province_scores.csv
+    python3 score_analytics.py district --province "Kandal" --output kandal.csv
+    python3 score_analytics.py assessment --verify 200
+"""
+
+import io
+import csv
+import sys
+import math
+import time
+import random
+import struct
+import argparse
+import logging
+from decimal import Decimal
+
+import numpy as np
+
+from run_migration import connect
+
+BANDS = ('excellent_count', 'good_count', 'fair_count', 'poor_count')
+
+# Band lower bounds in hundredths, as in calculate_student_performance()
+BAND_LIMITS = (9000, 7000, 5000)
+
+PERCENTILES = (25, 50, 75, 90)
+
+LEVELS = ('assessment', 'session', 'school', 'district', 'province')
+
+# Dense 0-based indexes shared by every query in the snapshot
+INDEX_CTES = """
+    WITH a AS (
+        SELECT assessment_id, (row_number() OVER (ORDER BY assessment_id) - 1)::int4 as idx
+        FROM student_assessment_sessions
+    ),
+    subj AS (
+        SELECT s.subject_id, a.idx as assessment_idx,
+               (row_number() OVER (ORDER BY s.subject_id) - 1)::int4 as idx
+        FROM assessment_subjects s JOIN a USING (assessment_id)
+    ),
+    stud AS (
+        SELECT s.student_id, a.idx as assessment_idx, s.student_gender,
+               (row_number() OVER (ORDER BY s.student_id) - 1)::int4 as idx
+        FROM assessment_students s JOIN a USING (assessment_id)
+    )
+"""
+
+ASSESSMENTS_SQL = """
+    SELECT sas.assessment_id, sas.is_active AND COALESCE(ins.is_active, false),
+           ins.inspection_date, ins.school, ins.name_of_teacher, ins.grade, ins.subject,
+           ins.district, ins.province
+    FROM student_assessment_sessions sas
+    LEFT JOIN inspection_sessions ins ON ins.id = sas.inspection_session_id
+    ORDER BY sas.assessment_id;
+"""
+
+SUBJECTS_SQL = INDEX_CTES + """
+    SELECT subj.assessment_idx, s.subject_name_km, s.subject_name_en, s.subject_order
+    FROM subj JOIN assessment_subjects s USING (subject_id)
+    ORDER BY subj.idx;
+"""
+
+STUDENTS_COPY = INDEX_CTES + """
+    SELECT assessment_idx,
+           CASE student_gender WHEN 'M' THEN 1 WHEN 'Male' THEN 1
+                               WHEN 'F' THEN 2 WHEN 'Female' THEN 2 ELSE 0 END
+    FROM stud ORDER BY idx
+"""
+
+# has_score separates NULL scores from 0.00
+SCORES_COPY = INDEX_CTES + """
+    SELECT subj.idx, stud.idx,
+           COALESCE((sc.score * 100)::int4, 0), (sc.score IS NOT NULL)::int4
+    FROM student_scores sc
+    JOIN subj USING (subject_id)
+    JOIN stud USING (student_id)
+"""
+
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+def copy_int_columns(cursor, query, width):
+    """Rows of a query returning width non-null int4 columns, as a (rows, width) int64 array"""
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT binary)", buffer)
+    data = buffer.getbuffer()
+    if bytes(data[:11]) != COPY_SIGNATURE:
+        raise ValueError("unexpected COPY binary header")
+    extension_length = struct.unpack('>I', data[15:19])[0]
+    start = 19 + extension_length
+    # Every tuple: int16 field count, then (int32 length, int32 value) per column
+    fields = [('count', '>i2')]
+    for column in range(width):
+        fields += [(f'length{column}', '>i4'), (f'value{column}', '>i4')]
+    tuple_type = np.dtype(fields)
+    rows = (len(data) - start - 2) // tuple_type.itemsize
+    tuples = np.frombuffer(data, dtype=tuple_type, count=rows, offset=start)
+    return np.stack([tuples[f'value{column}'].astype(np.int64) for column in range(width)], axis=1)
+
+def load(conn):
+    """Score matrix and dimensions as NumPy arrays, read in one consistent snapshot"""
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(ASSESSMENTS_SQL)
+            assessments = cursor.fetchall()
+            cursor.execute(SUBJECTS_SQL)
+            subjects = cursor.fetchall()
+            students = copy_int_columns(cursor, STUDENTS_COPY, 2)
+            scores = copy_int_columns(cursor, SCORES_COPY, 4)
+        conn.commit()
+    finally:
+        conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT')
+
+    subject_assessment = np.array([row[0] for row in subjects], dtype=np.int64)
+    return {
+        'assessments': assessments,
+        'active': np.array([row[1] for row in assessments], dtype=bool),
+        'subjects': subjects,
+        'subject_assessment': subject_assessment,
+        'student_assessment': students[:, 0] if len(students) else np.zeros(0, dtype=np.int64),
+        'student_gender': students[:, 1] if len(students) else np.zeros(0, dtype=np.int64),
+        'score_subject': scores[:, 0] if len(scores) else np.zeros(0, dtype=np.int64),
+        'score_student': scores[:, 1] if len(scores) else np.zeros(0, dtype=np.int64),
+        'cents': scores[:, 2] if len(scores) else np.zeros(0, dtype=np.int64),
+        'has_score': scores[:, 3].astype(bool) if len(scores) else np.zeros(0, dtype=bool),
+    }
+
+def round_ratio(numerator, denominator):
+    """numerator / denominator rounded half away from zero, as NUMERIC ROUND() does"""
+    numerator = np.asarray(numerator, dtype=np.int64)
+    denominator = np.asarray(denominator, dtype=np.int64)
+    safe = np.where(denominator > 0, denominator, 1)
+    magnitude = (2 * np.abs(numerator) + safe) // (2 * safe)
+    return np.sign(numerator) * magnitude
+
+def round_stddev(count, total, squares):
+    """ROUND(STDDEV(score), 2) in hundredths from exact per-group sums; None where count < 2"""
+    result = []
+    for n, s1, s2 in zip(count.tolist(), total.tolist(), squares.tolist()):
+        if n < 2:
+            result.append(None)
+            continue
+        # Sample variance in hundredths squared is numerator / denominator
+        numerator = n * s2 - s1 * s1
+        denominator = n * (n - 1)
+        # round(sqrt(x)) = (floor(sqrt(4x)) + 1) // 2, and floor(sqrt(x)) = isqrt(floor(x))
+        result.append((math.isqrt(4 * numerator // denominator) + 1) // 2)
+    return result
+
+def grouped_percentiles(groups, cents, counts):
+    """percentile_cont values per group, in score units; NaN for empty groups"""
+    order = np.lexsort((cents, groups))
+    values = cents[order].astype(np.float64) / 100
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    result = {}
+    for pct in PERCENTILES:
+        position = (pct / 100) * np.maximum(counts - 1, 0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, np.maximum(counts - 1, 0))
+        fraction = position - lower
+        present = counts > 0
+        value = np.full(len(counts), np.nan)
+        low = values[starts[present] + lower[present]]
+        high = values[starts[present] + upper[present]]
+        value[present] = low + fraction[present] * (high - low)
+        result[f'p{pct}'] = value
+    return result
+
+def score_statistics(groups, group_count, cents, has_score, gender):
+    """Band counts, average, stddev, percentiles and gender splits for each group id
+
+    groups holds one group id per score row, or -1 for rows outside every group.
+    """
+    rows = groups >= 0
+    total = np.bincount(groups[rows], minlength=group_count)
+    valid = rows & has_score
+    g = groups[valid]
+    v = cents[valid]
+    count = np.bincount(g, minlength=group_count)
+    sums = np.zeros(group_count, dtype=np.int64)
+    np.add.at(sums, g, v)
+    squares = np.zeros(group_count, dtype=np.int64)
+    np.add.at(squares, g, v * v)
+
+    stats = {'total_students': total}
+    upper = None
+    for band, limit in zip(BANDS, BAND_LIMITS + (None,)):
+        mask = np.ones(len(v), dtype=bool) if limit is None else v >= limit
+        if upper is not None:
+            mask &= v < upper
+        stats[band] = np.bincount(g[mask], minlength=group_count)
+        upper = limit
+    stats['avg_score'] = np.where(count > 0, round_ratio(sums, count), -1)
+    stats['avg_present'] = count > 0
+    stats['std_deviation'] = round_stddev(count, sums, squares)
+    stats.update(grouped_percentiles(g, v, count))
+
+    for code, label in ((1, 'male'), (2, 'female')):
+        mask = gender[valid] == code
+        gender_count = np.bincount(g[mask], minlength=group_count)
+        gender_sums = np.zeros(group_count, dtype=np.int64)
+        np.add.at(gender_sums, g[mask], v[mask])
+        stats[f'{label}_count'] = gender_count
+        stats[f'{label}_avg'] = np.where(gender_count > 0, round_ratio(gender_sums, gender_count), -1)
+        stats[f'{label}_avg_present'] = gender_count > 0
+    return stats
+
+def hundredths(value):
+    """Integer hundredths as a two-decimal Decimal"""
+    return None if value is None else Decimal(int(value)).scaleb(-2)
+
+def group_ids(keys):
+    """Dense ids for a list of hashable keys (None for rows outside every group); returns (ids, distinct keys)"""
+    lookup = {}
+    ids = np.full(len(keys), -1, dtype=np.int64)
+    for position, key in enumerate(keys):
+        if key is None:
+            continue
+        ids[position] = lookup.setdefault(key, len(lookup))
+    return ids, list(lookup)
+
+def assessment_report(data):
+    """calculate_student_performance() for every assessment subject"""
+    stats = score_statistics(
+        data['score_subject'], len(data['subjects']), data['cents'], data['has_score'],
+        data['student_gender'][data['score_student']]
+    )
+    report = []
+    for idx, (assessment_idx, name_km, name_en, order) in enumerate(data['subjects']):
+        row = {
+            'assessment_id': data['assessments'][assessment_idx][0],
+            'subject_order': order,
+            'subject_name_km': name_km,
+            'subject_name_en': name_en,
+        }
+        row.update(stats_row(stats, idx))
+        report.append(row)
+    report.sort(key=lambda row: (row['assessment_id'], row['subject_order']))
+    return report
+
+def location_report(data, level):
+    """Per location and subject statistics over active sessions"""
+    columns = {'school': (8, 7, 3), 'district': (8, 7), 'province': (8,)}[level]
+    names = {8: 'province', 7: 'district', 3: 'school'}
+    assessments = data['assessments']
+    subject_keys = [
+        tuple(assessments[assessment_idx][c] for c in columns) + (name_km,)
+        if data['active'][assessment_idx] else None
+        for assessment_idx, name_km, _, _ in data['subjects']
+    ]
+    subject_group, keys = group_ids(subject_keys)
+    groups = subject_group[data['score_subject']] if len(subject_group) else data['score_subject']
+    stats = score_statistics(
+        groups, len(keys), data['cents'], data['has_score'],
+        data['student_gender'][data['score_student']]
+    )
+    report = []
+    for idx, key in enumerate(keys):
+        row = {names[c]: value for c, value in zip(columns, key)}
+        row['subject_name_km'] = key[-1]
+        row.update(stats_row(stats, idx))
+        report.append(row)
+    report.sort(key=lambda row: tuple('' if row[names[c]] is None else row[names[c]] for c in columns)
+                + (row['subject_name_km'],))
+    return report
+
+def stats_row(stats, idx):
+    """Report columns for one group"""
+    row = {'total_students': int(stats['total_students'][idx])}
+    for band in BANDS:
+        row[band] = int(stats[band][idx])
+    row['avg_score'] = hundredths(stats['avg_score'][idx]) if stats['avg_present'][idx] else None
+    row['std_deviation'] = hundredths(stats['std_deviation'][idx])
+    for pct in PERCENTILES:
+        value = stats[f'p{pct}'][idx]
+        row[f'p{pct}'] = None if np.isnan(value) else round(float(value), 4)
+    for label in ('male', 'female'):
+        row[f'{label}_count'] = int(stats[f'{label}_count'][idx])
+        row[f'{label}_avg'] = (
+            hundredths(stats[f'{label}_avg'][idx]) if stats[f'{label}_avg_present'][idx] else None
+        )
+    return row
+
+def session_report(data):
+    """get_assessment_summary() without filters: one row per date, school, teacher, grade and subject
+
+    The function joins every student to every subject of its assessment before
+    joining the scores, so each score is counted once per subject. Its average
+    is weighted the same way here.
+    """
+    assessments = data['assessments']
+    subject_count = np.bincount(data['subject_assessment'], minlength=len(assessments))
+    # Inner joins: active, linked to a session and with at least one subject
+    keys = [
+        (row[2], row[3], row[4], row[5], row[6]) if data['active'][i] and subject_count[i] > 0 else None
+        for i, row in enumerate(assessments)
+    ]
+    assessment_group, group_keys = group_ids(keys)
+    group_count = len(group_keys)
+
+    student_groups = assessment_group[data['student_assessment']] if len(assessments) else data['student_assessment']
+    students = np.bincount(student_groups[student_groups >= 0], minlength=group_count)
+
+    # Scores join on their student's assessment, as the function does
+    score_assessment = data['student_assessment'][data['score_student']]
+    score_groups = assessment_group[score_assessment] if len(assessments) else score_assessment
+    valid = (score_groups >= 0) & data['has_score']
+    g = score_groups[valid]
+    v = data['cents'][valid]
+    weight = subject_count[score_assessment[valid]]
+    weighted_sums = np.zeros(group_count, dtype=np.int64)
+    np.add.at(weighted_sums, g, v * weight)
+    weighted_count = np.bincount(g, weights=weight, minlength=group_count).astype(np.int64)
+    minimum = np.full(group_count, np.iinfo(np.int64).max)
+    np.minimum.at(minimum, g, v)
+    maximum = np.full(group_count, np.iinfo(np.int64).min)
+    np.maximum.at(maximum, g, v)
+    average = round_ratio(weighted_sums, weighted_count)
+
+    report = []
+    for idx, (inspection_date, school, teacher, grade, subject) in enumerate(group_keys):
+        present = weighted_count[idx] > 0
+        report.append({
+            'inspection_date': inspection_date,
+            'school': school,
+            'teacher_name': teacher,
+            'grade': grade,
+            'subject': subject,
+            'num_students_assessed': int(students[idx]),
+            'avg_score': hundredths(average[idx]) if present else None,
+            'min_score': hundredths(minimum[idx]) if present else None,
+            'max_score': hundredths(maximum[idx]) if present else None,
+        })
+    report.sort(key=lambda row: (row['inspection_date'] is None, row['inspection_date']), reverse=True)
+    return report
+
+def build_report(data, level):
+    """Report rows for one level"""
+    if level == 'assessment':
+        return assessment_report(data)
+    if level == 'session':
+        return session_report(data)
+    return location_report(data, level)
+
+def verify(conn, data, level, report, samples, seed=456):
+    """Compare sampled report rows with the SQL function results; returns mismatch count"""
+    rng = random.Random(seed)
+    mismatches = 0
+    with conn.cursor() as cursor:
+        if level == 'assessment':
+            by_assessment = {}
+            for row in report:
+                by_assessment.setdefault(row['assessment_id'], []).append(row)
+            for assessment_id in rng.sample(sorted(by_assessment), min(samples, len(by_assessment))):
+                cursor.execute("SELECT * FROM calculate_student_performance(%s);", (assessment_id,))
+                expected = cursor.fetchall()
+                actual = [
+                    (r['subject_name_km'], r['subject_name_en'], r['total_students'],
+                     *(r[band] for band in BANDS), r['avg_score'], r['std_deviation'])
+                    for r in by_assessment[assessment_id]
+                ]
+                if [tuple(row) for row in expected] != actual:
+                    mismatches += 1
+                    logging.error(f"  {assessment_id}: SQL {expected} != NumPy {actual}")
+        elif level == 'session':
+            for row in rng.sample(report, min(samples, len(report))):
+                cursor.execute(
+                    "SELECT * FROM get_assessment_summary(%s, %s, %s, %s);",
+                    (row['school'], row['teacher_name'], row['inspection_date'], row['inspection_date'])
+                )
+                key = (row['inspection_date'], row['school'], row['teacher_name'], row['grade'], row['subject'])
+                expected = [r[5:9] for r in cursor.fetchall() if tuple(r[:5]) == key]
+                actual = [(row['num_students_assessed'], row['avg_score'], row['min_score'], row['max_score'])]
+                if expected != actual:
+                    mismatches += 1
+                    logging.error(f"  {key}: SQL {expected} != NumPy {actual}")
+        else:
+            logging.info("Only the assessment and session levels have SQL functions to verify against")
+    conn.rollback()
+    return mismatches
+
+def write_report(report, path):
+    """Write report rows as CSV"""
+    if not report:
+        open(path, 'w').close()
+        return
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(report[0]))
+        writer.writeheader()
+        writer.writerows(report)
+
+def main():
+    parser = argparse.ArgumentParser(description="Score bands, averages and percentiles for every group in one pass")
+    parser.add_argument('level', choices=LEVELS)
+    parser.add_argument('--province', help="only write rows for this province (school/district/province levels)")
+    parser.add_argument('--output', help="CSV file to write (default: score_<level>.csv)")
+    parser.add_argument('--verify', type=int, default=0, metavar='N',
+                        help="compare N random groups with the SQL functions")
+    parser.add_argument('--dsn', help="connection string (default: run_migration DB_CONFIG)")
+    args = parser.parse_args()
+
+    try:
+        conn = connect(args.dsn)
+        started = time.monotonic()
+        data = load(conn)
+        loaded = time.monotonic()
+        report = build_report(data, args.level)
+        computed = time.monotonic()
+        logging.info(
+            f"Loaded {len(data['cents'])} scores in {loaded - started:.2f}s; "
+            f"{len(report)} {args.level} rows computed in {computed - loaded:.2f}s"
+        )
+        if args.province and args.level in ('school', 'district', 'province'):
+            report = [row for row in report if row['province'] == args.province]
+        write_report(report, args.output or f"score_{args.level}.csv")
+        if args.verify:
+            mismatches = verify(conn, data, args.level, report, args.verify)
+            if mismatches:
+                logging.error(f"{mismatches} of the sampled groups differ from the SQL functions")
+                sys.exit(1)
+            logging.info("Sampled groups match the SQL functions")
+        conn.close()
+    except Exception as e:
+        logging.error(f"Score analytics failed: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
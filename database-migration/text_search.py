@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Search-as-you-type for schools, teachers and indicators
+
+Uses the trigram indexes from 06_search_indexes.sql. A term matches when it
+is a substring of the value after search_text() normalisation (lower case,
+invisible Khmer word separators removed). The search_key() condition lets the
+index narrow the rows, for Khmer terms as well; the search_text() condition is
+the exact check. Results are grouped by value
+and ranked by trigram similarity to the term, then by how often they occur.
+When fewer than --limit values contain the term, the closest values by
+similarity (typos, different spellings) fill the remaining places.
+
+--benchmark compares this path with the ILIKE '%term%' filter used by the
+reporting functions, on term fragments taken from the data, and reports the
+indexes each path's plan uses. It refuses to run without the trigram indexes
+(a pg_trgm without the gin_trgm_ops operator class cannot build them), since
+timings of the unindexed path say nothing about the indexed one. --explain
+prints the EXPLAIN ANALYZE plans of both paths for one term.
+
+Usage:
+    python3 text_search.py school "Primary School 13" --province "Kandal"
+    python3 text_search.py teacher "សុខ"
+    python3 text_search.py indicator "teach"
+    python3 text_search.py school "School 13" --explain
+    python3 text_search.py --benchmark --iterations 200
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+
+from run_migration import connect
+from benchmark import percentile
+
+# field -> (table, value column, indexed key expression, searched text)
+FIELDS = {
+    'school': ('inspection_sessions', 'school', 'search_key(school)', 'school'),
+    'teacher': (
+        'inspection_sessions', 'name_of_teacher', 'search_key(name_of_teacher)', 'name_of_teacher'
+    ),
+    'indicator': (
+        'master_fields', 'indicator_main',
+        'indicator_search_document(indicator_main, indicator_main_en, indicator_sub, indicator_sub_en)',
+        "COALESCE(indicator_main, '') || ' ' || COALESCE(indicator_main_en, '') || ' ' || "
+        "COALESCE(indicator_sub, '') || ' ' || COALESCE(indicator_sub_en, '')"
+    ),
+}
+
+# Values below this similarity are not offered as fuzzy matches
+SIMILARITY_THRESHOLD = 0.3
+
+# Trigram indexes created by 06_search_indexes.sql
+SEARCH_INDEXES = (
+    'idx_inspection_sessions_school_trgm',
+    'idx_inspection_sessions_teacher_trgm',
+    'idx_master_fields_search_trgm',
+)
+
+def like_escape(term):
+    """Escape LIKE wildcards so the term matches literally"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_queries(field, province=None):
+    """(substring query, near-match query) of the ranked path"""
+    table, column, key, text = FIELDS[field]
+    filters = "AND province = %(province)s" if province and table == 'inspection_sessions' else ""
+    substring = f"""
+        SELECT {column}, similarity({key}, search_key(%(term)s)) as score, COUNT(*) as occurrences
+        FROM {table}
+        WHERE is_active = true {filters}
+          AND {key} LIKE '%%' || search_key(%(pattern)s) || '%%'
+          AND search_text({text}) LIKE '%%' || search_text(%(pattern)s) || '%%'
+        GROUP BY {column}, {key}
+        ORDER BY score DESC, occurrences DESC, {column}
+        LIMIT %(limit)s
+    """
+    # Near matches that do not contain the term
+    near = f"""
+        SELECT {column}, similarity({key}, search_key(%(term)s)) as score, COUNT(*) as occurrences
+        FROM {table}
+        WHERE is_active = true {filters}
+          AND {key} %% search_key(%(term)s)
+          AND search_text({text}) NOT LIKE '%%' || search_text(%(pattern)s) || '%%'
+        GROUP BY {column}, {key}
+        HAVING similarity({key}, search_key(%(term)s)) >= %(threshold)s
+        ORDER BY score DESC, occurrences DESC, {column}
+        LIMIT %(limit)s
+    """
+    return substring, near
+
+def ilike_query(field, province=None):
+    """The ILIKE path of the reporting functions, for comparison"""
+    table, column = FIELDS[field][:2]
+    filters = "AND province = %(province)s" if province and table == 'inspection_sessions' else ""
+    return f"""
+        SELECT {column}, COUNT(*) as occurrences
+        FROM {table}
+        WHERE is_active = true {filters}
+          AND {column} ILIKE '%%' || %(pattern)s || '%%'
+        GROUP BY {column}
+        ORDER BY occurrences DESC, {column}
+        LIMIT %(limit)s
+    """
+
+def query_params(term, limit, province=None):
+    """Parameters shared by the search queries"""
+    return {
+        'term': term, 'pattern': like_escape(term), 'limit': limit, 'province': province,
+        'threshold': SIMILARITY_THRESHOLD,
+    }
+
+def search(conn, field, term, limit=20, province=None):
+    """[(value, similarity, occurrences)] best first"""
+    substring, near = search_queries(field, province)
+    params = query_params(term, limit, province)
+    with conn.cursor() as cursor:
+        cursor.execute(substring, params)
+        results = cursor.fetchall()
+        if len(results) < limit and len(term) >= 3:
+            cursor.execute(near, dict(params, limit=limit - len(results)))
+            results += cursor.fetchall()
+    conn.rollback()
+    return [(value, round(score, 3), occurrences) for value, score, occurrences in results]
+
+def ilike_search(conn, field, term, limit=20, province=None):
+    """The ILIKE path of the reporting functions, for comparison"""
+    with conn.cursor() as cursor:
+        cursor.execute(ilike_query(field, province), query_params(term, limit, province))
+        results = cursor.fetchall()
+    conn.rollback()
+    return results
+
+def check_search_indexes(conn):
+    """Raise unless pg_trgm has its GIN operator class and 06_search_indexes.sql built the indexes"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_opclass WHERE opcname = 'gin_trgm_ops');")
+        has_opclass = cursor.fetchone()[0]
+        cursor.execute("SELECT name FROM unnest(%s::text[]) as name WHERE to_regclass(name) IS NULL;",
+                       (list(SEARCH_INDEXES),))
+        missing = [row[0] for row in cursor.fetchall()]
+    conn.rollback()
+    if not has_opclass:
+        raise RuntimeError(
+            "pg_trgm does not provide the gin_trgm_ops operator class; install the PostgreSQL "
+            "contrib package for this server version and recreate the extension"
+        )
+    if missing:
+        raise RuntimeError(f"missing search indexes {', '.join(missing)}: apply 06_search_indexes.sql")
+
+def plan_indexes(plan):
+    """Names of the indexes an EXPLAIN (FORMAT JSON) plan node and its children read"""
+    names = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', []):
+        names |= plan_indexes(child)
+    return names
+
+def plan_lines(plan, depth=0):
+    """One indented line per plan node: type, relation, index and actual time"""
+    line = '  ' * depth + plan['Node Type']
+    if 'Relation Name' in plan:
+        line += f" on {plan['Relation Name']}"
+    if 'Index Name' in plan:
+        line += f" using {plan['Index Name']}"
+    if 'Actual Total Time' in plan:
+        line += f" (actual {plan['Actual Total Time']:.2f} ms, {plan['Actual Rows']} rows)"
+    lines = [line]
+    for child in plan.get('Plans', []):
+        lines += plan_lines(child, depth + 1)
+    return lines
+
+def explain(conn, sql, params, analyze=False):
+    """(plan as JSON, index names) of one query"""
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    with conn.cursor() as cursor:
+        cursor.execute(f"EXPLAIN ({options}) {sql}", params)
+        plan = cursor.fetchone()[0]
+    conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan, sorted(plan_indexes(plan[0]['Plan']))
+
+def explain_paths(conn, field, term, limit=20, province=None, analyze=False):
+    """{path: (plan, index names)} for the ranked and the ILIKE path"""
+    substring, near = search_queries(field, province)
+    params = query_params(term, limit, province)
+    return {
+        'trigram': explain(conn, substring, params, analyze),
+        'near': explain(conn, near, params, analyze),
+        'ilike': explain(conn, ilike_query(field, province), params, analyze),
+    }
+
+def sample_terms(conn, field, count, rng):
+    """Fragments of existing values, as typed into a search box"""
+    table, column = FIELDS[field][:2]
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT DISTINCT {column} FROM {table} WHERE is_active = true AND {column} IS NOT NULL;")
+        values = [row[0] for row in cursor.fetchall()]
+    conn.rollback()
+    terms = []
+    for _ in range(count if values else 0):
+        value = rng.choice(values)
+        length = rng.randint(3, max(3, min(12, len(value))))
+        start = rng.randint(0, max(0, len(value) - length))
+        terms.append(value[start:start + length])
+    return terms
+
+def run_benchmark(conn, iterations, limit, seed=456):
+    """Time both paths on the same terms; returns {field: {path: stats}}"""
+    check_search_indexes(conn)
+    rng = random.Random(seed)
+    report = {}
+    for field in FIELDS:
+        terms = sample_terms(conn, field, iterations, rng)
+        plans = explain_paths(conn, field, terms[0], limit) if terms else {}
+        timings = {'trigram': [], 'ilike': []}
+        missing = 0
+        for term in terms:
+            started = time.perf_counter()
+            found = search(conn, field, term, limit)
+            timings['trigram'].append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            expected = ilike_search(conn, field, term, limit)
+            timings['ilike'].append((time.perf_counter() - started) * 1000)
+            # Every ILIKE match contains the term, so it must be among the substring matches
+            if len(expected) < limit and not {value for value, _ in expected} <= {value for value, _, _ in found}:
+                missing += 1
+        report[field] = {
+            path: {
+                'p50_ms': round(percentile(sorted(values), 50), 2) if values else None,
+                'p95_ms': round(percentile(sorted(values), 95), 2) if values else None,
+            }
+            for path, values in timings.items()
+        }
+        report[field]['terms'] = len(terms)
+        report[field]['missing_matches'] = missing
+        report[field]['indexes'] = {path: indexes for path, (_, indexes) in plans.items()}
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Ranked substring search over schools, teachers and indicators")
+    parser.add_argument('field', nargs='?', choices=sorted(FIELDS))
+    parser.add_argument('term', nargs='?')
+    parser.add_argument('--province', help="only sessions in this province (school/teacher)")
+    parser.add_argument('--limit', type=int, default=20, help="maximum number of results")
+    parser.add_argument('--benchmark', action='store_true', help="compare with the ILIKE path")
+    parser.add_argument('--explain', action='store_true',
+                        help="print the EXPLAIN ANALYZE plans of both paths for the term")
+    parser.add_argument('--iterations', type=int, default=100, help="benchmark terms per field")
+    parser.add_argument('--dsn', help="connection string (default: run_migration DB_CONFIG)")
+    args = parser.parse_args()
+
+    if not args.benchmark and not (args.field and args.term):
+        parser.error("give a field and a search term, or --benchmark")
+
+    try:
+        conn = connect(args.dsn)
+        if args.benchmark:
+            report = run_benchmark(conn, args.iterations, args.limit)
+            for field, stats in report.items():
+                logging.info(
+                    f"{field:<10} {stats['terms']} terms: trigram p50 {stats['trigram']['p50_ms']} ms "
+                    f"p95 {stats['trigram']['p95_ms']} ms | ILIKE p50 {stats['ilike']['p50_ms']} ms "
+                    f"p95 {stats['ilike']['p95_ms']} ms | {stats['missing_matches']} terms with missing matches"
+                )
+                for path, indexes in stats['indexes'].items():
+                    logging.info(f"{'':<10} {path} plan reads {', '.join(indexes) or 'no index (sequential scan)'}")
+        elif args.explain:
+            check_search_indexes(conn)
+            for path, (plan, indexes) in explain_paths(
+                conn, args.field, args.term, args.limit, args.province, analyze=True
+            ).items():
+                print(f"== {path}: {', '.join(indexes) or 'no index (sequential scan)'}, "
+                      f"{plan[0]['Execution Time']:.2f} ms")
+                print('\n'.join(plan_lines(plan[0]['Plan'])))
+        else:
+            for value, score, occurrences in search(conn, args.field, args.term, args.limit, args.province):
+                print(f"{score:>6.3f}  {occurrences:>6}  {value}")
+        conn.close()
+    except Exception as e:
+        logging.error(f"Search failed: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Row-level verification of a copied or restored database
+
+verify_migration() only checks that the tables exist. This script compares
+the data of every table in a schema between a source and a target database
+without transferring the tables:
+
+  1. Each table is split into primary key ranges of --chunk-rows rows, using
+     the source's keys.
+  2. Worker processes, each with one connection to each database, hash every
+     range on both sides: the row count and the sum of a 64-bit hash of each
+     row's text.
+  3. A range whose hashes differ is split at its median key and both halves
+     are checked again, until a range has at most --diff-rows rows. Those rows
+     are then compared by key and row hash.
+
+The result lists the rows missing from the target, the rows only in the
+target and the rows that differ, by primary key. Tables without a primary key
+are compared as a whole. Only columns present on both sides are hashed; a
+column present on one side only is reported as a schema difference.
+
+Run it against databases that are not being written to. Rows written during
+the comparison show up as differences.
+
+Usage:
+    python3 verify_data.py --source "host=old dbname=plp_456" --target "host=new dbname=plp_456"
+    python3 verify_data.py --target "dbname=plp_456_restore" --tables inspection_sessions --output diff.json
+"""
+
+import sys
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from run_migration import connect
+
+TABLES_SQL = """
+    SELECT c.relname,
+           ARRAY(
+               SELECT a.attname FROM unnest(x.indkey) WITH ORDINALITY AS k(attnum, position)
+               JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+               ORDER BY k.position
+           )::text[] as key_columns
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_index x ON x.indrelid = c.oid AND x.indisprimary
+    WHERE n.nspname = %s
+      AND c.relkind IN ('r', 'p')
+      AND NOT c.relispartition
+    ORDER BY c.relname;
+"""
+
+COLUMNS_SQL = """
+    SELECT a.attname FROM pg_attribute a
+    WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attnum;
+"""
+
+# Set in each worker process by init_worker()
+worker_conns = {}
+
+def quote(name):
+    """Quoted SQL identifier"""
+    return '"' + name.replace('"', '""') + '"'
+
+def describe_tables(conn, schema):
+    """{table: {'key': [key columns], 'columns': [columns]}}"""
+    with conn.cursor() as cursor:
+        cursor.execute(TABLES_SQL, (schema,))
+        tables = {name: {'key': list(key or [])} for name, key in cursor.fetchall()}
+        for name, table in tables.items():
+            cursor.execute(COLUMNS_SQL, (f"{quote(schema)}.{quote(name)}",))
+            table['columns'] = [row[0] for row in cursor.fetchall()]
+    conn.rollback()
+    return tables
+
+def range_filter(key, lower, upper):
+    """WHERE clause and parameters for lower <= key < upper (None = unbounded)"""
+    row = f"({', '.join(quote(column) for column in key)})"
+    marks = f"({', '.join(['%s'] * len(key))})"
+    clauses = []
+    params = []
+    if lower is not None:
+        clauses.append(f"{row} >= {marks}")
+        params.extend(lower)
+    if upper is not None:
+        clauses.append(f"{row} < {marks}")
+        params.extend(upper)
+    return ' AND '.join(clauses) or 'true', params
+
+def plan_ranges(conn, schema, table, key, chunk_rows):
+    """[(lower, upper)] covering the whole key space, about chunk_rows source rows each"""
+    columns = ', '.join(quote(column) for column in key)
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT {columns} FROM (
+                SELECT {columns}, row_number() OVER (ORDER BY {columns}) as rn
+                FROM {quote(schema)}.{quote(table)}
+            ) ordered
+            WHERE rn > 1 AND (rn - 1) %% %s = 0
+            ORDER BY {columns};
+        """, (chunk_rows,))
+        bounds = [tuple(row) for row in cursor.fetchall()]
+    conn.rollback()
+    edges = [None] + bounds + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+def init_worker(source_dsn, target_dsn):
+    """Open this worker's connections to both databases"""
+    worker_conns['source'] = connect(source_dsn)
+    worker_conns['target'] = connect(target_dsn)
+    for conn in worker_conns.values():
+        conn.set_session(readonly=True)
+
+def row_text(columns):
+    """SQL expression for the text of a row restricted to columns"""
+    return f"ROW({', '.join(quote(column) for column in columns)})::text"
+
+def hash_range(side, schema, table, columns, key, lower, upper):
+    """(row count, sum of row hashes) of one range on one side"""
+    conn = worker_conns[side]
+    where, params = range_filter(key, lower, upper) if key else ('true', [])
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT COUNT(*), COALESCE(SUM(hashtextextended({row_text(columns)}, 0)), 0)
+            FROM {quote(schema)}.{quote(table)} WHERE {where};
+        """, params)
+        result = cursor.fetchone()
+    conn.rollback()
+    return result[0], int(result[1])
+
+def row_hashes(side, schema, table, columns, key, lower, upper):
+    """{key tuple: row hash} of one range on one side"""
+    conn = worker_conns[side]
+    where, params = range_filter(key, lower, upper)
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT {', '.join(quote(column) for column in key)},
+                   hashtextextended({row_text(columns)}, 0)
+            FROM {quote(schema)}.{quote(table)} WHERE {where};
+        """, params)
+        result = {tuple(row[:-1]): row[-1] for row in cursor.fetchall()}
+    conn.rollback()
+    return result
+
+def median_key(side, schema, table, key, lower, upper, count):
+    """Key of the middle row of a range on one side"""
+    conn = worker_conns[side]
+    where, params = range_filter(key, lower, upper)
+    columns = ', '.join(quote(column) for column in key)
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT {columns} FROM {quote(schema)}.{quote(table)}
+            WHERE {where} ORDER BY {columns} OFFSET %s LIMIT 1;
+        """, params + [count // 2])
+        result = tuple(cursor.fetchone())
+    conn.rollback()
+    return result
+
+def check_range(schema, table, columns, key, lower, upper, diff_rows):
+    """Compare one range; returns ('match', None), ('split', key), ('rows', diffs) or ('table', counts)"""
+    source = hash_range('source', schema, table, columns, key, lower, upper)
+    target = hash_range('target', schema, table, columns, key, lower, upper)
+    if source == target:
+        return 'match', None
+    if not key:
+        return 'table', {'source_rows': source[0], 'target_rows': target[0]}
+    if max(source[0], target[0]) > diff_rows:
+        side = 'source' if source[0] >= target[0] else 'target'
+        return 'split', median_key(side, schema, table, key, lower, upper, max(source[0], target[0]))
+
+    source_rows = row_hashes('source', schema, table, columns, key, lower, upper)
+    target_rows = row_hashes('target', schema, table, columns, key, lower, upper)
+    diffs = []
+    for row_key in sorted(set(source_rows) | set(target_rows), key=str):
+        if row_key not in target_rows:
+            kind = 'missing_in_target'
+        elif row_key not in source_rows:
+            kind = 'extra_in_target'
+        elif source_rows[row_key] != target_rows[row_key]:
+            kind = 'different'
+        else:
+            continue
+        diffs.append({'kind': kind, 'key': dict(zip(key, (str(v) for v in row_key)))})
+    return 'rows', diffs
+
+def verify(source_dsn, target_dsn, schema='public', tables=None, chunk_rows=100000,
+           diff_rows=64, workers=4):
+    """Compare all (or the given) tables; returns the report dict"""
+    source_conn = connect(source_dsn)
+    target_conn = connect(target_dsn)
+    source_tables = describe_tables(source_conn, schema)
+    target_tables = describe_tables(target_conn, schema)
+    target_conn.close()
+
+    names = sorted(tables) if tables else sorted(set(source_tables) | set(target_tables))
+    report = {'schema': schema, 'tables': {}}
+    work = []
+    for name in names:
+        if name not in source_tables or name not in target_tables:
+            report['tables'][name] = {'status': 'missing in ' + ('target' if name in source_tables else 'source')}
+            continue
+        source_columns = source_tables[name]['columns']
+        target_columns = set(target_tables[name]['columns'])
+        columns = [column for column in source_columns if column in target_columns]
+        key = source_tables[name]['key']
+        entry = {
+            'status': 'match', 'ranges': 0, 'splits': 0, 'differences': [],
+            'key': key, 'source_only_columns': [c for c in source_columns if c not in target_columns],
+            'target_only_columns': sorted(target_columns - set(source_columns)),
+        }
+        if entry['source_only_columns'] or entry['target_only_columns']:
+            entry['status'] = 'different'
+        if key != target_tables[name]['key']:
+            entry['target_key'] = target_tables[name]['key']
+        report['tables'][name] = entry
+        ranges = plan_ranges(source_conn, schema, name, key, chunk_rows) if key else [(None, None)]
+        work.extend((name, columns, key, lower, upper) for lower, upper in ranges)
+    source_conn.close()
+
+    logging.info(f"Comparing {len(names)} tables in {len(work)} ranges with {workers} workers")
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(source_dsn, target_dsn)) as pool:
+        running = {}
+
+        def submit(name, columns, key, lower, upper):
+            future = pool.submit(check_range, schema, name, columns, key, lower, upper, diff_rows)
+            running[future] = (name, columns, key, lower, upper)
+            report['tables'][name]['ranges'] += 1
+
+        for item in work:
+            submit(*item)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, columns, key, lower, upper = running.pop(future)
+                entry = report['tables'][name]
+                outcome, detail = future.result()
+                if outcome == 'match':
+                    continue
+                entry['status'] = 'different'
+                if outcome == 'split':
+                    # Bisect: both halves are checked again
+                    entry['splits'] += 1
+                    submit(name, columns, key, lower, detail)
+                    submit(name, columns, key, detail, upper)
+                elif outcome == 'rows':
+                    entry['differences'].extend(detail)
+                else:
+                    entry.update(detail)
+    report['duration_s'] = round(time.monotonic() - started, 1)
+    return report
+
+def print_summary(report, limit=10):
+    """Log one line per table and the first differing rows"""
+    for name, entry in report['tables'].items():
+        if 'differences' not in entry:
+            logging.info(f"  {name:<40} {entry['status']}")
+            continue
+        columns = ''
+        if entry['source_only_columns'] or entry['target_only_columns']:
+            columns = (f" (columns only in source: {entry['source_only_columns']}, "
+                       f"only in target: {entry['target_only_columns']})")
+        logging.info(
+            f"  {name:<40} {entry['status']:<10} {entry['ranges']} ranges, "
+            f"{len(entry['differences'])} differing rows{columns}"
+        )
+        for diff in entry['differences'][:limit]:
+            logging.info(f"      {diff['kind']:<18} {diff['key']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare table data between two databases by hashed key ranges")
+    parser.add_argument('--source', help="source connection string (default: run_migration DB_CONFIG)")
+    parser.add_argument('--target', required=True, help="target connection string")
+    parser.add_argument('--schema', default='public', help="schema to compare")
+    parser.add_argument('--tables', help="comma-separated tables (default: all tables in the schema)")
+    parser.add_argument('--chunk-rows', type=int, default=100000, help="source rows per initial range")
+    parser.add_argument('--diff-rows', type=int, default=64,
+                        help="compare rows individually once a differing range is this small")
+    parser.add_argument('--workers', type=int, default=4, help="worker processes")
+    parser.add_argument('--output', help="write the full report as JSON")
+    args = parser.parse_args()
+
+    try:
+        report = verify(
+            args.source, args.target, args.schema,
+            args.tables.split(',') if args.tables else None,
+            args.chunk_rows, args.diff_rows, args.workers
+        )
+    except Exception as e:
+        logging.error(f"Verification failed: {e}")
+        sys.exit(1)
+
+    print_summary(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, default=str)
+        logging.info(f"Report written to {args.output}")
+    different = [name for name, entry in report['tables'].items() if entry['status'] != 'match']
+    if different:
+        logging.error(f"{len(different)} table(s) differ: {', '.join(different)}")
+        sys.exit(1)
+    logging.info(f"All {len(report['tables'])} tables match ({report['duration_s']}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+"""
+Move the existing observation attachments into the MinIO uploads bucket
+
+The source is a local directory (e.g. an export of Vercel Blob or the old
+upload folder) or a bucket on an S3-compatible endpoint. Every file is
+hashed with SHA-256 and stored once per content, under
+<prefix><first two hex digits>/<sha256><extension>, so the same photo
+attached to several observations is uploaded and stored once. --mapping
+writes which object each source file became, for rewriting the attachment
+URLs in the database.
+
+  - --workers files are transferred at a time. A file larger than --part-size
+    is sent as a multipart upload, one part in memory per worker.
+  - Progress is kept in a SQLite manifest (--manifest): every file's state,
+    every stored object, and the parts of unfinished multipart uploads. An
+    interrupted run, or one stopped by --until at the end of the bandwidth
+    window, resumes where it stopped, down to the part, when started again
+    with the same manifest. A file that changed at the source since it was
+    recorded is transferred again.
+  - Ctrl-C stops after the parts being sent; --until stops starting new
+    files at the given time.
+  - --limit-mbps caps the upload rate over all workers, to leave the school's
+    connection usable during the day.
+  - Progress lines report the current and the sustained MB/s.
+
+Usage:
+    python3 migrate_media.py --source /srv/plp-uploads --endpoint http://157.10.73.52:9000
+    python3 migrate_media.py --source s3://old-attachments/observations/ --source-endpoint http://10.0.0.5:9000 \\
+        --workers 8 --limit-mbps 20 --until 17:00 --mapping attachments.csv
+"""
+
+import os
+import sys
+import csv
+import time
+import sqlite3
+import hashlib
+import argparse
+import mimetypes
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+from storage_benchmark import S3Target, RequestFailed, parse_size
+
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    source TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,      -- mtime of a local file, ETag of a source object
+    status TEXT NOT NULL DEFAULT 'pending',
+    sha256 TEXT,
+    object_key TEXT,
+    deduplicated INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS objects (
+    sha256 TEXT PRIMARY KEY,
+    object_key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    uploaded_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS multipart_uploads (
+    sha256 TEXT PRIMARY KEY,
+    object_key TEXT NOT NULL,
+    upload_id TEXT NOT NULL,
+    part_size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS multipart_parts (
+    sha256 TEXT NOT NULL,
+    part_number INTEGER NOT NULL,
+    etag TEXT NOT NULL,
+    PRIMARY KEY (sha256, part_number)
+);
+"""
+
+# Files are read and hashed in chunks of this size
+READ_CHUNK = 1024 * 1024
+
+# Seconds between progress lines
+PROGRESS_INTERVAL_S = 10
+
+def now():
+    return datetime.now().isoformat(timespec='seconds')
+
+class Manifest:
+    """The SQLite manifest, shared by the worker threads"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(MANIFEST_SCHEMA)
+        self.lock = threading.Lock()
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+            self.conn.commit()
+            return rows
+
+    def add_sources(self, entries):
+        """Record (source, size, fingerprint) entries; a changed source goes back to pending"""
+        with self.lock:
+            for source, size, fingerprint in entries:
+                self.conn.execute("""
+                    INSERT INTO files (source, size, fingerprint, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (source) DO UPDATE SET
+                        size = excluded.size, fingerprint = excluded.fingerprint, status = 'pending',
+                        sha256 = NULL, object_key = NULL, deduplicated = 0, error = NULL,
+                        updated_at = excluded.updated_at
+                    WHERE files.size != excluded.size OR files.fingerprint != excluded.fingerprint
+                """, (source, size, fingerprint, now()))
+            self.conn.commit()
+
+    def pending(self):
+        """(source, size) of every file not transferred yet, failed ones included"""
+        return self.execute("SELECT source, size FROM files WHERE status != 'done' ORDER BY source")
+
+    def stored_object(self, sha256):
+        rows = self.execute("SELECT object_key FROM objects WHERE sha256 = ?", (sha256,))
+        return rows[0][0] if rows else None
+
+    def record_object(self, sha256, object_key, size):
+        self.execute(
+            "INSERT OR IGNORE INTO objects (sha256, object_key, size, uploaded_at) VALUES (?, ?, ?, ?)",
+            (sha256, object_key, size, now())
+        )
+
+    def finish_file(self, source, sha256, object_key, deduplicated):
+        self.execute(
+            "UPDATE files SET status = 'done', sha256 = ?, object_key = ?, deduplicated = ?, error = NULL, "
+            "updated_at = ? WHERE source = ?",
+            (sha256, object_key, int(deduplicated), now(), source)
+        )
+
+    def fail_file(self, source, error):
+        self.execute(
+            "UPDATE files SET status = 'failed', error = ?, updated_at = ? WHERE source = ?", (error, now(), source)
+        )
+
+    def multipart(self, sha256):
+        """(upload id, part size, {part number: etag}) of an unfinished upload, or None"""
+        rows = self.execute("SELECT upload_id, part_size FROM multipart_uploads WHERE sha256 = ?", (sha256,))
+        if not rows:
+            return None
+        parts = self.execute("SELECT part_number, etag FROM multipart_parts WHERE sha256 = ?", (sha256,))
+        return rows[0][0], rows[0][1], dict(parts)
+
+    def start_multipart(self, sha256, object_key, upload_id, part_size):
+        self.execute(
+            "INSERT OR REPLACE INTO multipart_uploads (sha256, object_key, upload_id, part_size) VALUES (?, ?, ?, ?)",
+            (sha256, object_key, upload_id, part_size)
+        )
+
+    def record_part(self, sha256, number, etag):
+        self.execute("INSERT OR REPLACE INTO multipart_parts (sha256, part_number, etag) VALUES (?, ?, ?)",
+                     (sha256, number, etag))
+
+    def clear_multipart(self, sha256):
+        with self.lock:
+            self.conn.execute("DELETE FROM multipart_parts WHERE sha256 = ?", (sha256,))
+            self.conn.execute("DELETE FROM multipart_uploads WHERE sha256 = ?", (sha256,))
+            self.conn.commit()
+
+    def totals(self):
+        """{status: (files, bytes)}"""
+        return {status: (files, size or 0) for status, files, size in
+                self.execute("SELECT status, count(*), sum(size) FROM files GROUP BY status")}
+
+    def write_mapping(self, path):
+        """CSV of source, object_key, sha256, size for every transferred file"""
+        rows = self.execute(
+            "SELECT source, object_key, sha256, size FROM files WHERE status = 'done' ORDER BY source"
+        )
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['source', 'object_key', 'sha256', 'size'])
+            writer.writerows(rows)
+        return len(rows)
+
+class LocalSource:
+    """Files under a local directory; a file's source name is its relative path"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def scan(self):
+        """(source, size, fingerprint) of every file"""
+        for directory, dirs, files in os.walk(self.root):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                yield os.path.relpath(path, self.root), stat.st_size, str(stat.st_mtime_ns)
+
+    def open(self, source):
+        """(path of a readable local copy, cleanup function)"""
+        return os.path.join(self.root, source), lambda: None
+
+class S3Source:
+    """Objects under a prefix of a bucket on an S3-compatible endpoint"""
+
+    def __init__(self, url, target, work_dir):
+        parts = urlsplit(url)
+        self.bucket = parts.netloc
+        self.prefix = parts.path.lstrip('/')
+        self.target = target
+        self.work_dir = work_dir
+
+    def scan(self):
+        token = None
+        while True:
+            query = {'list-type': '2', 'prefix': self.prefix}
+            if token:
+                query['continuation-token'] = token
+            _, _, data = self.target.s3('GET', f"/{self.bucket}", query=query)
+            root = ElementTree.fromstring(data)
+            namespace = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+            for entry in root.iter(f"{namespace}Contents"):
+                key = entry.findtext(f"{namespace}Key")
+                if key.endswith('/'):
+                    continue
+                yield key, int(entry.findtext(f"{namespace}Size")), entry.findtext(f"{namespace}ETag", '').strip('"')
+            token = root.findtext(f"{namespace}NextContinuationToken")
+            if root.findtext(f"{namespace}IsTruncated") != 'true' or not token:
+                break
+
+    def open(self, source):
+        """Download the object to the work directory"""
+        fd, path = tempfile.mkstemp(dir=self.work_dir, suffix='.download')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.target.s3('GET', f"/{self.bucket}/{source}", sink=f.write)
+        except Exception:
+            os.remove(path)
+            raise
+        return path, lambda: os.remove(path)
+
+class RateLimiter:
+    """Token bucket over all workers; acquire(n) waits until n more bytes may be sent"""
+
+    def __init__(self, bytes_per_s):
+        self.rate = bytes_per_s
+        self.available = 0.0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count):
+        if not self.rate:
+            return
+        with self.lock:
+            current = time.monotonic()
+            # At most one second of unused bandwidth carries over
+            self.available = min(self.rate, self.available + (current - self.last) * self.rate) - count
+            self.last = current
+            wait = -self.available / self.rate if self.available < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class Progress:
+    """Counters of the run, printed every PROGRESS_INTERVAL_S by a background thread"""
+
+    def __init__(self, files, size):
+        self.files = files
+        self.size = size
+        self.done = self.deduplicated = self.failed = 0
+        self.uploaded = self.skipped_bytes = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.report_periodically, daemon=True)
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def rate(self, uploaded, seconds):
+        return uploaded / 1048576 / seconds if seconds > 0 else 0.0
+
+    def line(self, window_rate=None):
+        elapsed = time.monotonic() - self.started
+        now_rate = f"{window_rate:6.1f} MB/s now, " if window_rate is not None else ""
+        handled = (self.uploaded + self.skipped_bytes) / self.size * 100 if self.size else 100.0
+        return (f"  {handled:5.1f}%  {self.done + self.failed}/{self.files} files "
+                f"({self.deduplicated} duplicates, {self.failed} failed), "
+                f"{self.uploaded / 1048576:,.1f} MB uploaded, {self.skipped_bytes / 1048576:,.1f} MB not sent, "
+                f"{now_rate}{self.rate(self.uploaded, elapsed):6.1f} MB/s sustained")
+
+    def report_periodically(self):
+        last_time, last_uploaded = self.started, 0
+        while not self.stopping.wait(PROGRESS_INTERVAL_S):
+            current, uploaded = time.monotonic(), self.uploaded
+            print(self.line(self.rate(uploaded - last_uploaded, current - last_time)), flush=True)
+            last_time, last_uploaded = current, uploaded
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+class Stopped(Exception):
+    """The run was interrupted; the file stays pending"""
+
+class Migration:
+    """Transfers the pending files of the manifest to the destination bucket"""
+
+    def __init__(self, source, target, bucket, prefix, manifest, part_size, limiter, progress, retries):
+        self.source = source
+        self.target = target
+        self.bucket = bucket
+        self.prefix = prefix
+        self.manifest = manifest
+        self.part_size = part_size
+        self.limiter = limiter
+        self.progress = progress
+        self.retries = retries
+        # sha256 of the objects being uploaded by a worker, so duplicates wait instead of uploading too
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+        # Set on interruption: multipart uploads stop after their current part
+        self.stopping = threading.Event()
+
+    def object_key(self, sha256, source):
+        extension = os.path.splitext(source)[1].lower()
+        return f"{self.prefix}{sha256[:2]}/{sha256}{extension}"
+
+    def exists(self, object_key):
+        status, _, _ = self.target.s3('HEAD', f"/{self.bucket}/{object_key}", expect=(200, 404))
+        return status == 200
+
+    def send(self, method, object_key, body, query=None):
+        self.limiter.acquire(len(body))
+        content_type = mimetypes.guess_type(object_key)[0] or 'application/octet-stream'
+        _, headers, _ = self.target.s3(
+            method, f"/{self.bucket}/{object_key}", query=query, body=body,
+            headers={'Content-Length': str(len(body)), 'Content-Type': content_type}
+        )
+        self.progress.add(uploaded=len(body))
+        return headers
+
+    def upload(self, path, size, sha256, object_key):
+        """Upload the file in one PUT, or as a multipart upload resumed from the manifest"""
+        if size <= self.part_size:
+            with open(path, 'rb') as f:
+                self.send('PUT', object_key, f.read())
+            return
+        resumed = self.manifest.multipart(sha256)
+        if resumed and resumed[1] == self.part_size:
+            upload_id, _, etags = resumed
+        else:
+            _, _, data = self.target.s3(
+                'POST', f"/{self.bucket}/{object_key}", query={'uploads': ''},
+                headers={'Content-Type': mimetypes.guess_type(object_key)[0] or 'application/octet-stream'}
+            )
+            upload_id = next(element.text for element in ElementTree.fromstring(data).iter()
+                             if element.tag.endswith('UploadId'))
+            self.manifest.clear_multipart(sha256)
+            self.manifest.start_multipart(sha256, object_key, upload_id, self.part_size)
+            etags = {}
+        with open(path, 'rb') as f:
+            for number, offset in enumerate(range(0, size, self.part_size), 1):
+                if number in etags:
+                    self.progress.add(skipped_bytes=min(self.part_size, size - offset))
+                    continue
+                if self.stopping.is_set():
+                    raise Stopped()
+                f.seek(offset)
+                part = f.read(self.part_size)
+                try:
+                    headers = self.send('PUT', object_key, part, {'partNumber': str(number), 'uploadId': upload_id})
+                except RequestFailed as e:
+                    if 'NoSuchUpload' in str(e):
+                        # The upload expired or was aborted; the next attempt starts a new one
+                        self.manifest.clear_multipart(sha256)
+                    raise
+                etags[number] = headers['ETag']
+                self.manifest.record_part(sha256, number, headers['ETag'])
+        complete = '<CompleteMultipartUpload>' + ''.join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+            for number, etag in sorted(etags.items())
+        ) + '</CompleteMultipartUpload>'
+        self.target.s3('POST', f"/{self.bucket}/{object_key}", query={'uploadId': upload_id}, body=complete.encode())
+        self.manifest.clear_multipart(sha256)
+
+    def claim(self, sha256):
+        """True when this worker uploads sha256; otherwise waits for the worker that does"""
+        with self.in_flight_lock:
+            event = self.in_flight.get(sha256)
+            if event is None:
+                self.in_flight[sha256] = threading.Event()
+                return True
+        event.wait()
+        return False
+
+    def release(self, sha256):
+        with self.in_flight_lock:
+            self.in_flight.pop(sha256).set()
+
+    def transfer(self, source, size):
+        """Hash, deduplicate and upload one file; returns (sha256, object key, deduplicated)"""
+        path, cleanup = self.source.open(source)
+        try:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+                    digest.update(chunk)
+            sha256 = digest.hexdigest()
+            while True:
+                object_key = self.manifest.stored_object(sha256)
+                if object_key:
+                    return sha256, object_key, True
+                if self.claim(sha256):
+                    break
+            try:
+                object_key = self.object_key(sha256, source)
+                deduplicated = self.exists(object_key)
+                if not deduplicated:
+                    self.upload(path, size, sha256, object_key)
+                self.manifest.record_object(sha256, object_key, size)
+                return sha256, object_key, deduplicated
+            finally:
+                self.release(sha256)
+        finally:
+            cleanup()
+
+    def run_file(self, source, size, deadline):
+        """Transfer one file with retries and record the outcome"""
+        if self.stopping.is_set() or (deadline and time.time() >= deadline):
+            return
+        for attempt in range(self.retries + 1):
+            try:
+                sha256, object_key, deduplicated = self.transfer(source, size)
+                self.manifest.finish_file(source, sha256, object_key, deduplicated)
+                self.progress.add(done=1, deduplicated=int(deduplicated),
+                                  skipped_bytes=size if deduplicated else 0)
+                return
+            except Stopped:
+                return
+            except Exception as e:
+                error = str(e).strip() or type(e).__name__
+                if attempt < self.retries:
+                    time.sleep(2 ** attempt)
+                    continue
+                print(f"  ❌ {source}: {error}", flush=True)
+                self.manifest.fail_file(source, error)
+                self.progress.add(failed=1)
+
+def parse_endpoint(url):
+    """(host, port) of http://host:port"""
+    parts = urlsplit(url if '://' in url else f"http://{url}")
+    if parts.scheme != 'http':
+        raise ValueError(f"only http endpoints are supported: {url}")
+    return parts.hostname, parts.port or 80
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Migrate media files into the MinIO uploads bucket")
+    parser.add_argument('--source', required=True, help="local directory, or s3://bucket/prefix")
+    parser.add_argument('--source-endpoint', help="S3-compatible endpoint of an s3:// source")
+    parser.add_argument('--source-access-key', default=os.environ.get('SOURCE_ACCESS_KEY'))
+    parser.add_argument('--source-secret-key', default=os.environ.get('SOURCE_SECRET_KEY'))
+    parser.add_argument('--endpoint', default='http://localhost:9000', help="MinIO endpoint")
+    parser.add_argument('--access-key', default=os.environ.get('MINIO_ACCESS_KEY'), help="default: $MINIO_ACCESS_KEY")
+    parser.add_argument('--secret-key', default=os.environ.get('MINIO_SECRET_KEY'), help="default: $MINIO_SECRET_KEY")
+    parser.add_argument('--bucket', default='uploads')
+    parser.add_argument('--prefix', default='attachments/', help="key prefix of the stored objects")
+    parser.add_argument('--manifest', default='migrate_media.sqlite', help="SQLite manifest to resume from")
+    parser.add_argument('--workers', type=int, default=8, help="files transferred at the same time")
+    parser.add_argument('--part-size', default='16M', help="multipart part size (at least 5M)")
+    parser.add_argument('--retries', type=int, default=3, help="extra attempts per failing file")
+    parser.add_argument('--limit-mbps', type=float, default=0, help="upload rate cap in MB/s (0: none)")
+    parser.add_argument('--until', help="HH:MM after which no new file is started")
+    parser.add_argument('--work-dir', default=tempfile.gettempdir(), help="where s3:// objects are downloaded")
+    parser.add_argument('--mapping', help="write source,object_key,sha256,size of the transferred files as CSV")
+    args = parser.parse_args()
+    args.part_size = parse_size(args.part_size)
+    if args.part_size < 5 * 1024 * 1024:
+        parser.error("--part-size must be at least 5M")
+    if not (args.access_key and args.secret_key):
+        parser.error("the MinIO credentials are required: --access-key and --secret-key")
+    if args.source.startswith('s3://') and not args.source_endpoint:
+        parser.error("an s3:// source needs --source-endpoint")
+    return args
+
+def deadline_of(until):
+    """Epoch seconds of the next HH:MM (tomorrow once today's has passed), or None"""
+    if not until:
+        return None
+    hour, minute = (int(part) for part in until.split(':'))
+    current = datetime.now()
+    deadline = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if deadline <= current:
+        deadline += timedelta(days=1)
+    return deadline.timestamp()
+
+def main():
+    args = parse_args()
+    host, port = parse_endpoint(args.endpoint)
+    target = S3Target('minio', host, port, args.access_key, args.secret_key)
+    if args.source.startswith('s3://'):
+        source_host, source_port = parse_endpoint(args.source_endpoint)
+        source = S3Source(args.source, S3Target(
+            'source', source_host, source_port, args.source_access_key or '', args.source_secret_key or ''
+        ), args.work_dir)
+    else:
+        if not os.path.isdir(args.source):
+            print(f"❌ {args.source} is not a directory")
+            sys.exit(1)
+        source = LocalSource(args.source)
+
+    manifest = Manifest(args.manifest)
+    print(f"🔎 Scanning {args.source}...")
+    try:
+        batch = []
+        for entry in source.scan():
+            batch.append(entry)
+            if len(batch) >= 1000:
+                manifest.add_sources(batch)
+                batch = []
+        manifest.add_sources(batch)
+        target.create_bucket(args.bucket)
+    except (OSError, RequestFailed) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    pending = manifest.pending()
+    totals = manifest.totals()
+    done_files, done_bytes = totals.get('done', (0, 0))
+    pending_bytes = sum(size for _, size in pending)
+    print(f"📋 {len(pending)} file(s), {pending_bytes / 1048576:,.1f} MB to transfer; "
+          f"{done_files} file(s), {done_bytes / 1048576:,.1f} MB already done")
+    if not pending:
+        if args.mapping:
+            print(f"💾 {manifest.write_mapping(args.mapping)} file(s) written to {args.mapping}")
+        return
+
+    deadline = deadline_of(args.until)
+    progress = Progress(len(pending), pending_bytes)
+    migration = Migration(
+        source, target, args.bucket, args.prefix, manifest, args.part_size,
+        RateLimiter(args.limit_mbps * 1048576), progress, args.retries
+    )
+    print(f"🚀 Transferring with {args.workers} worker(s), {args.part_size // 1048576} MB parts"
+          + (f", at most {args.limit_mbps} MB/s" if args.limit_mbps else "")
+          + (f", until {args.until}" if deadline else ""))
+    progress.start()
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        list(pool.map(lambda entry: migration.run_file(entry[0], entry[1], deadline), pending))
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrupted; finishing the parts in progress...", flush=True)
+        migration.stopping.set()
+        pool.shutdown(cancel_futures=True)
+        progress.stop()
+        print(progress.line())
+        print("   Run again with the same manifest to resume")
+        sys.exit(130)
+    pool.shutdown()
+    progress.stop()
+
+    print(progress.line())
+    elapsed = time.monotonic() - progress.started
+    remaining = len(manifest.pending())
+    print(f"\n{'✅' if not remaining else '⏸️ '} {progress.done} file(s) transferred in {elapsed:.0f}s, "
+          f"{progress.deduplicated} of them duplicates; "
+          f"{progress.rate(progress.uploaded, elapsed):.1f} MB/s sustained")
+    if args.mapping:
+        print(f"💾 {manifest.write_mapping(args.mapping)} file(s) written to {args.mapping}")
+    if remaining:
+        print(f"   {remaining} file(s) left ({progress.failed} failed); run again with the same manifest to resume")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
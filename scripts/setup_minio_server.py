@@ -1,11 +1,91 @@
 #!/usr/bin/env python3
+"""
+Provision the MinIO storage servers (MinIO, nginx, storage API, firewall)
+
+The setup is a plan of steps grouped in phases. Every step has a cheap probe
+that tells whether the host already satisfies it (file content checksum,
+package installed, service active, firewall rule present). All probes run in
+one remote script; the unsatisfied steps of each phase are then sent as one
+remote script per phase. A rerun against a provisioned host only probes, and
+keeps the MinIO credentials already configured on it.
+
+The MinIO binary and the storage API (server.js with its node_modules) are
+artifacts: fetched or built once on this machine into a local cache where
+each is named by its sha256 (--artifact-cache), and reused until their inputs
+change. A step that installs an artifact first copies it over SFTP, in
+chunks, to a staging directory on the host, unless a staged copy with the
+same checksum is already there; the checksum of the copy is verified on the
+host before it is installed. Hosts therefore need no access to dl.min.io or
+the npm registry, and an unchanged artifact is never copied again.
+
+With --inventory, every host in the inventory is provisioned at the same time
+(--parallel at most) as one distributed, erasure-coded MinIO deployment:
+MINIO_VOLUMES lists every drive of every node, and each node's nginx
+load-balances /minio/ across all nodes. Output lines carry the host name, and
+a host that fails is reported without stopping the others. Inventory:
+
+    {
+      "user": "ubuntu", "password": "...",
+      "drives": ["/mnt/disk1", "/mnt/disk2", "/mnt/disk3", "/mnt/disk4"],
+      "hosts": [
+        {"name": "minio1", "address": "10.0.0.11"},
+        {"name": "minio2", "address": "10.0.0.12", "port": 2222, "minio_host": "minio2.internal"}
+      ]
+    }
+
+Hosts may also be plain addresses. user, password and port can be set per
+host; minio_host is the name the nodes use to reach each other (default:
+address).
+
+nginx.conf, the nginx site and the systemd units are rendered from a
+performance profile (--profile, knobs overridden with --set; see
+storage_profiles.py) and checked with nginx -t and systemd-analyze verify on
+this machine before any host is touched. A check that cannot run stops the
+setup as well: point --nginx or --systemd-analyze at a working command (e.g.
+in a container), or pass --skip-validation to provision unvalidated.
+
+Once provisioned, every host gets one round of storage_monitor.py's probes
+from this machine: MinIO, the storage API, nginx's /minio/ and /console/
+routes and a small upload, with their latencies.
+
+Usage:
+    python3 setup_minio_server.py                 # provision HOST
+    python3 setup_minio_server.py --check         # list the steps that would run
+    python3 setup_minio_server.py --host 127.0.0.1 --port 2222 --user ubuntu --password ubuntu
+                                                  # e.g. an Ubuntu container running sshd
+    python3 setup_minio_server.py --inventory fleet.json --parallel 8
+    python3 setup_minio_server.py --profile high-concurrency-upload --set nginx_upstream_keepalive=64
+    python3 setup_minio_server.py --nginx "docker run --rm -v /tmp:/tmp nginx:stable nginx"
+    python3 setup_minio_server.py --minio-binary ./minio  # seed the cache on a machine without internet
+"""
 
 import paramiko
 import time
 import sys
 import os
+import re
+import json
+import gzip
+import base64
 import random
+import select
 import string
+import hashlib
+import tarfile
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from storage_profiles import (
+    PROFILES, DEFAULT_PROFILE, load_profile, api_ports, render_nginx_conf, render_nginx_site,
+    render_minio_service, render_storage_api_service, validate_profile, print_validation,
+)
+from storage_benchmark import S3Target, RequestFailed
+from storage_monitor import build_probes, probe_round, format_result
 
 # Server credentials
 HOST = "157.10.73.52"
@@ -16,180 +96,160 @@ def generate_key(length):
     """Generate random key for MinIO credentials"""
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
-def execute_command(ssh, command, print_output=True):
-    """Execute command via SSH and return output"""
-    stdin, stdout, stderr = ssh.exec_command(command)
-    output = stdout.read().decode()
-    error = stderr.read().decode()
-    
-    if print_output and output:
-        print(output)
-    if error:
-        print(f"Error: {error}")
-    
-    return output, error
+# Full command output goes here; the console only shows it when print_output is set
+LOG_FILE = "setup_minio_server.log"
 
-def setup_minio_server():
-    """Main setup function"""
-    print("🚀 Starting MinIO Storage Server Setup...")
-    print(f"📡 Connecting to {HOST}...")
-    
-    # Create SSH client
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
-    try:
-        # Connect to server
-        ssh.connect(HOST, username=USER, password=PASSWORD, timeout=30)
-        print("✅ Connected successfully!")
-        
-        # Generate credentials
-        access_key = generate_key(20)
-        secret_key = generate_key(40)
-        
-        print("\n📦 Installing required packages...")
-        commands = [
-            # Update system
-            "sudo apt update",
-            "sudo apt upgrade -y",
-            
-            # Install required packages
-            "sudo apt install -y wget curl nginx certbot python3-certbot-nginx ufw nodejs npm",
-            
-            # Download and install MinIO
-            "cd /tmp && wget -q https://dl.min.io/server/minio/release/linux-amd64/minio",
-            "chmod +x /tmp/minio",
-            "sudo mv /tmp/minio /usr/local/bin/",
-            
-            # Create MinIO user and directories
-            "sudo useradd -r minio-user -s /sbin/nologin 2>/dev/null || true",
-            "sudo mkdir -p /mnt/data",
-            "sudo mkdir -p /etc/minio",
-            "sudo chown -R minio-user:minio-user /mnt/data",
-            "sudo chown -R minio-user:minio-user /etc/minio",
-        ]
-        
-        for cmd in commands:
-            print(f"  Running: {cmd}")
-            execute_command(ssh, cmd, print_output=False)
-        
-        print("\n🔐 Creating MinIO configuration...")
-        
-        # Create MinIO environment file
-        minio_config = f"""# MinIO Configuration
-MINIO_ROOT_USER="{access_key}"
-MINIO_ROOT_PASSWORD="{secret_key}"
-MINIO_VOLUMES="/mnt/data"
-MINIO_OPTS="--console-address :9001"
-"""
-        
-        # Write config file
-        execute_command(ssh, f"echo '{minio_config}' | sudo tee /etc/default/minio > /dev/null")
-        
-        # Create systemd service
-        print("📝 Creating systemd service...")
-        service_content = """[Unit]
-Description=MinIO
-Documentation=https://docs.min.io
-Wants=network-online.target
-After=network-online.target
-AssertFileIsExecutable=/usr/local/bin/minio
-
-[Service]
-WorkingDirectory=/usr/local/
-User=minio-user
-Group=minio-user
-ProtectProc=invisible
-EnvironmentFile=/etc/default/minio
-ExecStartPre=/bin/bash -c "if [ -z \\"${MINIO_VOLUMES}\\" ]; then echo \\"Variable MINIO_VOLUMES not set\\"; exit 1; fi"
-ExecStart=/usr/local/bin/minio server $MINIO_OPTS $MINIO_VOLUMES
-Restart=always
-StandardOutput=journal
-StandardError=inherit
-LimitNOFILE=65536
-TasksMax=infinity
-TimeoutStopSec=infinity
-SendSIGKILL=no
-
-[Install]
-WantedBy=multi-user.target"""
-        
-        execute_command(ssh, f"echo '{service_content}' | sudo tee /etc/systemd/system/minio.service > /dev/null")
-        
-        # Start MinIO service
-        print("🚀 Starting MinIO service...")
-        execute_command(ssh, "sudo systemctl daemon-reload")
-        execute_command(ssh, "sudo systemctl enable minio")
-        execute_command(ssh, "sudo systemctl start minio")
-        
-        # Configure Nginx
-        print("\n🌐 Configuring Nginx...")
-        nginx_config = """upstream minio {
-    server localhost:9000;
-}
+# Lines of stdout/stderr kept in memory per command (the log has everything)
+CAPTURE_LINES = 200
 
-upstream minio-console {
-    server localhost:9001;
-}
+CommandResult = namedtuple('CommandResult', 'output error exit_status duration')
 
-server {
-    listen 80;
-    listen [::]:80;
-    server_name _;
-    
-    client_max_body_size 100M;
-    proxy_buffering off;
-    proxy_request_buffering off;
-    
-    location /minio/ {
-        rewrite ^/minio/(.*) /$1 break;
-        proxy_set_header Host $http_host;
-        proxy_set_header X-Real-IP $remote_addr;
-        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
-        proxy_set_header X-Forwarded-Proto $scheme;
-        proxy_connect_timeout 300;
-        proxy_http_version 1.1;
-        proxy_set_header Connection "";
-        chunked_transfer_encoding off;
-        proxy_pass http://minio;
-    }
-    
-    location /console/ {
-        rewrite ^/console/(.*) /$1 break;
-        proxy_set_header Host $http_host;
-        proxy_set_header X-Real-IP $remote_addr;
-        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
-        proxy_set_header X-Forwarded-Proto $scheme;
-        proxy_set_header X-NginX-Proxy true;
-        proxy_connect_timeout 300;
-        proxy_http_version 1.1;
-        proxy_set_header Upgrade $http_upgrade;
-        proxy_set_header Connection "upgrade";
-        chunked_transfer_encoding off;
-        proxy_pass http://minio-console;
-    }
-}"""
-        
-        execute_command(ssh, f"echo '{nginx_config}' | sudo tee /etc/nginx/sites-available/minio > /dev/null")
-        execute_command(ssh, "sudo ln -sf /etc/nginx/sites-available/minio /etc/nginx/sites-enabled/")
-        execute_command(ssh, "sudo rm -f /etc/nginx/sites-enabled/default")
-        execute_command(ssh, "sudo nginx -t && sudo systemctl reload nginx")
-        
-        # Setup Storage API
-        print("\n📦 Setting up Storage API Server...")
-        
-        # Create storage API directory
-        execute_command(ssh, "mkdir -p ~/storage-api")
-        
-        # Copy storage API server
-        with open('/Users/user/Desktop/apps/plp-456/scripts/storage-api-server.js', 'r') as f:
-            api_content = f.read()
-        
-        # Write API server file
-        execute_command(ssh, f"cat > ~/storage-api/server.js << 'EOF'\n{api_content}\nEOF")
-        
-        # Create package.json
-        package_json = """{
+class CommandFailed(Exception):
+    """A remote command exited with a non-zero status"""
+
+# (host, step, command label, seconds, exit status) of every command run so far
+timings = []
+log_file = None
+output_lock = threading.Lock()
+
+# Host and step of the commands run by the current thread
+context = threading.local()
+
+def host_prefix():
+    """'[host] ' when the current thread provisions one host of a fleet"""
+    host = getattr(context, 'host', None)
+    return f"[{host}] " if host else ""
+
+def say(message):
+    """Print a message, each line prefixed with the host being provisioned"""
+    prefix = host_prefix()
+    with output_lock:
+        for line in message.split('\n'):
+            print(f"{prefix}{line}" if line else "")
+
+def log(line):
+    """Append a timestamped line to LOG_FILE"""
+    global log_file
+    with output_lock:
+        if log_file is None:
+            log_file = open(LOG_FILE, 'a', encoding='utf-8')
+        log_file.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {host_prefix()}{line}\n")
+        log_file.flush()
+
+def begin_step(name):
+    """Attribute the commands that follow to a named step in the timing summary"""
+    context.step = name
+    log(f"=== {name}")
+
+def execute_command(ssh, command, print_output=True, check=True, stdin=None, log_output=True, label=None):
+    """Execute command via SSH, streaming its output; returns a CommandResult
+
+    stdout and stderr are read as they arrive from one select() loop, so a
+    command writing a lot to either stream never blocks on a full window.
+    stdin, when given, is sent from the same loop. Every line goes to LOG_FILE
+    unless log_output is off (secrets); only the last CAPTURE_LINES of each
+    stream are kept for the result. With check, a non-zero exit raises
+    CommandFailed. label replaces the command in the timing summary.
+    """
+    channel = ssh.get_transport().open_session()
+    channel.exec_command(command)
+    pending = (stdin or '').encode()
+    if not pending:
+        # Nothing is sent on stdin; closing it keeps prompts from waiting for input
+        channel.shutdown_write()
+    label = label or command.splitlines()[0]
+    log(f"$ {command}" if label == command else f"$ {command}  # {label}")
+
+    started = time.monotonic()
+    captured = {'out': deque(maxlen=CAPTURE_LINES), 'err': deque(maxlen=CAPTURE_LINES)}
+    partial = {'out': b'', 'err': b''}
+
+    def emit(stream, data, final=False):
+        lines = (partial[stream] + data).split(b'\n')
+        partial[stream] = b'' if final else lines.pop()
+        for raw in lines:
+            if final and not raw:
+                continue
+            line = raw.decode(errors='replace').rstrip('\r')
+            captured[stream].append(line)
+            if log_output:
+                log(f"[{stream}] {line}")
+            if stream == 'err':
+                say(f"    ! {line}")
+            elif print_output:
+                say(f"    {line}")
+
+    while True:
+        select.select([channel], [], [], 0.05 if pending else 1.0)
+        received = False
+        if pending and channel.exit_status_ready():
+            pending = b''
+        while pending and channel.send_ready():
+            sent = channel.send(pending[:32768])
+            pending = pending[sent:]
+            if not pending:
+                channel.shutdown_write()
+        while channel.recv_ready():
+            emit('out', channel.recv(32768))
+            received = True
+        while channel.recv_stderr_ready():
+            emit('err', channel.recv_stderr(32768))
+            received = True
+        if not received and channel.exit_status_ready() and channel.eof_received \
+                and not channel.recv_ready() and not channel.recv_stderr_ready():
+            break
+    emit('out', b'', final=True)
+    emit('err', b'', final=True)
+
+    exit_status = channel.recv_exit_status()
+    channel.close()
+    duration = time.monotonic() - started
+    timings.append((getattr(context, 'host', None), getattr(context, 'step', "setup"), label, duration, exit_status))
+    log(f"exit {exit_status} after {duration:.1f}s")
+
+    result = CommandResult('\n'.join(captured['out']), '\n'.join(captured['err']), exit_status, duration)
+    if exit_status != 0:
+        say(f"    ❌ exit status {exit_status} after {duration:.1f}s: {label[:80]}")
+        if check:
+            raise CommandFailed(f"'{label[:80]}' exited with status {exit_status}")
+    return result
+
+def print_timing_summary(top=10):
+    """Print time per step and the slowest commands"""
+    if not timings:
+        return
+    total = sum(duration for _, _, _, duration, _ in timings)
+    steps = {}
+    for host, step, _, duration, _ in timings:
+        key = f"{host}: {step}" if host else step
+        steps[key] = steps.get(key, 0) + duration
+    print("\n⏱️  Time per step:")
+    for step, duration in sorted(steps.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {duration:8.1f}s {duration / total * 100 if total else 0:5.1f}%  {step}")
+    print(f"  {total:8.1f}s total over {len(timings)} commands")
+    print("\n🐢 Slowest commands:")
+    for host, step, label, duration, exit_status in sorted(timings, key=lambda item: item[3], reverse=True)[:top]:
+        status = "" if exit_status == 0 else f"  (exit {exit_status})"
+        where = f"[{host}] " if host else ""
+        print(f"  {duration:8.1f}s  {where}{label[:70]}{status}")
+
+# Apt packages the storage stack needs; MinIO and node_modules come from the artifacts
+PACKAGES = ["curl", "nginx", "certbot", "python3-certbot-nginx", "ufw", "nodejs"]
+
+MINIO_URL = "https://dl.min.io/server/minio/release/linux-amd64/minio"
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Local cache of the artifacts pushed to the hosts
+ARTIFACT_CACHE = os.path.expanduser("~/.cache/plp-storage")
+
+# Artifacts are staged under $HOME on the hosts, named by their sha256
+STAGING_DIR = ".plp-storage/artifacts"
+
+# Artifacts are hashed and copied over SFTP in chunks of this size
+CHUNK_SIZE = 1024 * 1024
+
+STORAGE_API_PACKAGE_JSON = """{
   "name": "storage-api",
   "version": "1.0.0",
   "main": "server.js",
@@ -202,88 +262,714 @@ server {
     "minio": "^7.1.3",
     "cors": "^2.8.5"
   }
-}"""
-        
-        execute_command(ssh, f"cat > ~/storage-api/package.json << 'EOF'\n{package_json}\nEOF")
-        
-        # Create .env file
-        env_content = f"""PORT=3500
-MINIO_ENDPOINT=localhost
+}
+"""
+
+# Stamp files of steps without a natural state to probe
+STATE_DIR = "/var/lib/plp-storage"
+
+# apt upgrade is repeated at most this often
+UPGRADE_INTERVAL_MINUTES = 24 * 60
+
+FIREWALL_PORTS = [22, 80, 443, 9000, 9001, 3500]
+
+# Drive of a single-node setup without an inventory
+DEFAULT_DRIVES = ["/mnt/data"]
+
+# name: step name; probe: shell test that exits 0 when the step is already
+# satisfied; apply: shell commands that satisfy it; after: steps whose
+# application forces this one to run too (restarts after a config change);
+# artifacts: artifacts the apply commands install from the staging directory
+Step = namedtuple('Step', 'name probe apply after artifacts')
+
+def plan_step(name, probe, apply, after=(), artifacts=()):
+    """A plan step; see Step"""
+    return Step(name, probe, apply, tuple(after), tuple(artifacts))
+
+def file_step(name, path, content, sudo=True, mode="644"):
+    """Step that writes content to path unless the file already has exactly that content
+
+    path is expanded by the remote shell, so $HOME may be used.
+    """
+    digest = hashlib.sha256(content.encode()).hexdigest()
+    encoded = base64.b64encode(content.encode()).decode()
+    prefix = "sudo " if sudo else ""
+    return plan_step(
+        name,
+        f"echo \"{digest}  {path}\" | {prefix}sha256sum -c --status",
+        f"echo '{encoded}' | base64 -d | {prefix}tee {path} > /dev/null\n{prefix}chmod {mode} {path}",
+    )
+
+# name: label; digest: sha256; path: the file in the local cache
+Artifact = namedtuple('Artifact', 'name digest path size')
+
+def sha256_file(path):
+    """Hex sha256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ArtifactCache:
+    """Local store of artifacts, each file named by its sha256
+
+    index.json maps a key, naming what an artifact was made from, to its
+    digest, so an artifact is fetched or built once and reused afterwards.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self.index_path = os.path.join(root, 'index.json')
+        try:
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            self.index = {}
+
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest)
+
+    def temp_path(self):
+        """A new empty file in the cache, for an artifact being fetched or built"""
+        fd, path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        os.close(fd)
+        return path
+
+    def get(self, key, name):
+        """The cached artifact for key, or None when missing or corrupt"""
+        digest = self.index.get(key)
+        if digest is None or not os.path.exists(self.object_path(digest)):
+            return None
+        path = self.object_path(digest)
+        if sha256_file(path) != digest:
+            os.remove(path)
+            return None
+        return Artifact(name, digest, path, os.path.getsize(path))
+
+    def add(self, key, name, source):
+        """Move the file at source into the cache as the artifact for key"""
+        digest = sha256_file(source)
+        path = self.object_path(digest)
+        os.replace(source, path)
+        self.index[key] = digest
+        index_temp = self.index_path + '.part'
+        with open(index_temp, 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(index_temp, self.index_path)
+        return Artifact(name, digest, path, os.path.getsize(path))
+
+def minio_artifact(cache, local_binary=None, refresh=False):
+    """The MinIO server binary, downloaded from MINIO_URL once or taken from local_binary"""
+    key = f"minio {MINIO_URL}"
+    if local_binary:
+        temp = cache.temp_path()
+        with open(local_binary, 'rb') as source, open(temp, 'wb') as target:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                target.write(chunk)
+        return cache.add(key, "minio", temp)
+    artifact = None if refresh else cache.get(key, "minio")
+    if artifact:
+        return artifact
+
+    print(f"⬇️  Downloading {MINIO_URL}...")
+    with urllib.request.urlopen(MINIO_URL + ".sha256sum", timeout=60) as response:
+        expected = response.read().decode().split()[0]
+    temp = cache.temp_path()
+    try:
+        with urllib.request.urlopen(MINIO_URL, timeout=60) as response, open(temp, 'wb') as f:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                f.write(chunk)
+        if sha256_file(temp) != expected:
+            raise RuntimeError(f"{MINIO_URL} does not match its published sha256 {expected}")
+        return cache.add(key, "minio", temp)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+def reset_metadata(info):
+    """tarfile filter making the bundle depend only on file contents and modes"""
+    info.mtime = 0
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    return info
+
+def storage_api_artifact(cache, refresh=False):
+    """server.js with package.json and installed node_modules, as a reproducible .tar.gz
+
+    npm runs on this machine; the dependencies are plain JavaScript, so the
+    bundle runs on any host with nodejs. A new bundle is only built when
+    storage-api-server.js or the package.json change.
+    """
+    with open(os.path.join(SCRIPT_DIR, 'storage-api-server.js'), 'r') as f:
+        api_content = f.read()
+    inputs = hashlib.sha256((api_content + STORAGE_API_PACKAGE_JSON).encode()).hexdigest()
+    key = f"storage-api {inputs}"
+    artifact = None if refresh else cache.get(key, "storage-api")
+    if artifact:
+        return artifact
+
+    print("📦 Building the storage API bundle (npm install)...")
+    with tempfile.TemporaryDirectory() as build:
+        with open(os.path.join(build, 'server.js'), 'w') as f:
+            f.write(api_content)
+        with open(os.path.join(build, 'package.json'), 'w') as f:
+            f.write(STORAGE_API_PACKAGE_JSON)
+        subprocess.run(
+            ["npm", "install", "--omit=dev", "--no-audit", "--no-fund"], cwd=build, check=True
+        )
+        # Lets the host tell whether the files someone may edit in place still match
+        with open(os.path.join(build, '.bundle.sha256sums'), 'w') as f:
+            for name in ('server.js', 'package.json'):
+                f.write(f"{sha256_file(os.path.join(build, name))}  {name}\n")
+        temp = cache.temp_path()
+        try:
+            with open(temp, 'wb') as raw, \
+                    gzip.GzipFile(filename='', fileobj=raw, mode='wb', mtime=0) as compressed, \
+                    tarfile.open(fileobj=compressed, mode='w') as bundle:
+                for name in sorted(os.listdir(build)):
+                    bundle.add(os.path.join(build, name), arcname=name, filter=reset_metadata)
+            return cache.add(key, "storage-api", temp)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+def prepare_artifacts(cache, minio_binary=None, refresh=False):
+    """{name: Artifact} of everything the plan installs"""
+    artifacts = {
+        'minio': minio_artifact(cache, minio_binary, refresh),
+        'storage-api': storage_api_artifact(cache, refresh),
+    }
+    for artifact in artifacts.values():
+        print(f"  📦 {artifact.name:<12} {artifact.digest[:12]}  {artifact.size / 1048576:7.1f} MB")
+    return artifacts
+
+def staged_path(artifact):
+    """Where the artifact is staged on a host, for the remote shell"""
+    return f"\"$HOME/{STAGING_DIR}/{artifact.digest}\""
+
+def stage_artifacts(ssh, artifacts):
+    """Copy the artifacts the host has no verified copy of to its staging directory
+
+    The copy is streamed over SFTP in CHUNK_SIZE writes to a .part file, whose
+    sha256 is checked on the host before it is renamed into place.
+    """
+    artifacts = list({artifact.digest: artifact for artifact in artifacts}.values())
+    script = f"mkdir -p \"$HOME/{STAGING_DIR}\" && cd \"$HOME/{STAGING_DIR}\"\n" + "\n".join(
+        f"echo '{artifact.digest}  {artifact.digest}' | sha256sum -c --status 2>/dev/null && echo {artifact.digest}"
+        for artifact in artifacts
+    ) + "\ntrue"
+    result = execute_command(
+        ssh, "bash -s", print_output=False, stdin=script, label=f"check {len(artifacts)} staged artifact(s)"
+    )
+    staged = set(result.output.split())
+    missing = [artifact for artifact in artifacts if artifact.digest not in staged]
+    if not missing:
+        return
+    sftp = ssh.open_sftp()
+    try:
+        staging = f"{sftp.normalize('.')}/{STAGING_DIR}"
+        for artifact in missing:
+            started = time.monotonic()
+            with open(artifact.path, 'rb') as local, sftp.open(f"{staging}/{artifact.digest}.part", 'wb') as remote:
+                remote.set_pipelined(True)
+                for chunk in iter(lambda: local.read(CHUNK_SIZE), b''):
+                    remote.write(chunk)
+            duration = time.monotonic() - started
+            timings.append((getattr(context, 'host', None), getattr(context, 'step', "setup"),
+                            f"sftp {artifact.name}", duration, 0))
+            log(f"sftp {artifact.path} -> {staging}/{artifact.digest}.part: {artifact.size} bytes in {duration:.1f}s")
+            say(f"  ⬆️  {artifact.name}: {artifact.size / 1048576:.1f} MB in {duration:.1f}s "
+                f"({artifact.size / 1048576 / max(duration, 0.001):.1f} MB/s)")
+            verified = execute_command(
+                ssh,
+                f"cd \"$HOME/{STAGING_DIR}\" && if echo '{artifact.digest}  {artifact.digest}.part' | sha256sum -c --status; "
+                f"then mv {artifact.digest}.part {artifact.digest}; else rm -f {artifact.digest}.part; exit 1; fi",
+                print_output=False, check=False, label=f"verify {artifact.name}"
+            )
+            if verified.exit_status != 0:
+                raise RuntimeError(f"{artifact.name} failed its checksum after the copy to the host")
+    finally:
+        sftp.close()
+
+def read_credentials(ssh):
+    """(access key, secret key) already configured on the host, or (None, None)"""
+    result = execute_command(
+        ssh, "sudo cat /etc/default/minio 2>/dev/null || true", print_output=False, log_output=False
+    )
+    values = {}
+    for line in result.output.splitlines():
+        key, _, value = line.partition('=')
+        values[key.strip()] = value.strip().strip('"')
+    return values.get('MINIO_ROOT_USER'), values.get('MINIO_ROOT_PASSWORD')
+
+def ellipsis(values):
+    """MinIO {a...b} notation for values differing only in a consecutive number, else None"""
+    if len(values) == 1:
+        return values[0]
+    parts = [re.fullmatch(r'(.*?)(\d+)(\D*)', value) for value in values]
+    if not all(parts):
+        return None
+    prefixes = {part.group(1) for part in parts}
+    suffixes = {part.group(3) for part in parts}
+    numbers = [part.group(2) for part in parts]
+    consecutive = [int(number) for number in numbers] == list(range(int(numbers[0]), int(numbers[0]) + len(numbers)))
+    same_width = len({len(number) for number in numbers}) == 1 or not any(n.startswith('0') for n in numbers)
+    if len(prefixes) != 1 or len(suffixes) != 1 or not consecutive or not same_width:
+        return None
+    return f"{parts[0].group(1)}{{{numbers[0]}...{numbers[-1]}}}{parts[0].group(3)}"
+
+def minio_volumes(nodes, drives):
+    """MINIO_VOLUMES for drives on every node; nodes are the names the nodes reach each other by"""
+    if len(nodes) == 1:
+        return ellipsis(drives) or ' '.join(drives)
+    node_pattern = ellipsis(nodes)
+    drive_pattern = ellipsis(drives)
+    if node_pattern and drive_pattern:
+        return f"http://{node_pattern}:9000{drive_pattern}"
+    # MinIO also accepts every endpoint spelled out, as long as none uses an ellipsis
+    return ' '.join(f"http://{node}:9000{drive}" for node in nodes for drive in drives)
+
+def build_plan(access_key, secret_key, artifacts, nodes=("localhost",), drives=DEFAULT_DRIVES, profile=None,
+               user="ubuntu", home="/home/ubuntu"):
+    """[(phase, [Step])] describing a provisioned host of a deployment over nodes
+
+    artifacts are the {name: Artifact} of prepare_artifacts(); profile is a
+    storage_profiles.load_profile() (default: DEFAULT_PROFILE). The storage
+    API is installed in home/storage-api and runs as user: the SSH user of
+    the host and its home directory.
+    """
+    profile = profile or load_profile(DEFAULT_PROFILE)
+    api_dir = f"{home}/storage-api"
+
+    # Create MinIO environment file
+    minio_config = f"""# MinIO Configuration
+MINIO_ROOT_USER="{access_key}"
+MINIO_ROOT_PASSWORD="{secret_key}"
+MINIO_VOLUMES="{minio_volumes(nodes, drives)}"
+MINIO_OPTS="--console-address :9001"
+"""
+    if profile['minio_api_requests_max']:
+        minio_config += f"MINIO_API_REQUESTS_MAX={profile['minio_api_requests_max']}\n"
+
+    # PORT is set per worker by storage-api@.service
+    env_content = f"""MINIO_ENDPOINT=localhost
 MINIO_PORT=9000
 MINIO_USE_SSL=false
 MINIO_ACCESS_KEY={access_key}
 MINIO_SECRET_KEY={secret_key}
-DEFAULT_BUCKET=uploads"""
-        
-        execute_command(ssh, f"cat > ~/storage-api/.env << 'EOF'\n{env_content}\nEOF")
-        
-        # Install dependencies
-        print("  Installing Node.js dependencies...")
-        execute_command(ssh, "cd ~/storage-api && npm install")
-        
-        # Create systemd service for API
-        api_service = """[Unit]
-Description=Storage API Server
-After=network.target minio.service
-
-[Service]
-Type=simple
-User=ubuntu
-WorkingDirectory=/home/ubuntu/storage-api
-ExecStart=/usr/bin/node server.js
-Restart=on-failure
-Environment=NODE_ENV=production
-
-[Install]
-WantedBy=multi-user.target"""
-        
-        execute_command(ssh, f"echo '{api_service}' | sudo tee /etc/systemd/system/storage-api.service > /dev/null")
-        execute_command(ssh, "sudo systemctl daemon-reload")
-        execute_command(ssh, "sudo systemctl enable storage-api")
-        execute_command(ssh, "sudo systemctl start storage-api")
-        
-        # Configure firewall
-        print("\n🔒 Configuring firewall...")
-        firewall_commands = [
-            "sudo ufw allow 22/tcp",
-            "sudo ufw allow 80/tcp",
-            "sudo ufw allow 443/tcp",
-            "sudo ufw allow 9000/tcp",
-            "sudo ufw allow 9001/tcp",
-            "sudo ufw allow 3500/tcp",
-            "echo 'y' | sudo ufw enable"
+DEFAULT_BUCKET=uploads
+"""
+
+    minio = artifacts['minio']
+    api = artifacts['storage-api']
+    workers = [f"storage-api@{port}.service" for port in api_ports(profile)]
+    wanted = ' '.join(workers)
+    packages = ' '.join(PACKAGES)
+    directories = ' '.join(list(drives) + ["/etc/minio"])
+    ports = ' '.join(str(port) for port in FIREWALL_PORTS)
+    phases = [
+        ("Packages", [
+            plan_step(
+                "apt upgrade",
+                f"test -n \"$(find {STATE_DIR}/apt-upgraded -mmin -{UPGRADE_INTERVAL_MINUTES} 2>/dev/null)\"",
+                "sudo apt-get update\n"
+                "sudo DEBIAN_FRONTEND=noninteractive apt-get upgrade -y\n"
+                f"sudo mkdir -p {STATE_DIR} && sudo touch {STATE_DIR}/apt-upgraded",
+            ),
+            plan_step(
+                "apt install",
+                f"dpkg -s {packages} > /dev/null 2>&1",
+                f"sudo DEBIAN_FRONTEND=noninteractive apt-get install -y {packages}",
+            ),
+        ]),
+        ("MinIO", [
+            plan_step(
+                "minio binary",
+                f"echo '{minio.digest}  /usr/local/bin/minio' | sha256sum -c --status",
+                f"sudo install -m 755 {staged_path(minio)} /usr/local/bin/minio",
+                artifacts=[minio],
+            ),
+            plan_step(
+                "minio-user and directories",
+                "id -u minio-user > /dev/null 2>&1 && "
+                f"for dir in {directories}; do test \"$(stat -c %U $dir 2>/dev/null)\" = minio-user || exit 1; done",
+                "sudo useradd -r minio-user -s /sbin/nologin 2>/dev/null || true\n"
+                f"sudo mkdir -p {directories}\n"
+                f"for dir in {directories}; do sudo chown -R minio-user:minio-user $dir; done",
+            ),
+            file_step("/etc/default/minio", "/etc/default/minio", minio_config, mode="600"),
+            file_step("minio.service", "/etc/systemd/system/minio.service", render_minio_service(profile)),
+            plan_step(
+                "minio running",
+                "systemctl is-enabled --quiet minio && systemctl is-active --quiet minio",
+                "sudo systemctl daemon-reload\n"
+                "sudo systemctl enable minio\n"
+                "sudo systemctl restart minio",
+                after=["minio binary", "/etc/default/minio", "minio.service"],
+            ),
+        ]),
+        ("Storage API", [
+            plan_step(
+                "storage-api bundle",
+                f"cd {api_dir} && test \"$(cat .bundle-digest)\" = {api.digest} "
+                "&& sha256sum -c --status .bundle.sha256sums",
+                f"mkdir -p {api_dir} && rm -rf {api_dir}/node_modules\n"
+                f"tar -xzf {staged_path(api)} -C {api_dir}\n"
+                f"echo {api.digest} > {api_dir}/.bundle-digest",
+                artifacts=[api],
+            ),
+            file_step("storage-api .env", f"{api_dir}/.env", env_content, sudo=False, mode="600"),
+            file_step(
+                "storage-api@.service", "/etc/systemd/system/storage-api@.service",
+                render_storage_api_service(profile, user, home)
+            ),
+            # One instance per worker, named by its port; any other storage-api unit
+            # (a previous worker count, the old single storage-api.service) is stopped
+            plan_step(
+                "storage-api running",
+                f"for unit in {wanted}; do systemctl is-enabled --quiet $unit && systemctl is-active --quiet $unit || exit 1; done && "
+                "test -z \"$(systemctl list-units --plain --no-legend --state=active 'storage-api*' | awk '{print $1}' "
+                f"| grep -vxF {' '.join(f'-e {unit}' for unit in workers)})\"",
+                "sudo systemctl daemon-reload\n"
+                "for unit in $(systemctl list-units --all --plain --no-legend 'storage-api*' | awk '{print $1}'); do\n"
+                f"  case \" {wanted} \" in *\" $unit \"*) ;; *) sudo systemctl disable --now $unit || true;; esac\n"
+                "done\n"
+                "sudo rm -f /etc/systemd/system/storage-api.service\n"
+                "sudo systemctl daemon-reload\n"
+                f"sudo systemctl enable {wanted}\n"
+                f"sudo systemctl restart {wanted}",
+                after=["storage-api bundle", "storage-api .env", "storage-api@.service"],
+            ),
+        ]),
+        ("Nginx", [
+            file_step("nginx.conf", "/etc/nginx/nginx.conf", render_nginx_conf(profile)),
+            file_step("nginx site", "/etc/nginx/sites-available/minio", render_nginx_site(profile, nodes)),
+            plan_step(
+                "nginx site enabled",
+                "test \"$(readlink /etc/nginx/sites-enabled/minio)\" = /etc/nginx/sites-available/minio "
+                "&& test ! -e /etc/nginx/sites-enabled/default",
+                "sudo ln -sf /etc/nginx/sites-available/minio /etc/nginx/sites-enabled/\n"
+                "sudo rm -f /etc/nginx/sites-enabled/default",
+            ),
+            plan_step(
+                "nginx reloaded",
+                "systemctl is-active --quiet nginx",
+                "sudo nginx -t && sudo systemctl reload-or-restart nginx",
+                after=["nginx.conf", "nginx site", "nginx site enabled"],
+            ),
+        ]),
+        ("Firewall", [
+            plan_step(
+                "ufw rules",
+                "status=\"$(sudo ufw status)\" && echo \"$status\" | grep -q '^Status: active' && "
+                f"for port in {ports}; do echo \"$status\" | grep -Eq \"^$port/tcp +ALLOW\" || exit 1; done",
+                f"for port in {ports}; do sudo ufw allow $port/tcp; done\n"
+                "sudo ufw --force enable",
+            ),
+        ]),
+    ]
+    # Port 3500 changes hands when the worker count does. With several workers
+    # nginx takes it over, so the workers start (and the single worker stops)
+    # before nginx reloads; with one worker nginx lets go of it before
+    # storage-api@3500 starts.
+    if len(workers) == 1:
+        order = ["Packages", "MinIO", "Nginx", "Storage API", "Firewall"]
+        phases.sort(key=lambda phase: order.index(phase[0]))
+    return phases
+
+def probe_plan(ssh, plan):
+    """Names of the steps whose probe passes, from one remote script"""
+    steps = [step for _, phase_steps in plan for step in phase_steps]
+    script = "\n".join(
+        f"if ( {step.probe} ) > /dev/null 2>&1; then echo 'ok {index}'; else echo 'todo {index}'; fi"
+        for index, step in enumerate(steps)
+    )
+    result = execute_command(
+        ssh, "bash -s", print_output=False, stdin=script, label=f"probe {len(steps)} steps"
+    )
+    satisfied = set()
+    for line in result.output.splitlines():
+        state, _, index = line.partition(' ')
+        if state == 'ok':
+            satisfied.add(steps[int(index)].name)
+    return satisfied
+
+def apply_plan(ssh, plan, check_only=False):
+    """Run the unsatisfied steps, one remote script per phase; returns the names of the steps run"""
+    begin_step("Probe")
+    satisfied = probe_plan(ssh, plan)
+    applied = []
+    for phase, steps in plan:
+        todo = []
+        for step in steps:
+            forced = [name for name in step.after if name in applied or name in [s.name for s in todo]]
+            if step.name not in satisfied or forced:
+                todo.append(step)
+        if not todo:
+            say(f"  ✓ {phase}: all {len(steps)} steps already satisfied")
+            continue
+        say(f"\n🔧 {phase}: {', '.join(step.name for step in todo)}")
+        if check_only:
+            applied.extend(step.name for step in todo)
+            continue
+        begin_step(phase)
+        artifacts = [artifact for step in todo for artifact in step.artifacts]
+        if artifacts:
+            stage_artifacts(ssh, artifacts)
+        script = "set -e\n" + "\n".join(f"echo '==> {step.name}'\n{step.apply}" for step in todo)
+        execute_command(ssh, "bash -s", stdin=script, label=f"{phase}: {', '.join(step.name for step in todo)}")
+        applied.extend(step.name for step in todo)
+    return applied
+
+def load_inventory(args):
+    """(hosts, drives) from --inventory, or the single host given on the command line
+
+    Each host is a dict with name, address, port, user, password and minio_host.
+    """
+    if not args.inventory:
+        host = {'name': None, 'address': args.host, 'port': args.port,
+                'user': args.user, 'password': args.password, 'minio_host': 'localhost'}
+        return [host], DEFAULT_DRIVES
+    with open(args.inventory, 'r') as f:
+        inventory = json.load(f)
+    hosts = []
+    for entry in inventory['hosts']:
+        if isinstance(entry, str):
+            entry = {'address': entry}
+        hosts.append({
+            'name': entry.get('name', entry['address']),
+            'address': entry['address'],
+            'port': entry.get('port', inventory.get('port', args.port)),
+            'user': entry.get('user', inventory.get('user', args.user)),
+            'password': entry.get('password', inventory.get('password', args.password)),
+            'minio_host': entry.get('minio_host', entry['address']),
+        })
+    if len(hosts) == 1:
+        hosts[0]['minio_host'] = 'localhost'
+    return hosts, inventory.get('drives', DEFAULT_DRIVES)
+
+def connect_host(host):
+    """SSH client connected to an inventory host"""
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh.connect(host['address'], port=host['port'], username=host['user'], password=host['password'], timeout=30)
+    return ssh
+
+def fleet_credentials(hosts, parallel):
+    """(access key, secret key, {host name: error}) shared by the reachable hosts
+
+    The existing credentials are kept; new ones are generated if no host has any.
+    """
+    def read(host):
+        context.host = host['name']
+        try:
+            ssh = connect_host(host)
+        except Exception as e:
+            say(f"❌ Error: {e}")
+            return None, str(e)
+        try:
+            begin_step("Read credentials")
+            return read_credentials(ssh), None
+        finally:
+            ssh.close()
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        found = dict(zip([host['name'] for host in hosts], pool.map(read, hosts)))
+    unreachable = {name: error for name, (_, error) in found.items() if error}
+    configured = {name: credentials for name, (credentials, _) in found.items() if credentials and all(credentials)}
+    if len(set(configured.values())) > 1:
+        raise RuntimeError(f"hosts {', '.join(map(str, configured))} are configured with different MinIO credentials")
+    if configured:
+        return (*next(iter(configured.values())), unreachable)
+    return generate_key(20), generate_key(40), unreachable
+
+def remote_home(ssh):
+    """Home directory of the SSH user"""
+    home = execute_command(ssh, "echo \"$HOME\"", print_output=False).output.strip()
+    if not home.startswith('/'):
+        raise RuntimeError(f"cannot determine the home directory of the SSH user (got {home!r})")
+    return home
+
+def provision_host(host, plan_for, check_only):
+    """Apply plan_for(user, home) to one host; returns a result dict instead of raising
+
+    The plan is built for the host's SSH user and its home directory, where the
+    storage API is installed and from where its workers run.
+    """
+    context.host = host['name']
+    result = {'host': host['name'] or host['address'], 'status': 'failed', 'applied': [], 'error': None}
+    started = time.monotonic()
+    ssh = None
+    try:
+        say(f"📡 Connecting to {host['address']}...")
+        ssh = connect_host(host)
+        say("✅ Connected successfully!")
+        say("\n🔎 Probing host state...")
+        begin_step("Home directory")
+        plan = plan_for(host['user'], remote_home(ssh))
+        result['applied'] = apply_plan(ssh, plan, check_only=check_only)
+        if not check_only:
+            # Check services status
+            say("\n✅ Checking services status...")
+            begin_step("Status check")
+            execute_command(
+                ssh,
+                "sudo systemctl status minio --no-pager | head -n 5; "
+                "sudo systemctl status 'storage-api@*' --no-pager | head -n 5",
+                check=False
+            )
+        result['status'] = 'checked' if check_only else 'provisioned'
+    except Exception as e:
+        say(f"❌ Error: {e}")
+        result['error'] = str(e)
+    finally:
+        if ssh is not None:
+            ssh.close()
+        result['duration'] = time.monotonic() - started
+    return result
+
+def print_health(addresses, access_key, secret_key):
+    """One round of storage_monitor.py's probes against every host, from this machine
+
+    The uploads bucket does not exist on a fresh host, so it is created first;
+    when that fails the upload probe is left out.
+    """
+    print("\n🩺 Probing the endpoints...")
+    for address in addresses:
+        target = S3Target('upload', address, 80, access_key, secret_key, prefix='/minio',
+                          keepalive=False, timeout=10)
+        upload = (target, 'uploads')
+        try:
+            target.create_bucket('uploads')
+        except (RequestFailed, OSError) as e:
+            print(f"  ⚠️  {address}: cannot create the uploads bucket ({e}), skipping the upload probe")
+            upload = None
+        results = probe_round(address, build_probes(), timeout=10, upload=upload)
+        healthy = all(result.ok for result in results)
+        print(f"  {'✅' if healthy else '⚠️ '} {address:<20} " + '  '.join(format_result(result) for result in results))
+    print(f"  Keep watching latency with: python3 storage_monitor.py --host {addresses[0]} --save-baseline baseline.json")
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Provision the MinIO storage servers")
+    parser.add_argument('--host', default=HOST, help="server to provision")
+    parser.add_argument('--port', type=int, default=22, help="SSH port")
+    parser.add_argument('--user', default=USER, help="SSH user")
+    parser.add_argument('--password', default=PASSWORD, help="SSH password")
+    parser.add_argument('--inventory', help="JSON inventory of the hosts of a distributed deployment")
+    parser.add_argument('--parallel', type=int, default=4, help="hosts provisioned at the same time")
+    parser.add_argument('--check', action='store_true',
+                        help="only report the steps that would run")
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, choices=list(PROFILES),
+                        help="performance profile of the nginx and systemd configuration")
+    parser.add_argument('--set', action='append', default=[], metavar='KNOB=VALUE',
+                        help="override a profile knob (see storage_profiles.py list)")
+    parser.add_argument('--artifact-cache', default=ARTIFACT_CACHE,
+                        help="local cache of the MinIO binary and storage API bundle")
+    parser.add_argument('--minio-binary', help="add this MinIO binary to the cache instead of downloading it")
+    parser.add_argument('--refresh-artifacts', action='store_true',
+                        help="download and build the artifacts again")
+    parser.add_argument('--nginx', default='nginx', help="nginx command for validation, e.g. in a container")
+    parser.add_argument('--systemd-analyze', default='systemd-analyze',
+                        help="systemd-analyze command for validation, e.g. in a container")
+    parser.add_argument('--skip-validation', action='store_true',
+                        help="provision without validating the configuration locally")
+    return parser.parse_args()
+
+def setup_minio_server():
+    """Main setup function"""
+    args = parse_args()
+    print("🚀 Starting MinIO Storage Server Setup...")
+
+    try:
+        hosts, drives = load_inventory(args)
+        nodes = [host['minio_host'] for host in hosts]
+        if len(hosts) > 1:
+            print(f"🖧  {len(hosts)} nodes, {len(drives)} drive(s) each, {args.parallel} at a time")
+            print(f"   MINIO_VOLUMES={minio_volumes(nodes, drives)}")
+
+        # Nothing goes to a host unless the configuration passes nginx -t and systemd-analyze locally
+        profile = load_profile(args.profile, args.set)
+        if args.skip_validation:
+            print(f"⚠️  Not validating profile {args.profile} (--skip-validation)")
+        else:
+            print(f"🔎 Validating profile {args.profile}...")
+            results = validate_profile(profile, len(nodes), args.nginx, args.systemd_analyze)
+            if not print_validation(results):
+                if any(status == 'failed' for status, _ in results.values()):
+                    raise RuntimeError(f"profile {args.profile} does not validate")
+                raise RuntimeError(
+                    f"profile {args.profile} could not be validated: point --nginx and --systemd-analyze "
+                    "at working commands, or pass --skip-validation"
+                )
+
+        print("📦 Preparing artifacts...")
+        artifacts = prepare_artifacts(
+            ArtifactCache(args.artifact_cache), args.minio_binary, args.refresh_artifacts
+        )
+
+        # Keep the credentials of already provisioned hosts
+        access_key, secret_key, unreachable = fleet_credentials(hosts, args.parallel)
+        def plan_for(user, home):
+            return build_plan(access_key, secret_key, artifacts, nodes, drives, profile, user, home)
+
+        reachable = [host for host in hosts if host['name'] not in unreachable]
+        with ThreadPoolExecutor(max_workers=args.parallel) as pool:
+            provisioned = dict(zip(
+                [host['name'] for host in reachable],
+                pool.map(lambda host: provision_host(host, plan_for, args.check), reachable)
+            ))
+        results = [
+            provisioned.get(host['name']) or {
+                'host': host['name'] or host['address'], 'status': 'failed', 'applied': [],
+                'error': unreachable[host['name']], 'duration': 0.0,
+            }
+            for host in hosts
         ]
-        
-        for cmd in firewall_commands:
-            execute_command(ssh, cmd, print_output=False)
-        
-        # Check services status
-        print("\n✅ Checking services status...")
-        execute_command(ssh, "sudo systemctl status minio --no-pager | head -n 5")
-        execute_command(ssh, "sudo systemctl status storage-api --no-pager | head -n 5")
-        
-        print("\n" + "="*60)
-        print("🎉 MinIO Storage Server Setup Complete!")
-        print("="*60)
-        print("\n📋 IMPORTANT - SAVE THESE CREDENTIALS:")
-        print(f"  Access Key: {access_key}")
-        print(f"  Secret Key: {secret_key}")
-        print("\n🌐 Access URLs:")
-        print(f"  MinIO API: http://{HOST}:9000")
-        print(f"  MinIO Console: http://{HOST}:9001")
-        print(f"  Storage API: http://{HOST}:3500")
-        print(f"  Via Nginx: http://{HOST}/console/")
-        print("\n📱 For your Vercel app, use:")
-        print(f"  STORAGE_API_URL=http://{HOST}:3500")
-        print(f"  MINIO_ACCESS_KEY={access_key}")
-        print(f"  MINIO_SECRET_KEY={secret_key}")
-        print("\n✅ You can now upload files from https://mentor.openplp.com!")
-        
     except Exception as e:
         print(f"❌ Error: {e}")
+        print_timing_summary()
         sys.exit(1)
-    finally:
-        ssh.close()
+
+    failed = [result for result in results if result['status'] == 'failed']
+    if len(hosts) > 1 or failed:
+        print("\n📋 Hosts:")
+        for result in results:
+            outcome = result['error'] if result['error'] else f"{len(result['applied'])} step(s) " + \
+                ("would run" if args.check else "applied")
+            print(f"  {'❌' if result['error'] else '✅'} {result['host']:<20} {result['duration']:6.1f}s  {outcome}")
+
+    if args.check:
+        print(f"\n📋 {sum(len(result['applied']) for result in results)} step(s) would run")
+        sys.exit(1 if failed else 0)
+
+    print_timing_summary()
+    if failed:
+        print(f"\n❌ {len(failed)} of {len(hosts)} host(s) failed; full command output: {LOG_FILE}")
+        sys.exit(1)
+
+    addresses = [host['address'] for host in hosts]
+    print_health(addresses, access_key, secret_key)
+    print("\n" + "="*60)
+    print("🎉 MinIO Storage Server Setup Complete!")
+    print(f"   {sum(len(result['applied']) for result in results)} step(s) applied; full command output: {LOG_FILE}")
+    print("="*60)
+    print("\n📋 IMPORTANT - SAVE THESE CREDENTIALS:")
+    print(f"  Access Key: {access_key}")
+    print(f"  Secret Key: {secret_key}")
+    print("\n🌐 Access URLs:")
+    for address in addresses:
+        print(f"  MinIO API: http://{address}:9000")
+    print(f"  MinIO Console: http://{addresses[0]}:9001")
+    print(f"  Storage API: http://{addresses[0]}:3500")
+    print(f"  Via Nginx: http://{addresses[0]}/console/")
+    print("\n📱 For your Vercel app, use:")
+    print(f"  STORAGE_API_URL=http://{addresses[0]}:3500")
+    print(f"  MINIO_ACCESS_KEY={access_key}")
+    print(f"  MINIO_SECRET_KEY={secret_key}")
+    print("\n✅ You can now upload files from https://mentor.openplp.com!")
 
 if __name__ == "__main__":
-    setup_minio_server()
\ No newline at end of file
+    setup_minio_server()
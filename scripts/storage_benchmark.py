@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Upload and download throughput of the storage server
+
+Measures how fast observation photos and PDFs move through each way into
+storage:
+
+    direct   MinIO's S3 API on port 9000
+    proxy    the same API through nginx's /minio/ location
+    api      the storage API's POST /upload on port 3500 (uploads only; it
+             has no download route)
+
+For every object size, multipart part size and concurrency level, each
+target uploads --requests objects, then downloads them, with --concurrency
+workers keeping their connections alive. An object larger than the part size
+is uploaded as a multipart upload of parts of that size. Every cell reports
+throughput (MB/s over the cell's wall time) and p50/p95/p99 latency per
+object, and the report puts the targets side by side. With --baseline, every
+cell is also compared with an earlier --output, so the effect of an nginx or
+systemd change shows up as a before/after difference.
+
+Only the standard library is used; requests are signed with AWS Signature
+Version 4 and an unsigned payload. Through the proxy, the signature covers
+the path nginx forwards to MinIO, without /minio.
+
+Run it against a stand-in before touching the production server: MinIO on
+port 9000 (minio server /tmp/bench-data) and nginx on port 80 with the site
+written by setup_minio_server.py.
+
+Usage:
+    python3 storage_benchmark.py --host localhost --access-key minioadmin --secret-key minioadmin
+    python3 storage_benchmark.py --sizes 256K,2M,20M --part-sizes 5M,16M --concurrency 1,4,16 \\
+        --output after.json --baseline before.json
+"""
+
+import os
+import sys
+import hmac
+import socket
+import json
+import time
+import uuid
+import math
+import hashlib
+import argparse
+import threading
+import http.client
+from datetime import datetime, timezone
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+REGION = "us-east-1"
+
+# Downloads are read and discarded in chunks of this size
+READ_CHUNK = 1024 * 1024
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_size(text):
+    """Bytes of '256K', '5M', '1G' or a plain number"""
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+def format_size(size):
+    """Short size label: 256K, 5M"""
+    for unit in ('G', 'M', 'K'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return str(size)
+
+def percentile(values, p):
+    """Nearest-rank percentile of values, or None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def sign(method, host, path, query, headers, access_key, secret_key):
+    """headers with the SigV4 Authorization of an unsigned-payload S3 request"""
+    now = datetime.now(timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    scope = f"{now.strftime('%Y%m%d')}/{REGION}/s3/aws4_request"
+    headers = dict(headers, **{
+        'Host': host, 'x-amz-date': amz_date, 'x-amz-content-sha256': 'UNSIGNED-PAYLOAD',
+    })
+    canonical_headers = sorted((name.lower(), str(value).strip()) for name, value in headers.items())
+    signed_headers = ';'.join(name for name, _ in canonical_headers)
+    canonical_request = '\n'.join([
+        method,
+        quote(path, safe='/-_.~'),
+        '&'.join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query.items())),
+        ''.join(f"{name}:{value}\n" for name, value in canonical_headers),
+        signed_headers,
+        'UNSIGNED-PAYLOAD',
+    ])
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+    ])
+    key = ('AWS4' + secret_key).encode()
+    for part in scope.split('/'):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    headers['Authorization'] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+        f"SignedHeaders={signed_headers}, Signature={signature}"
+    )
+    return headers
+
+class RequestFailed(Exception):
+    """A request got an unexpected HTTP status"""
+
+class Target:
+    """One way into storage; each worker thread keeps its own connection"""
+
+    def __init__(self, name, host, port, keepalive=True, timeout=300):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.local = threading.local()
+
+    @property
+    def host_header(self):
+        return self.host if self.port == 80 else f"{self.host}:{self.port}"
+
+    def request(self, method, path, body=None, headers=None, expect=(200,), sink=False):
+        """(status, headers, body) of one request
+
+        With sink the body is not kept: it is read in chunks, passed to sink when
+        sink is callable, and only its length is returned.
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or not self.keepalive:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.local.conn = conn
+        headers = dict(headers or {})
+        if not self.keepalive:
+            headers['Connection'] = 'close'
+        try:
+            if conn.sock is None:
+                conn.connect()
+                # Headers and body go out in separate writes; without this, Nagle's
+                # algorithm and delayed ACKs add ~40 ms to every small upload
+                conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            if sink:
+                received = 0
+                while True:
+                    chunk = response.read(READ_CHUNK)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                    if callable(sink):
+                        sink(chunk)
+                data = received
+            else:
+                data = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self.local.conn = None
+            raise
+        if not self.keepalive:
+            conn.close()
+        if response.status not in expect:
+            detail = '' if sink else data[:200].decode(errors='replace')
+            raise RequestFailed(f"{method} {path}: HTTP {response.status} {detail}".strip())
+        return response.status, response.headers, data
+
+class S3Target(Target):
+    """MinIO's S3 API, at prefix on the host (nginx strips it before MinIO sees the path)"""
+
+    downloads = True
+
+    def __init__(self, name, host, port, access_key, secret_key, prefix='', **kwargs):
+        super().__init__(name, host, port, **kwargs)
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.prefix = prefix
+
+    def s3(self, method, path, query=None, body=None, headers=None, **kwargs):
+        query = query or {}
+        headers = sign(method, self.host_header, path, query, headers or {}, self.access_key, self.secret_key)
+        url = self.prefix + quote(path, safe='/-_.~')
+        if query:
+            url += '?' + '&'.join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query.items()))
+        return self.request(method, url, body=body, headers=headers, **kwargs)
+
+    def create_bucket(self, bucket):
+        self.s3('PUT', f"/{bucket}", expect=(200, 409))
+
+    def upload(self, bucket, key, body, part_size):
+        if not part_size or len(body) <= part_size:
+            self.s3('PUT', f"/{bucket}/{key}", body=body, headers={'Content-Length': str(len(body))})
+            return
+        _, _, data = self.s3('POST', f"/{bucket}/{key}", query={'uploads': ''})
+        upload_id = next(element.text for element in ElementTree.fromstring(data).iter() if element.tag.endswith('UploadId'))
+        etags = []
+        try:
+            for number, offset in enumerate(range(0, len(body), part_size), 1):
+                part = body[offset:offset + part_size]
+                _, headers, _ = self.s3(
+                    'PUT', f"/{bucket}/{key}", query={'partNumber': str(number), 'uploadId': upload_id},
+                    body=part, headers={'Content-Length': str(len(part))}
+                )
+                etags.append(headers['ETag'])
+            complete = '<CompleteMultipartUpload>' + ''.join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                for number, etag in enumerate(etags, 1)
+            ) + '</CompleteMultipartUpload>'
+            self.s3('POST', f"/{bucket}/{key}", query={'uploadId': upload_id}, body=complete.encode())
+        except Exception:
+            self.s3('DELETE', f"/{bucket}/{key}", query={'uploadId': upload_id}, expect=(204, 404))
+            raise
+
+    def download(self, bucket, key):
+        return self.s3('GET', f"/{bucket}/{key}", sink=True)[2]
+
+    def delete(self, bucket, key):
+        self.s3('DELETE', f"/{bucket}/{key}", expect=(204, 404))
+
+class ApiTarget(Target):
+    """The storage API: multipart/form-data POST /upload, JSON DELETE /delete"""
+
+    downloads = False
+
+    def create_bucket(self, bucket):
+        body = json.dumps({'bucketName': bucket}).encode()
+        self.request('POST', '/bucket/create', body=body, headers={'Content-Type': 'application/json'},
+                     expect=(200, 400, 409, 500))
+
+    def upload(self, bucket, key, body, part_size):
+        boundary = uuid.uuid4().hex
+        head = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"bucket\"\r\n\r\n{bucket}\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"fileName\"\r\n\r\n{key}\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{key.rsplit('/', 1)[-1]}\"\r\n"
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        self.request('POST', '/upload', body=[head, body, tail], headers={
+            'Content-Type': f"multipart/form-data; boundary={boundary}",
+            'Content-Length': str(len(head) + len(body) + len(tail)),
+        })
+
+    def delete(self, bucket, key):
+        body = json.dumps({'bucket': bucket, 'fileName': key}).encode()
+        self.request('DELETE', '/delete', body=body, headers={'Content-Type': 'application/json'},
+                     expect=(200, 404, 500))
+
+def run_operation(target, operation, keys, concurrency, func):
+    """Run func(key) for every key on concurrency workers; returns the cell's measurements"""
+    latencies = []
+    errors = []
+    moved = [0]
+    lock = threading.Lock()
+
+    def timed(key):
+        started = time.perf_counter()
+        try:
+            size = func(key)
+        except (OSError, http.client.HTTPException, RequestFailed) as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            moved[0] += size
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, keys))
+    wall = time.perf_counter() - started
+    return {
+        'target': target.name, 'operation': operation,
+        'requests': len(keys), 'errors': len(errors), 'first_error': errors[0] if errors else None,
+        'bytes': moved[0], 'seconds': round(wall, 4),
+        'mb_per_s': round(moved[0] / 1048576 / wall, 2) if wall else None,
+        'p50_ms': None if not latencies else round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': None if not latencies else round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': None if not latencies else round(percentile(latencies, 99) * 1000, 1),
+    }
+
+def benchmark_cell(target, bucket, payload, size, part_size, concurrency, requests, run_id):
+    """Upload, download and delete requests objects of size; returns the upload and download results"""
+    body = memoryview(payload)[:size]
+    keys = [f"bench-{run_id}/{target.name}-{size}-{part_size}-{concurrency}-{index}" for index in range(requests)]
+
+    def upload(key):
+        target.upload(bucket, key, body, part_size)
+        return size
+
+    results = [run_operation(target, 'upload', keys, concurrency, upload)]
+    if target.downloads:
+        results.append(run_operation(target, 'download', keys, concurrency, lambda key: target.download(bucket, key)))
+    for key in keys:
+        try:
+            target.delete(bucket, key)
+        except (OSError, http.client.HTTPException, RequestFailed):
+            pass
+    for result in results:
+        result.update({'size': size, 'part_size': part_size, 'concurrency': concurrency})
+    return results
+
+def cell_key(result):
+    return (result['operation'], result['size'], result['part_size'], result['concurrency'])
+
+def cell_label(key):
+    operation, size, part_size, concurrency = key
+    part = format_size(part_size) if part_size else '-'
+    return f"{operation:<8} {format_size(size):>6} {part:>5} {concurrency:>4}"
+
+def print_report(results, targets):
+    """One row per cell, the targets side by side, then proxy overhead against direct"""
+    header = f"{'op':<8} {'size':>6} {'part':>5} {'conc':>4}"
+    print("\n📊 Throughput (MB/s) and p50 / p95 / p99 latency (ms):")
+    print(header + ''.join(f"  {target:>34}" for target in targets))
+    cells = {}
+    for result in results:
+        cells.setdefault(cell_key(result), {})[result['target']] = result
+    for key, by_target in cells.items():
+        row = cell_label(key)
+        for target in targets:
+            result = by_target.get(target)
+            if result is None:
+                row += f"  {'':>34}"
+            elif result['p50_ms'] is None:
+                row += f"  {'all ' + str(result['errors']) + ' failed':>34}"
+            else:
+                text = f"{result['mb_per_s']:8.1f} {result['p50_ms']:7.1f} {result['p95_ms']:7.1f} {result['p99_ms']:7.1f}"
+                if result['errors']:
+                    text += f" !{result['errors']}"
+                row += f"  {text:>34}"
+        print(row)
+    if 'direct' in targets and 'proxy' in targets:
+        print("\n🔀 Through nginx vs direct (throughput, p95):")
+        for key, by_target in cells.items():
+            direct, proxy = by_target.get('direct'), by_target.get('proxy')
+            if direct and proxy and direct['mb_per_s'] and proxy['p95_ms'] is not None and direct['p95_ms']:
+                print(f"  {cell_label(key)}  {proxy['mb_per_s'] / direct['mb_per_s'] * 100 - 100:+7.1f}%  "
+                      f"{proxy['p95_ms'] - direct['p95_ms']:+9.1f} ms")
+    failed = [result for result in results if result['errors']]
+    for result in failed:
+        print(f"  ❌ {result['target']} {cell_label(cell_key(result))}: "
+              f"{result['errors']} of {result['requests']} failed, e.g. {result['first_error']}")
+
+def print_comparison(results, baseline):
+    """Difference of every cell from the same cell of an earlier run"""
+    before = {(result['target'],) + cell_key(result): result for result in baseline['results']}
+    print(f"\n📈 Against the baseline of {baseline.get('started_at', 'an earlier run')} "
+          "(throughput, p95; + is faster / slower):")
+    for result in results:
+        previous = before.get((result['target'],) + cell_key(result))
+        if not previous or not previous['mb_per_s'] or result['p95_ms'] is None or previous['p95_ms'] is None:
+            continue
+        print(f"  {result['target']:<7} {cell_label(cell_key(result))}  "
+              f"{previous['mb_per_s']:8.1f} -> {result['mb_per_s']:8.1f} MB/s "
+              f"({result['mb_per_s'] / previous['mb_per_s'] * 100 - 100:+6.1f}%)  "
+              f"p95 {previous['p95_ms']:8.1f} -> {result['p95_ms']:8.1f} ms")
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Benchmark uploads and downloads through MinIO, nginx and the storage API")
+    parser.add_argument('--host', default='localhost', help="storage server")
+    parser.add_argument('--access-key', default=os.environ.get('MINIO_ACCESS_KEY'), help="default: $MINIO_ACCESS_KEY")
+    parser.add_argument('--secret-key', default=os.environ.get('MINIO_SECRET_KEY'), help="default: $MINIO_SECRET_KEY")
+    parser.add_argument('--targets', default='direct,proxy,api', help="any of direct, proxy, api")
+    parser.add_argument('--minio-port', type=int, default=9000)
+    parser.add_argument('--nginx-port', type=int, default=80)
+    parser.add_argument('--api-port', type=int, default=3500)
+    parser.add_argument('--bucket', default='plp-benchmark')
+    parser.add_argument('--sizes', default='256K,2M,20M', help="object sizes")
+    parser.add_argument('--part-sizes', default='5M,16M', help="multipart part sizes; smaller objects use one PUT")
+    parser.add_argument('--concurrency', default='1,4,16', help="concurrent requests")
+    parser.add_argument('--requests', type=int, default=16, help="objects per cell")
+    parser.add_argument('--no-keepalive', action='store_true', help="open a new connection for every request")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare with")
+    args = parser.parse_args()
+    args.targets = args.targets.split(',')
+    unknown = set(args.targets) - {'direct', 'proxy', 'api'}
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+    if {'direct', 'proxy'} & set(args.targets) and not (args.access_key and args.secret_key):
+        parser.error("the direct and proxy targets need --access-key and --secret-key")
+    return args
+
+def main():
+    args = parse_args()
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    part_sizes = [parse_size(size) for size in args.part_sizes.split(',')]
+    concurrencies = [int(level) for level in args.concurrency.split(',')]
+    options = {'keepalive': not args.no_keepalive}
+    available = {
+        'direct': lambda: S3Target('direct', args.host, args.minio_port, args.access_key, args.secret_key, **options),
+        'proxy': lambda: S3Target('proxy', args.host, args.nginx_port, args.access_key, args.secret_key,
+                                  prefix='/minio', **options),
+        'api': lambda: ApiTarget('api', args.host, args.api_port, **options),
+    }
+    targets = [available[name]() for name in args.targets]
+
+    def cells(target):
+        """(size, part size, concurrency) to run; a part size only matters for objects larger than it"""
+        planned = []
+        for size in sizes:
+            parts = {part for part in part_sizes if part < size} if isinstance(target, S3Target) else set()
+            for part_size in sorted(parts or {0}):
+                for concurrency in concurrencies:
+                    planned.append((size, part_size, concurrency))
+        return planned
+
+    run_id = uuid.uuid4().hex[:8]
+    payload = os.urandom(max(sizes))
+    started_at = datetime.now().isoformat(timespec='seconds')
+    print(f"🚀 Benchmarking {', '.join(args.targets)} on {args.host}: "
+          f"{sum(len(cells(target)) for target in targets)} cells x {args.requests} objects")
+    results = []
+    for target in targets:
+        try:
+            target.create_bucket(args.bucket)
+        except (OSError, http.client.HTTPException, RequestFailed) as e:
+            print(f"❌ {target.name}: cannot create bucket {args.bucket}: {e}")
+            sys.exit(1)
+        for size, part_size, concurrency in cells(target):
+            cell = benchmark_cell(target, args.bucket, payload, size, part_size, concurrency, args.requests, run_id)
+            for result in cell:
+                print(f"  {target.name:<7} {cell_label(cell_key(result))}  {result['mb_per_s'] or 0:8.1f} MB/s  "
+                      f"p95 {result['p95_ms'] if result['p95_ms'] is not None else '-':>8} ms"
+                      + (f"  {result['errors']} failed" if result['errors'] else ""))
+            results.extend(cell)
+
+    print_report(results, args.targets)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            print_comparison(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'started_at': started_at, 'host': args.host, 'keepalive': not args.no_keepalive,
+                'requests': args.requests, 'results': results,
+            }, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+    sys.exit(1 if any(result['errors'] for result in results) else 0)
+
+if __name__ == "__main__":
+    main()
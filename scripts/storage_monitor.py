@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Health and latency monitor of the storage server
+
+Every --interval seconds, all endpoints are probed at the same time:
+
+    minio           MinIO's liveness endpoint on port 9000
+    storage-api     GET /health of the storage API on port 3500
+    nginx-minio     MinIO's liveness endpoint through nginx's /minio/ location
+    nginx-console   the MinIO console through nginx's /console/ location
+    upload          with --access-key/--secret-key: a 64 KB object PUT, read
+                    back and deleted through /minio/, the path teachers'
+                    uploads take
+
+Each probe keeps a latency histogram and counts of errors by reason (timeout,
+connection, HTTP status). The histograms go to a Prometheus text file
+(--prometheus, e.g. into node_exporter's textfile directory) rewritten after
+every round, and every result can be appended to a JSONL file (--jsonl).
+
+--save-baseline stores each probe's p50/p95/p99 and error rate at the end of
+a run on a healthy server; --baseline compares every round's window of
+recent results with it. A probe is flagged when its p95 grows by more than
+--tolerance and --min-delta-ms, or its error rate by more than
+--max-error-increase, so slow storage shows up here before it shows up as
+upload timeouts.
+
+Usage:
+    python3 storage_monitor.py --host 157.10.73.52 --rounds 30 --interval 2 --save-baseline baseline.json
+    python3 storage_monitor.py --host 157.10.73.52 --baseline baseline.json \\
+        --prometheus /var/lib/node_exporter/textfile/storage.prom --jsonl probes.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import http.client
+from collections import deque, namedtuple
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from storage_benchmark import S3Target, RequestFailed, percentile
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# Results per probe used for percentiles and regression checks
+WINDOW = 100
+
+UPLOAD_PROBE_SIZE = 64 * 1024
+
+# name: probe name; port; path; expect: HTTP statuses meaning healthy
+Probe = namedtuple('Probe', 'name port path expect')
+
+# ok, status: HTTP status or None; latency in seconds; reason of a failure
+Result = namedtuple('Result', 'probe ok status latency reason')
+
+def build_probes(minio_port=9000, api_port=3500, nginx_port=80):
+    """The HTTP probes of one storage server"""
+    return [
+        Probe('minio', minio_port, '/minio/health/live', (200,)),
+        Probe('storage-api', api_port, '/health', (200,)),
+        Probe('nginx-minio', nginx_port, '/minio/minio/health/live', (200,)),
+        Probe('nginx-console', nginx_port, '/console/', (200, 301, 302, 307)),
+    ]
+
+def run_probe(host, probe, timeout):
+    """Result of one GET"""
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection(host, probe.port, timeout=timeout)
+    try:
+        conn.request('GET', probe.path)
+        response = conn.getresponse()
+        response.read()
+        latency = time.perf_counter() - started
+        if response.status not in probe.expect:
+            return Result(probe.name, False, response.status, latency, f"http_{response.status}")
+        return Result(probe.name, True, response.status, latency, None)
+    except TimeoutError:
+        return Result(probe.name, False, None, time.perf_counter() - started, 'timeout')
+    except (OSError, http.client.HTTPException):
+        return Result(probe.name, False, None, time.perf_counter() - started, 'connection')
+    finally:
+        conn.close()
+
+def run_upload_probe(target, bucket):
+    """Result of writing, reading back and deleting a small object"""
+    key = f"monitor/probe-{os.getpid()}-{time.monotonic_ns()}"
+    body = os.urandom(UPLOAD_PROBE_SIZE)
+    started = time.perf_counter()
+    try:
+        target.upload(bucket, key, body, 0)
+        _, _, data = target.s3('GET', f"/{bucket}/{key}")
+        latency = time.perf_counter() - started
+        target.delete(bucket, key)
+        if data != body:
+            return Result('upload', False, 200, latency, 'corrupt')
+        return Result('upload', True, 200, latency, None)
+    except TimeoutError:
+        return Result('upload', False, None, time.perf_counter() - started, 'timeout')
+    except RequestFailed as e:
+        status = str(e).split('HTTP ')[-1].split()[0]
+        return Result('upload', False, None, time.perf_counter() - started, f"http_{status}")
+    except (OSError, http.client.HTTPException):
+        return Result('upload', False, None, time.perf_counter() - started, 'connection')
+
+class ProbeStats:
+    """Histogram, error counts and recent results of one probe"""
+
+    def __init__(self, name):
+        self.name = name
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.latency_sum = 0.0
+        self.errors = {}
+        self.recent = deque(maxlen=WINDOW)
+        self.up = None
+
+    def add(self, result):
+        self.count += 1
+        self.latency_sum += result.latency
+        for index, bound in enumerate(BUCKETS):
+            if result.latency <= bound:
+                self.buckets[index] += 1
+        if not result.ok:
+            self.errors[result.reason] = self.errors.get(result.reason, 0) + 1
+        self.recent.append(result)
+        self.up = result.ok
+
+    def summary(self):
+        """p50/p95/p99 (ms) of the successful recent results, and the recent error rate"""
+        latencies = [result.latency for result in self.recent if result.ok]
+        failed = sum(1 for result in self.recent if not result.ok)
+        return {
+            'samples': len(self.recent),
+            'p50_ms': None if not latencies else round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': None if not latencies else round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': None if not latencies else round(percentile(latencies, 99) * 1000, 2),
+            'error_rate': round(failed / len(self.recent), 4) if self.recent else None,
+        }
+
+def regressions(stats, baseline, tolerance, min_delta_ms, max_error_increase):
+    """{probe: reason} of the probes doing worse than the baseline"""
+    flagged = {}
+    for name, probe_stats in stats.items():
+        before = baseline.get('probes', {}).get(name)
+        if not before:
+            continue
+        current = probe_stats.summary()
+        if current['p95_ms'] is not None and before['p95_ms'] is not None:
+            delta = current['p95_ms'] - before['p95_ms']
+            if current['p95_ms'] > before['p95_ms'] * (1 + tolerance) and delta > min_delta_ms:
+                flagged[name] = f"p95 {current['p95_ms']:.1f} ms vs {before['p95_ms']:.1f} ms baseline"
+        if current['error_rate'] is not None and \
+                current['error_rate'] > (before['error_rate'] or 0) + max_error_increase:
+            flagged[name] = (flagged.get(name, '') + '; ' if name in flagged else '') + \
+                f"error rate {current['error_rate']:.0%} vs {before['error_rate'] or 0:.0%} baseline"
+    return flagged
+
+def prometheus_text(host, stats, flagged):
+    """Prometheus text exposition of every probe's histogram, errors and state"""
+    lines = [
+        "# HELP storage_probe_duration_seconds Latency of the storage server probes.",
+        "# TYPE storage_probe_duration_seconds histogram",
+    ]
+    for name, probe_stats in stats.items():
+        labels = f'host="{host}",probe="{name}"'
+        for bound, count in zip(BUCKETS, probe_stats.buckets):
+            lines.append(f'storage_probe_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'storage_probe_duration_seconds_bucket{{{labels},le="+Inf"}} {probe_stats.count}')
+        lines.append(f'storage_probe_duration_seconds_sum{{{labels}}} {probe_stats.latency_sum:.6f}')
+        lines.append(f'storage_probe_duration_seconds_count{{{labels}}} {probe_stats.count}')
+    lines += [
+        "# HELP storage_probe_errors_total Failed probes by reason.",
+        "# TYPE storage_probe_errors_total counter",
+    ]
+    for name, probe_stats in stats.items():
+        for reason, count in sorted(probe_stats.errors.items()):
+            lines.append(f'storage_probe_errors_total{{host="{host}",probe="{name}",reason="{reason}"}} {count}')
+    lines += [
+        "# HELP storage_probe_up Whether the last probe succeeded.",
+        "# TYPE storage_probe_up gauge",
+    ]
+    for name, probe_stats in stats.items():
+        lines.append(f'storage_probe_up{{host="{host}",probe="{name}"}} {int(bool(probe_stats.up))}')
+    lines += [
+        "# HELP storage_probe_regression Whether the probe is slower or failing more than its baseline.",
+        "# TYPE storage_probe_regression gauge",
+    ]
+    for name in stats:
+        lines.append(f'storage_probe_regression{{host="{host}",probe="{name}"}} {int(name in flagged)}')
+    return '\n'.join(lines) + '\n'
+
+def write_atomically(path, content):
+    """Replace path, so a scraper never reads a half-written file"""
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'w') as f:
+        f.write(content)
+    os.replace(temp, path)
+
+def probe_round(host, probes, timeout, upload=None):
+    """[Result] of every probe, run concurrently; upload is (S3Target, bucket) or None"""
+    with ThreadPoolExecutor(max_workers=len(probes) + 1) as pool:
+        futures = [pool.submit(run_probe, host, probe, timeout) for probe in probes]
+        if upload:
+            futures.append(pool.submit(run_upload_probe, *upload))
+        return [future.result() for future in futures]
+
+def format_result(result):
+    """'minio 2.1 ms' or 'minio ❌ timeout'"""
+    if result.ok:
+        return f"{result.probe} {result.latency * 1000:.1f} ms"
+    return f"{result.probe} ❌ {result.reason}"
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Probe the storage server's health and latency")
+    parser.add_argument('--host', default='localhost', help="storage server")
+    parser.add_argument('--minio-port', type=int, default=9000)
+    parser.add_argument('--api-port', type=int, default=3500)
+    parser.add_argument('--nginx-port', type=int, default=80)
+    parser.add_argument('--access-key', default=os.environ.get('MINIO_ACCESS_KEY'),
+                        help="enables the upload probe (default: $MINIO_ACCESS_KEY)")
+    parser.add_argument('--secret-key', default=os.environ.get('MINIO_SECRET_KEY'), help="default: $MINIO_SECRET_KEY")
+    parser.add_argument('--bucket', default='uploads', help="bucket of the upload probe")
+    parser.add_argument('--interval', type=float, default=15, help="seconds between rounds")
+    parser.add_argument('--rounds', type=int, default=0, help="rounds to run (0: until interrupted)")
+    parser.add_argument('--timeout', type=float, default=5, help="seconds before a probe counts as timed out")
+    parser.add_argument('--prometheus', help="Prometheus text file rewritten after every round")
+    parser.add_argument('--jsonl', help="append every probe result to this JSONL file")
+    parser.add_argument('--baseline', help="baseline JSON to flag regressions against")
+    parser.add_argument('--save-baseline', help="write this run's percentiles and error rates as a baseline")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="p95 growth flagged as a regression (0.5: +50%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=20, help="smallest p95 growth flagged, in ms")
+    parser.add_argument('--max-error-increase', type=float, default=0.05,
+                        help="error rate growth flagged as a regression")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    probes = build_probes(args.minio_port, args.api_port, args.nginx_port)
+    upload = None
+    if args.access_key and args.secret_key:
+        target = S3Target('upload', args.host, args.nginx_port, args.access_key, args.secret_key,
+                          prefix='/minio', keepalive=False, timeout=args.timeout)
+        upload = (target, args.bucket)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    names = [probe.name for probe in probes] + (['upload'] if upload else [])
+    stats = {name: ProbeStats(name) for name in names}
+    jsonl = open(args.jsonl, 'a') if args.jsonl else None
+    flagged = {}
+    print(f"🩺 Probing {', '.join(names)} on {args.host} every {args.interval:g}s")
+    rounds = 0
+    try:
+        while not args.rounds or rounds < args.rounds:
+            started = time.monotonic()
+            timestamp = datetime.now().isoformat(timespec='seconds')
+            results = probe_round(args.host, probes, args.timeout, upload)
+            for result in results:
+                stats[result.probe].add(result)
+                if jsonl:
+                    jsonl.write(json.dumps({
+                        'time': timestamp, 'host': args.host, 'probe': result.probe, 'ok': result.ok,
+                        'status': result.status, 'latency_ms': round(result.latency * 1000, 2),
+                        'reason': result.reason,
+                    }) + '\n')
+            if jsonl:
+                jsonl.flush()
+            previously = flagged
+            flagged = regressions(
+                stats, baseline, args.tolerance, args.min_delta_ms, args.max_error_increase
+            ) if baseline else {}
+            print(f"{timestamp}  " + '  '.join(format_result(result) for result in results), flush=True)
+            for name, reason in flagged.items():
+                if name not in previously:
+                    print(f"  ⚠️  {name} regressed: {reason}", flush=True)
+            for name in set(previously) - set(flagged):
+                print(f"  ✅ {name} back within its baseline", flush=True)
+            if args.prometheus:
+                write_atomically(args.prometheus, prometheus_text(args.host, stats, flagged))
+            rounds += 1
+            if not args.rounds or rounds < args.rounds:
+                time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        print()
+    finally:
+        if jsonl:
+            jsonl.close()
+
+    print(f"\n📋 Last {WINDOW} results per probe:")
+    print(f"  {'probe':<14} {'samples':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    summaries = {name: probe_stats.summary() for name, probe_stats in stats.items()}
+    for name, summary in summaries.items():
+        cells = [f"{summary[key]:8.1f}" if summary[key] is not None else f"{'-':>8}"
+                 for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+        errors = f"{summary['error_rate']:.0%}" if summary['error_rate'] is not None else '-'
+        print(f"  {name:<14} {summary['samples']:>7} {' '.join(cells)} {errors:>7}"
+              + (f"  ⚠️  {flagged[name]}" if name in flagged else ""))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'saved_at': datetime.now().isoformat(timespec='seconds'), 'host': args.host,
+                       'probes': summaries}, f, indent=2)
+        print(f"💾 Baseline written to {args.save_baseline}")
+    down = [name for name, probe_stats in stats.items() if probe_stats.up is False]
+    if flagged or down:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
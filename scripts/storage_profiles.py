@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Performance profiles of the storage server's nginx and systemd configuration
+
+setup_minio_server.py writes /etc/nginx/nginx.conf, the nginx site, and the
+minio and storage-api units from these renderers. What varies between
+servers lives in PROFILES as explicit knobs, so a tuning change is a
+reviewed edit of a knob instead of an edit of a config string:
+
+    small-vm                  1-2 vCPU host serving one school network:
+                              modest connection limits, one storage API worker
+    high-concurrency-upload   many teachers uploading photos and PDFs at once:
+                              large connection limits and keepalive pools,
+                              four storage API workers behind nginx
+
+With more than one storage API worker, the workers listen on 3501, 3502, ...
+and nginx listens on 3500 and balances across them, so clients keep using
+port 3500.
+
+The rendered files are checked locally before they go to any host:
+nginx -t against a scratch copy of the nginx configuration, and
+systemd-analyze verify on the units. A unit whose binary is not installed
+on the validating machine (/usr/local/bin/minio, /usr/bin/node) is only
+reported, not failed. A check whose tool is not installed is reported as
+skipped and counts as not validated. Either tool can be run in a container
+instead, e.g. --nginx "docker run --rm -v /tmp:/tmp nginx:stable nginx".
+
+Usage:
+    python3 storage_profiles.py list
+    python3 storage_profiles.py render --profile high-concurrency-upload --out rendered/
+    python3 storage_profiles.py validate --profile small-vm --set nginx_upstream_keepalive=64
+"""
+
+import os
+import re
+import sys
+import shlex
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+PROFILES = {
+    "small-vm": {
+        # nginx.conf
+        "nginx_worker_processes": "auto",
+        "nginx_worker_connections": 1024,
+        "nginx_worker_rlimit_nofile": 4096,
+        "nginx_multi_accept": False,
+        "nginx_sendfile": True,
+        "nginx_tcp_nopush": True,
+        "nginx_keepalive_timeout_s": 65,
+        "nginx_keepalive_requests": 1000,
+        # Site: idle connections each nginx worker keeps open to each upstream
+        "nginx_upstream_keepalive": 16,
+        "nginx_client_max_body_size": "100M",
+        "nginx_client_body_timeout_s": 60,
+        "nginx_proxy_request_buffering": False,
+        "nginx_proxy_buffering": False,
+        # nginx caps the connect timeout at about 75s
+        "nginx_proxy_connect_timeout_s": 60,
+        "nginx_proxy_send_timeout_s": 300,
+        "nginx_proxy_read_timeout_s": 300,
+        # minio.service and /etc/default/minio (0: MinIO sizes it from memory)
+        "minio_limit_nofile": 65536,
+        "minio_api_requests_max": 0,
+        # storage-api@.service (0: node's default heap)
+        "api_workers": 1,
+        "api_limit_nofile": 16384,
+        "api_uv_threadpool_size": 4,
+        "api_max_old_space_mb": 256,
+    },
+    "high-concurrency-upload": {
+        "nginx_worker_processes": "auto",
+        "nginx_worker_connections": 8192,
+        "nginx_worker_rlimit_nofile": 65536,
+        "nginx_multi_accept": True,
+        "nginx_sendfile": True,
+        "nginx_tcp_nopush": True,
+        "nginx_keepalive_timeout_s": 75,
+        "nginx_keepalive_requests": 10000,
+        "nginx_upstream_keepalive": 128,
+        "nginx_client_max_body_size": "100M",
+        "nginx_client_body_timeout_s": 120,
+        "nginx_proxy_request_buffering": False,
+        "nginx_proxy_buffering": False,
+        "nginx_proxy_connect_timeout_s": 10,
+        "nginx_proxy_send_timeout_s": 600,
+        "nginx_proxy_read_timeout_s": 600,
+        "minio_limit_nofile": 1048576,
+        "minio_api_requests_max": 0,
+        "api_workers": 4,
+        "api_limit_nofile": 65536,
+        "api_uv_threadpool_size": 16,
+        "api_max_old_space_mb": 512,
+    },
+}
+
+DEFAULT_PROFILE = "small-vm"
+
+# Port clients use for the storage API, whatever the number of workers
+API_PORT = 3500
+
+def load_profile(name, overrides=()):
+    """Knobs of a named profile, with 'knob=value' overrides converted to the knob's type"""
+    if name not in PROFILES:
+        raise ValueError(f"unknown profile {name!r}; profiles: {', '.join(PROFILES)}")
+    profile = dict(PROFILES[name], name=name)
+    for override in overrides:
+        knob, _, value = override.partition('=')
+        if knob not in PROFILES[name]:
+            raise ValueError(f"unknown knob {knob!r}")
+        current = PROFILES[name][knob]
+        if isinstance(current, bool):
+            if value.lower() not in ('on', 'off', 'true', 'false', '1', '0'):
+                raise ValueError(f"{knob} takes on or off, not {value!r}")
+            profile[knob] = value.lower() in ('on', 'true', '1')
+        elif isinstance(current, int):
+            if not re.fullmatch(r'-?\d+', value):
+                raise ValueError(f"{knob} takes a number, not {value!r}")
+            profile[knob] = int(value)
+        else:
+            profile[knob] = value
+    return profile
+
+def on_off(value):
+    return "on" if value else "off"
+
+def api_ports(profile):
+    """Ports the storage API workers listen on"""
+    if profile["api_workers"] <= 1:
+        return [API_PORT]
+    return [API_PORT + index for index in range(1, profile["api_workers"] + 1)]
+
+def render_nginx_conf(profile, user="www-data", conf_dir="/etc/nginx", pid="/run/nginx.pid", log_dir="/var/log/nginx"):
+    """/etc/nginx/nginx.conf; Debian's layout with the profile's limits"""
+    user_line = f"user {user};\n" if user else ""
+    return f"""{user_line}worker_processes {profile['nginx_worker_processes']};
+worker_rlimit_nofile {profile['nginx_worker_rlimit_nofile']};
+pid {pid};
+include {conf_dir}/modules-enabled/*.conf;
+
+events {{
+    worker_connections {profile['nginx_worker_connections']};
+    multi_accept {on_off(profile['nginx_multi_accept'])};
+}}
+
+http {{
+    sendfile {on_off(profile['nginx_sendfile'])};
+    tcp_nopush {on_off(profile['nginx_tcp_nopush'])};
+    tcp_nodelay on;
+    keepalive_timeout {profile['nginx_keepalive_timeout_s']}s;
+    keepalive_requests {profile['nginx_keepalive_requests']};
+    types_hash_max_size 2048;
+    server_tokens off;
+
+    include {conf_dir}/mime.types;
+    default_type application/octet-stream;
+
+    ssl_protocols TLSv1.2 TLSv1.3;
+    ssl_prefer_server_ciphers on;
+
+    access_log {log_dir}/access.log;
+    error_log {log_dir}/error.log;
+
+    gzip on;
+
+    include {conf_dir}/conf.d/*.conf;
+    include {conf_dir}/sites-enabled/*;
+}}
+"""
+
+def upstream_block(name, servers, balancing, keepalive):
+    """nginx upstream over servers (host:port), keeping keepalive idle connections per worker"""
+    lines = '\n'.join(f"    server {server};" for server in servers)
+    return f"""upstream {name} {{
+{balancing}{lines}
+    keepalive {keepalive};
+}}
+"""
+
+def proxy_settings(profile):
+    """Timeouts and forwarded headers shared by the proxied locations"""
+    return f"""        proxy_connect_timeout {profile['nginx_proxy_connect_timeout_s']}s;
+        proxy_send_timeout {profile['nginx_proxy_send_timeout_s']}s;
+        proxy_read_timeout {profile['nginx_proxy_read_timeout_s']}s;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        proxy_http_version 1.1;"""
+
+def render_nginx_site(profile, nodes=("localhost",)):
+    """/etc/nginx/sites-available/minio: /minio/ and /console/ over every node, and the storage API workers"""
+    local = len(nodes) == 1
+    nodes = ["localhost"] if local else list(nodes)
+    keepalive = profile['nginx_upstream_keepalive']
+    # Uploads go to the least busy node; console sessions stay on one node
+    site = upstream_block("minio", [f"{node}:9000" for node in nodes], "" if local else "    least_conn;\n", keepalive)
+    site += "\n" + upstream_block(
+        "minio-console", [f"{node}:9001" for node in nodes], "" if local else "    ip_hash;\n", keepalive
+    )
+    ports = api_ports(profile)
+    if ports != [API_PORT]:
+        site += "\n" + upstream_block(
+            "storage-api", [f"127.0.0.1:{port}" for port in ports], "    least_conn;\n", keepalive
+        )
+    site += f"""
+server {{
+    listen 80;
+    listen [::]:80;
+    server_name _;
+
+    client_max_body_size {profile['nginx_client_max_body_size']};
+    client_body_timeout {profile['nginx_client_body_timeout_s']}s;
+    proxy_buffering {on_off(profile['nginx_proxy_buffering'])};
+    proxy_request_buffering {on_off(profile['nginx_proxy_request_buffering'])};
+
+    location /minio/ {{
+        rewrite ^/minio/(.*) /$1 break;
+        proxy_set_header Host $http_host;
+{proxy_settings(profile)}
+        proxy_set_header Connection "";
+        chunked_transfer_encoding off;
+        proxy_pass http://minio;
+    }}
+
+    location /console/ {{
+        rewrite ^/console/(.*) /$1 break;
+        proxy_set_header Host $http_host;
+        proxy_set_header X-NginX-Proxy true;
+{proxy_settings(profile)}
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection "upgrade";
+        chunked_transfer_encoding off;
+        proxy_pass http://minio-console;
+    }}
+}}
+"""
+    if ports != [API_PORT]:
+        site += f"""
+server {{
+    listen {API_PORT};
+    listen [::]:{API_PORT};
+    server_name _;
+
+    client_max_body_size {profile['nginx_client_max_body_size']};
+    client_body_timeout {profile['nginx_client_body_timeout_s']}s;
+    proxy_buffering {on_off(profile['nginx_proxy_buffering'])};
+    proxy_request_buffering {on_off(profile['nginx_proxy_request_buffering'])};
+
+    location / {{
+        proxy_set_header Host $host;
+{proxy_settings(profile)}
+        proxy_set_header Connection "";
+        proxy_pass http://storage-api;
+    }}
+}}
+"""
+    return site
+
+def render_minio_service(profile):
+    """/etc/systemd/system/minio.service"""
+    return f"""[Unit]
+Description=MinIO
+Documentation=https://docs.min.io
+Wants=network-online.target
+After=network-online.target
+AssertFileIsExecutable=/usr/local/bin/minio
+
+[Service]
+WorkingDirectory=/usr/local/
+User=minio-user
+Group=minio-user
+ProtectProc=invisible
+EnvironmentFile=/etc/default/minio
+ExecStartPre=/bin/bash -c "if [ -z \\"${{MINIO_VOLUMES}}\\" ]; then echo \\"Variable MINIO_VOLUMES not set\\"; exit 1; fi"
+ExecStart=/usr/local/bin/minio server $MINIO_OPTS $MINIO_VOLUMES
+Restart=always
+StandardOutput=journal
+StandardError=inherit
+LimitNOFILE={profile['minio_limit_nofile']}
+TasksMax=infinity
+TimeoutStopSec=infinity
+SendSIGKILL=no
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+def render_storage_api_service(profile, user="ubuntu", home=None):
+    """/etc/systemd/system/storage-api@.service; the instance name is the worker's port
+
+    The worker runs as user from home/storage-api (default: /home/<user>),
+    where the bundle and the .env file with the MinIO settings are
+    installed; PORT comes from the instance.
+    """
+    home = f"{home or f'/home/{user}'}/storage-api"
+    heap = f"--max-old-space-size={profile['api_max_old_space_mb']} " if profile['api_max_old_space_mb'] else ""
+    return f"""[Unit]
+Description=Storage API worker on port %i
+After=network.target minio.service
+
+[Service]
+Type=simple
+User={user}
+WorkingDirectory={home}
+EnvironmentFile={home}/.env
+Environment=NODE_ENV=production
+Environment=PORT=%i
+Environment=UV_THREADPOOL_SIZE={profile['api_uv_threadpool_size']}
+ExecStart=/usr/bin/node {heap}server.js
+Restart=on-failure
+RestartSec=2
+LimitNOFILE={profile['api_limit_nofile']}
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+def render_configs(profile, nodes=("localhost",)):
+    """{path on the host: content} of every file the profile controls"""
+    return {
+        "/etc/nginx/nginx.conf": render_nginx_conf(profile),
+        "/etc/nginx/sites-available/minio": render_nginx_site(profile, nodes),
+        "/etc/systemd/system/minio.service": render_minio_service(profile),
+        "/etc/systemd/system/storage-api@.service": render_storage_api_service(profile),
+    }
+
+# Minimal mime.types for validating on a machine without nginx's own
+MIME_TYPES = """types {
+    text/html html;
+    application/octet-stream bin;
+}
+"""
+
+def validate_nginx(profile, node_count=1, nginx="nginx"):
+    """('ok' | 'failed' | 'skipped', output) of nginx -t on a scratch copy of the configuration
+
+    Upstream names must resolve when nginx loads its configuration, so the
+    nodes are stood in for by loopback addresses.
+    """
+    command = shlex.split(nginx)
+    if not shutil.which(command[0]):
+        return 'skipped', f"{command[0]} is not installed"
+    nodes = [f"127.0.0.{index}" for index in range(1, node_count + 1)]
+    with tempfile.TemporaryDirectory(prefix="nginx-profile-") as conf_dir:
+        for directory in ("modules-enabled", "conf.d", "sites-enabled", "logs"):
+            os.makedirs(os.path.join(conf_dir, directory))
+        files = {
+            "nginx.conf": render_nginx_conf(
+                profile, user=None, conf_dir=conf_dir, pid=f"{conf_dir}/nginx.pid", log_dir=f"{conf_dir}/logs"
+            ),
+            "sites-enabled/minio": render_nginx_site(profile, nodes),
+            "mime.types": MIME_TYPES,
+        }
+        for name, content in files.items():
+            with open(os.path.join(conf_dir, name), 'w') as f:
+                f.write(content)
+        result = subprocess.run(
+            command + ["-t", "-p", conf_dir, "-e", f"{conf_dir}/logs/error.log", "-c", f"{conf_dir}/nginx.conf"],
+            capture_output=True, text=True
+        )
+    output = (result.stdout + result.stderr).strip()
+    return ('ok' if result.returncode == 0 else 'failed'), output
+
+def validate_units(profile, systemd_analyze="systemd-analyze"):
+    """('ok' | 'failed' | 'skipped', output) of systemd-analyze verify on the units
+
+    A missing ExecStart binary is expected on a machine that does not run the
+    service, so those complaints do not fail the check.
+    """
+    command = shlex.split(systemd_analyze)
+    if not shutil.which(command[0]):
+        return 'skipped', f"{command[0]} is not installed"
+    with tempfile.TemporaryDirectory(prefix="units-profile-") as unit_dir:
+        units = {
+            "minio.service": render_minio_service(profile),
+            "storage-api@.service": render_storage_api_service(profile),
+        }
+        for name, content in units.items():
+            with open(os.path.join(unit_dir, name), 'w') as f:
+                f.write(content)
+        instances = [os.path.join(unit_dir, f"storage-api@{port}.service") for port in api_ports(profile)]
+        result = subprocess.run(
+            command + ["verify", "--man=no", "--generators=no", os.path.join(unit_dir, "minio.service")] + instances,
+            capture_output=True, text=True
+        )
+    lines = [line for line in (result.stdout + result.stderr).splitlines() if line.strip()]
+    problems = []
+    for line in lines:
+        missing = re.search(r"Command (\S+) is not executable", line)
+        if not (missing and not os.path.exists(missing.group(1))):
+            problems.append(line)
+    if problems or (result.returncode != 0 and not lines):
+        return 'failed', '\n'.join(problems)
+    return 'ok', '\n'.join(lines)
+
+def validate_profile(profile, node_count=1, nginx="nginx", systemd_analyze="systemd-analyze"):
+    """{'nginx -t': (status, output), 'systemd-analyze verify': (status, output)}"""
+    return {
+        "nginx -t": validate_nginx(profile, node_count, nginx),
+        "systemd-analyze verify": validate_units(profile, systemd_analyze),
+    }
+
+def print_validation(results):
+    """Print each check; returns False unless every check ran and passed"""
+    for check, (status, output) in results.items():
+        icon = {'ok': '✅', 'failed': '❌', 'skipped': '⚠️ '}[status]
+        print(f"{icon} {check}: {status}")
+        for line in output.splitlines():
+            print(f"    {line}")
+    return all(status == 'ok' for status, _ in results.values())
+
+def main():
+    parser = argparse.ArgumentParser(description="Render and validate the storage server performance profiles")
+    parser.add_argument('command', choices=['list', 'render', 'validate'])
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, help="profile name")
+    parser.add_argument('--set', action='append', default=[], metavar='KNOB=VALUE', help="override a knob")
+    parser.add_argument('--nodes', default='localhost', help="comma-separated MinIO nodes of the site")
+    parser.add_argument('--out', default='rendered', help="render: directory to write the files to")
+    parser.add_argument('--nginx', default='nginx', help="validate: nginx command, e.g. in a container")
+    parser.add_argument('--systemd-analyze', default='systemd-analyze', help="validate: systemd-analyze command")
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        knobs = list(PROFILES[DEFAULT_PROFILE])
+        print(f"{'knob':<32}" + ''.join(f"{name:>26}" for name in PROFILES))
+        for knob in knobs:
+            print(f"{knob:<32}" + ''.join(f"{str(profile[knob]):>26}" for profile in PROFILES.values()))
+        return
+
+    try:
+        profile = load_profile(args.profile, args.set)
+    except ValueError as e:
+        parser.error(str(e))
+    nodes = args.nodes.split(',')
+
+    if args.command == 'render':
+        for path, content in render_configs(profile, nodes).items():
+            target = os.path.join(args.out, path.lstrip('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'w') as f:
+                f.write(content)
+            print(f"📝 {target}")
+        return
+
+    print(f"🔎 Validating profile {args.profile}...")
+    if not print_validation(validate_profile(profile, len(nodes), args.nginx, args.systemd_analyze)):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()